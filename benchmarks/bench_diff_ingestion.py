@@ -0,0 +1,76 @@
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from unidiff import PatchSet
+
+from review_common.diff_stream import iter_file_lines, iter_patched_files
+
+FILE_TEMPLATE = """diff --git a/vendor/pkg{index}/module.py b/vendor/pkg{index}/module.py
+index 1234567..abcdefg 100644
+--- a/vendor/pkg{index}/module.py
++++ b/vendor/pkg{index}/module.py
+@@ -1,{lines} +1,{lines} @@
+{body}"""
+
+
+def write_synthetic_diff(path: str, size_mb: int, lines_per_file: int = 200):
+    body = "".join(
+        f"-value_{line} = {line}\n+value_{line} = {line + 1}\n" if line % 2 else f" unchanged_{line} = True\n"
+        for line in range(lines_per_file)
+    )
+    file_lines = sum(1 for line in range(lines_per_file) if line % 2 == 0) + lines_per_file // 2
+    target = size_mb * 1024 * 1024
+    written = 0
+    index = 0
+    with open(path, "w") as diff_file:
+        while written < target:
+            text = FILE_TEMPLATE.format(index=index, lines=file_lines, body=body)
+            diff_file.write(text)
+            written += len(text)
+            index += 1
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux and bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def ingest(mode: str, path: str):
+    start = time.perf_counter()
+    if mode == "patchset":
+        with open(path, "r") as diff_file:
+            patch = PatchSet(diff_file.read())
+        text = "\n".join([f"```diff\n{file}\n```" for file in patch])
+        files = len(patch)
+    else:
+        files = 0
+        total = 0
+        for file in iter_patched_files(iter_file_lines(path)):
+            files += 1
+            total += len(str(file))
+    elapsed = time.perf_counter() - start
+    print(f"{mode:>9}: {files} files in {elapsed:.2f}s, peak RSS {peak_rss_mb():.1f} MB")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--ingest":
+        ingest(sys.argv[2], sys.argv[3])
+        sys.exit(0)
+
+    sizes = [int(size) for size in sys.argv[1:]] or [16, 64]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size_mb in sizes:
+            path = os.path.join(tmp_dir, f"synthetic_{size_mb}mb.diff")
+            write_synthetic_diff(path, size_mb)
+            print(f"Diff of {size_mb} MB:")
+            # Each mode runs in its own process so peak RSS is not shared.
+            for mode in ("patchset", "stream"):
+                subprocess.run(
+                    [sys.executable, "-m", "benchmarks.bench_diff_ingestion", "--ingest", mode, path],
+                    check=True,
+                )
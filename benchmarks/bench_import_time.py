@@ -0,0 +1,61 @@
+import statistics
+import subprocess
+import sys
+import time
+
+ENTRY_POINTS = (
+    "code_reviewer.code_reviewer",
+    "code_reviewer.repo_reviewer",
+    "local_diff_reviewer.local_diff_reviewer",
+    "pull_request_reviewer.pull_request_reviewer",
+    "pull_request_reviewer.batch_reviewer",
+    "pull_request_reviewer.watcher",
+    "review_daemon.daemon",
+    "review_daemon.client",
+)
+
+# Dependencies that must only be imported once a review actually needs them.
+HEAVY_MODULES = ("openai", "requests", "urllib3", "markdown", "html2text", "unidiff", "bs4", "dotenv", "asyncio")
+
+
+def heavy_modules_loaded(module: str) -> list:
+    code = (
+        f"import sys, {module}; "
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    return [name for name in output.strip().split(",") if name]
+
+
+def import_time_us(module: str) -> int:
+    # The last line of -X importtime is the module itself, with its cumulative
+    # time (including everything it imports) in the second column.
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    return int(stderr.strip().splitlines()[-1].split("|")[1])
+
+
+def help_time(module: str, runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-m", module, "--help"], capture_output=True, check=True)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    baseline = help_time("json.tool", runs)
+    print(f"{'entry point':<45} {'import':>10} {'--help':>10}  heavy modules")
+    print(f"{'python -m json.tool --help (baseline)':<45} {'':>10} {baseline * 1000:>8.0f}ms")
+    for module in ENTRY_POINTS:
+        heavy = heavy_modules_loaded(module)
+        print(
+            f"{module:<45} {import_time_us(module) / 1000:>8.1f}ms {help_time(module, runs) * 1000:>8.0f}ms"
+            f"  {', '.join(heavy) or '-'}"
+        )
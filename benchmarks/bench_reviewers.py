@@ -0,0 +1,272 @@
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+from benchmarks.fake_servers import FakeGitHubServer, FakeOpenAIServer
+from code_reviewer.code_reviewer import CodeReviewer
+from local_diff_reviewer.local_diff_reviewer import LocalCodeReviewer
+from pull_request_reviewer.pull_request_reviewer import PRReviewer
+from review_common.compaction import DiffCompactor
+from review_common.github_client import GitHubClient
+from review_common.hedging import HedgedClient
+from review_common.openai_client import OpenAIClient
+
+SCENARIOS = ("code", "local", "pr")
+
+# Metrics compared against a baseline; higher values are worse for all of them.
+REGRESSION_METRICS = ("p50_ms", "p90_ms", "prompt_tokens", "peak_kb")
+
+FILE_TEMPLATE = """diff --git a/src/pkg{index}/module.py b/src/pkg{index}/module.py
+index 1234567..abcdefg 100644
+--- a/src/pkg{index}/module.py
++++ b/src/pkg{index}/module.py
+@@ -1,4 +1,4 @@
+-from legacy.helpers import retry
++from common.helpers import retry
+ import logging
+ import os
+ import sys
+@@ -11,{lines} +11,{lines} @@
+{body}"""
+
+
+def synthetic_diff(files: int, lines_per_file: int = 40) -> str:
+    # Every file repeats the same import change, as in a sweeping refactor, but
+    # the rest of each file's changes are its own.
+    def body(index: int) -> str:
+        return "".join(
+            f"-value_{index}_{line} = {line}\n+value_{index}_{line} = {line + 1}\n"
+            if line % 2
+            else f" unchanged_{line} = True\n"
+            for line in range(lines_per_file)
+        )
+
+    file_lines = sum(1 for line in range(lines_per_file) if line % 2 == 0) + lines_per_file // 2
+    return "".join(FILE_TEMPLATE.format(index=index, lines=file_lines, body=body(index)) for index in range(files))
+
+
+def synthetic_source(files: int, lines_per_file: int = 40) -> str:
+    # One function per file's worth of lines, so a large module has
+    # boundaries that --chunk-tokens can split it on.
+    def function(index: int) -> str:
+        body = "".join(f"    value_{line} = {line}\n" for line in range(lines_per_file - 2))
+        return f"def function_{index}():\n{body}    return value_0\n"
+
+    return "\n\n".join(function(index) for index in range(files))
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def build_scenario(
+    name: str,
+    size: int,
+    tmp_dir: str,
+    client: OpenAIClient,
+    github_server: FakeGitHubServer,
+    chunk_tokens: Optional[int],
+    max_workers: int,
+    stream: bool,
+    compactor: Optional[DiffCompactor] = None,
+) -> Callable[[], str]:
+    def ignore(line: str):
+        pass
+
+    if name == "code":
+        path = os.path.join(tmp_dir, f"module_{size}.py")
+        with open(path, "w") as source:
+            source.write(synthetic_source(size))
+        reviewer = CodeReviewer(client=client)
+        return lambda: reviewer.review_code_changes(
+            path,
+            "Benchmark change",
+            progress_callback=ignore,
+            stream=stream,
+            raw=True,
+            chunk_tokens=chunk_tokens,
+            max_workers=max_workers,
+        )
+
+    diff = synthetic_diff(size)
+    if name == "local":
+        path = os.path.join(tmp_dir, f"change_{size}.diff")
+        with open(path, "w") as diff_file:
+            diff_file.write(diff)
+        reviewer = LocalCodeReviewer(client=client, compactor=compactor)
+        return lambda: reviewer.review_code_changes(
+            path,
+            "Benchmark change",
+            progress_callback=ignore,
+            chunk_tokens=chunk_tokens,
+            max_workers=max_workers,
+            stream=stream,
+            raw=True,
+        )
+
+    pr_url = github_server.add_pull("bench/repo", size, diff)
+    reviewer = PRReviewer(
+        client=client,
+        github=GitHubClient(token="bench", api_url=github_server.url),
+        compactor=compactor,
+    )
+    return lambda: reviewer.review_pull_request(
+        pr_url,
+        progress_callback=ignore,
+        chunk_tokens=chunk_tokens,
+        max_workers=max_workers,
+        stream=stream,
+        raw=True,
+    )
+
+
+def measure(run: Callable[[], str], repeat: int, openai_server: FakeOpenAIServer, input_bytes: int) -> Dict:
+    # The first run pays for lazy imports and connection setup.
+    run()
+    openai_server.reset()
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        latencies.append(time.perf_counter() - start)
+    stats = dict(openai_server.stats)
+
+    # Allocation tracing slows everything down, so peak memory comes from a
+    # separate, untimed run.
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    total = sum(latencies)
+    return {
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 1),
+        "p90_ms": round(percentile(latencies, 0.9) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "reviews_per_s": round(repeat / total, 2),
+        "input_kb_per_s": round(input_bytes * repeat / total / 1024, 1),
+        "requests": stats.get("requests", 0) // repeat,
+        "rate_limited": stats.get("rate_limited", 0) // repeat,
+        "prompt_tokens": stats.get("prompt_tokens", 0) // repeat,
+        "completion_tokens": stats.get("completion_tokens", 0) // repeat,
+        "peak_kb": peak // 1024,
+    }
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float) -> List[str]:
+    regressions = []
+    for key, metrics in results.items():
+        previous = baseline.get(key)
+        if previous is None:
+            continue
+        for metric in REGRESSION_METRICS:
+            before, after = previous.get(metric), metrics.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            if change > tolerance:
+                regressions.append(f"{key} {metric}: {before} -> {after} ({change:+.0%})")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the reviewers end to end against local OpenAI and GitHub stand-ins."
+    )
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1, 10, 100], help="files per synthetic diff")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per scenario and size")
+    parser.add_argument("--chunk-tokens", type=int, default=4000, help="chunk budget per model request (0 disables)")
+    parser.add_argument("--max-workers", type=int, default=4)
+    parser.add_argument("--stream", action="store_true", help="request streamed completions")
+    parser.add_argument("--compact", action="store_true", help="compact diffs before they are sent")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake model latency before the first token, in seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=1000.0, help="fake model generation rate")
+    parser.add_argument("--completion-tokens", type=int, default=150, help="tokens in each fake review")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="answer every Nth model request with a 429")
+    parser.add_argument("--slow-every", type=int, default=0, help="stall every Nth model request")
+    parser.add_argument("--slow-latency", type=float, default=1.0, help="extra latency of a stalled request, in seconds")
+    parser.add_argument("--hedge", action="store_true", help="hedge slow model requests to a second client")
+    parser.add_argument(
+        "--hedge-delay", type=float, default=0.5, help="hedge delay until latency percentiles are known, in seconds"
+    )
+    parser.add_argument("--github-latency", type=float, default=0.01, help="fake GitHub latency, in seconds")
+    parser.add_argument("--json", dest="json_path", help="write the results to this file")
+    parser.add_argument("--baseline", help="results file from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression (default: 0.25)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.ERROR)
+
+    results = {}
+    openai_server = FakeOpenAIServer(
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens,
+        rate_limit_every=args.rate_limit_every,
+        slow_every=args.slow_every,
+        slow_latency=args.slow_latency,
+    )
+    with openai_server, FakeGitHubServer(latency=args.github_latency) as github_server:
+        client = OpenAIClient(api_key="bench", api_base=openai_server.api_base)
+        if args.hedge:
+            # Both backends are the same stand-in; stalls hit single requests,
+            # so a duplicate usually gets a fast answer.
+            client = HedgedClient(
+                client, hedge_delay=args.hedge_delay, api_key="bench", api_base=openai_server.api_base
+            )
+        header = (
+            f"{'scenario':<8} {'size':>5} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'reviews/s':>10} "
+            f"{'KB/s':>8} {'requests':>9} {'429s':>5} {'prompt tok':>11} {'peak KB':>9}"
+        )
+        print(header)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for name in args.scenarios:
+                for size in args.sizes:
+                    run = build_scenario(
+                        name,
+                        size,
+                        tmp_dir,
+                        client,
+                        github_server,
+                        args.chunk_tokens or None,
+                        args.max_workers,
+                        args.stream,
+                        DiffCompactor() if args.compact else None,
+                    )
+                    input_bytes = len(synthetic_source(size) if name == "code" else synthetic_diff(size))
+                    metrics = measure(run, args.repeat, openai_server, input_bytes)
+                    results[f"{name}/{size}"] = metrics
+                    print(
+                        f"{name:<8} {size:>5} {metrics['p50_ms']:>9} {metrics['p90_ms']:>9} "
+                        f"{metrics['p99_ms']:>9} {metrics['reviews_per_s']:>10} {metrics['input_kb_per_s']:>8} "
+                        f"{metrics['requests']:>9} {metrics['rate_limited']:>5} {metrics['prompt_tokens']:>11} "
+                        f"{metrics['peak_kb']:>9}"
+                    )
+
+    if args.hedge:
+        print(client.hedge_stats.summary())
+
+    if args.json_path:
+        with open(args.json_path, "w") as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+from typing import List, Optional
+
+from benchmarks.bench_reviewers import percentile
+from review_common.symbol_index import SymbolIndex
+
+MODULE_TEMPLATE = '''import os
+
+from pkg{other}.module{other} import helper_{other}_0
+
+
+class Service{index}:
+    """Coordinates the work of module {index}."""
+
+    def __init__(self, name: str, retries: int = 3):
+        self.name = name
+        self.retries = retries
+
+    def run(self, payload: dict) -> dict:
+        return {{"name": self.name, "value": helper_{index}_0(payload)}}
+{functions}
+'''
+
+FUNCTION_TEMPLATE = '''
+
+def helper_{index}_{number}(payload: dict, scale: int = {number}) -> int:
+    """Scales the payload size."""
+    total = len(payload) * scale
+    return helper_{other}_{next}(payload) + total if scale > 100 else total
+'''
+
+DIFF_TEMPLATE = """diff --git a/pkg{index}/module{index}.py b/pkg{index}/module{index}.py
+--- a/pkg{index}/module{index}.py
++++ b/pkg{index}/module{index}.py
+@@ -14,2 +14,3 @@
+     def run(self, payload: dict) -> dict:
+-        return {{"name": self.name, "value": helper_{index}_0(payload)}}
++        service = Service{other}(self.name)
++        return {{"name": self.name, "value": helper_{other}_1(service.run(payload))}}
+"""
+
+
+def write_repo(root: str, modules: int, functions: int):
+    for index in range(modules):
+        other = (index * 7 + 1) % modules
+        body = "".join(
+            FUNCTION_TEMPLATE.format(index=index, number=number, other=other, next=(number + 1) % functions)
+            for number in range(functions)
+        )
+        package = os.path.join(root, f"pkg{index}")
+        os.makedirs(package, exist_ok=True)
+        with open(os.path.join(package, "__init__.py"), "w"):
+            pass
+        with open(os.path.join(package, f"module{index}.py"), "w") as module:
+            module.write(MODULE_TEMPLATE.format(index=index, other=other, functions=body))
+
+
+def timed(label: str, function):
+    start = time.perf_counter()
+    result = function()
+    print(f"  {label:<28} {time.perf_counter() - start:>8.2f}s  {result.summary() if result else ''}")
+    return result
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark building and querying the symbol index.")
+    parser.add_argument("--modules", nargs="+", type=int, default=[1000, 5000], help="modules per synthetic repository")
+    parser.add_argument("--functions", type=int, default=20, help="functions per module")
+    parser.add_argument("--changed", type=float, default=0.01, help="share of modules edited before the incremental update")
+    parser.add_argument("--lookups", type=int, default=200, help="diffs looked up per repository")
+    args = parser.parse_args(argv)
+
+    for modules in args.modules:
+        with tempfile.TemporaryDirectory() as root, tempfile.TemporaryDirectory() as index_dir:
+            write_repo(root, modules, args.functions)
+            print(f"{modules} modules, {modules * (args.functions + 3)} definitions:")
+            index = SymbolIndex(root, index_dir)
+            timed("cold build", index.update)
+            timed("warm update, nothing changed", index.update)
+
+            # Touching a file changes its mtime but not its hash; editing it
+            # changes both.
+            rng = random.Random(modules)
+            changed = rng.sample(range(modules), max(1, int(modules * args.changed)))
+            for number in changed[: len(changed) // 2]:
+                os.utime(os.path.join(root, f"pkg{number}", f"module{number}.py"))
+            for number in changed[len(changed) // 2 :]:
+                with open(os.path.join(root, f"pkg{number}", f"module{number}.py"), "a") as module:
+                    module.write("\n\ndef added() -> None:\n    pass\n")
+            timed(f"update after {len(changed)} edits", index.update)
+
+            latencies = []
+            for _ in range(args.lookups):
+                number = rng.randrange(modules)
+                diff = DIFF_TEMPLATE.format(index=number, other=(number + 3) % modules)
+                start = time.perf_counter()
+                index.context_for_diff(diff)
+                latencies.append(time.perf_counter() - start)
+            print(
+                f"  {'lookup':<28} p50 {percentile(latencies, 0.5) * 1000:.1f}ms, "
+                f"p99 {percentile(latencies, 0.99) * 1000:.1f}ms"
+            )
+            print(f"  {index.stats.summary()}")
+            print(f"  index size {os.path.getsize(index.path) / 1024 / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
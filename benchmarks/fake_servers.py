@@ -0,0 +1,292 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Type
+from urllib.parse import parse_qs, urlsplit
+
+from review_common.chunking import estimate_tokens
+
+RE_PULL = re.compile(r"^/repos/([^/]+)/([^/]+)/pulls/(\d+)$")
+RE_DIFF = re.compile(r"^/([^/]+)/([^/]+)/pull/(\d+)\.diff$")
+RE_PULLS = re.compile(r"^/repos/([^/]+)/([^/]+)/pulls$")
+RE_PULL_LIST = re.compile(r"^/repos/([^/]+)/([^/]+)/pulls/(\d+)/(comments|reviews)$")
+
+REVIEW_LINE = "- Consider handling the error returned by this call.\n"
+
+
+class FakeServer(ABC):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats: Dict[str, int] = {}
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @abstractmethod
+    def handler(self) -> Type[BaseHTTPRequestHandler]:
+        pass
+
+    def count(self, name: str, amount: int = 1):
+        with self.lock:
+            self.stats[name] = self.stats.get(name, 0) + amount
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def __enter__(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class QuietHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status: int, body: bytes, content_type: str, headers: Optional[dict] = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeOpenAIServer(FakeServer):
+    def __init__(
+        self,
+        latency: float = 0.05,
+        tokens_per_second: float = 1000.0,
+        completion_tokens: int = 150,
+        rate_limit_every: int = 0,
+        retry_after: float = 0.05,
+        slow_every: int = 0,
+        slow_latency: float = 1.0,
+    ):
+        super().__init__()
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        # Every slow_every-th request stalls, to give the latency a tail.
+        self.slow_every = slow_every
+        self.slow_latency = slow_latency
+        self._requests = 0
+
+    @property
+    def api_base(self) -> str:
+        return f"{self.url}/v1"
+
+    def completion_lines(self):
+        lines = []
+        tokens = 0
+        while tokens < self.completion_tokens:
+            lines.append(REVIEW_LINE)
+            tokens += estimate_tokens(REVIEW_LINE)
+        return lines
+
+    def handler(self):
+        fake = self
+
+        class Handler(QuietHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with fake.lock:
+                    fake._requests += 1
+                    number = fake._requests
+                fake.count("requests")
+                if fake.rate_limit_every and number % fake.rate_limit_every == 0:
+                    fake.count("rate_limited")
+                    error = {"error": {"message": "Rate limit reached", "type": "requests", "code": None}}
+                    self.send_body(
+                        429,
+                        json.dumps(error).encode(),
+                        "application/json",
+                        {"Retry-After": str(fake.retry_after)},
+                    )
+                    return
+
+                prompt_tokens = sum(estimate_tokens(message["content"]) for message in body["messages"])
+                lines = fake.completion_lines()
+                completion_tokens = sum(estimate_tokens(line) for line in lines)
+                fake.count("prompt_tokens", prompt_tokens)
+                fake.count("completion_tokens", completion_tokens)
+                time.sleep(fake.latency)
+                if fake.slow_every and number % fake.slow_every == 0:
+                    fake.count("slow")
+                    time.sleep(fake.slow_latency)
+                if body.get("stream"):
+                    self.stream_completion(body["model"], lines)
+                    return
+
+                time.sleep(completion_tokens / fake.tokens_per_second)
+                response = {
+                    "id": f"chatcmpl-{number}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body["model"],
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": "".join(lines)},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": prompt_tokens + completion_tokens,
+                    },
+                }
+                self.send_body(200, json.dumps(response).encode(), "application/json")
+
+            def stream_completion(self, model: str, lines):
+                # HTTP/1.0 closes the connection after the response, which
+                # ends the event stream without chunked encoding.
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                try:
+                    for line in lines:
+                        time.sleep(estimate_tokens(line) / fake.tokens_per_second)
+                        chunk = {
+                            "object": "chat.completion.chunk",
+                            "model": model,
+                            "choices": [{"index": 0, "delta": {"content": line}, "finish_reason": None}],
+                        }
+                        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                        self.wfile.flush()
+                    self.wfile.write(b"data: [DONE]\n\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client closed the stream before the reply was done.
+                    fake.count("aborted")
+
+        return Handler
+
+
+class FakeGitHubServer(FakeServer):
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.diffs: Dict[str, str] = {}
+        self.reviews: Dict[str, List[dict]] = {}
+        self.comments: Dict[str, List[dict]] = {}
+        self._next_id = 0
+
+    def add_pull(self, repo_name: str, number: int, diff: str) -> str:
+        # Adding a pull request again replaces its diff, as a push would.
+        self.diffs[f"{repo_name}/{number}"] = diff
+        return f"https://github.com/{repo_name}/pull/{number}"
+
+    def close_pull(self, repo_name: str, number: int):
+        self.diffs.pop(f"{repo_name}/{number}", None)
+
+    def pull_json(self, owner: str, repo: str, number: str) -> dict:
+        text = self.diffs[f"{owner}/{repo}/{number}"]
+        return {
+            "number": int(number),
+            "title": f"Synthetic change {number}",
+            "body": "Generated for the reviewer benchmarks.",
+            "html_url": f"https://github.com/{owner}/{repo}/pull/{number}",
+            "diff_url": f"{self.url}/{owner}/{repo}/pull/{number}.diff",
+            "head": {"sha": hashlib.sha1(text.encode()).hexdigest()},
+        }
+
+    def handler(self):
+        fake = self
+
+        class Handler(QuietHandler):
+            def do_GET(self):
+                fake.count("requests")
+                time.sleep(fake.latency)
+                url = urlsplit(self.path)
+                listing = RE_PULL_LIST.match(url.path)
+                if listing:
+                    self.send_page(listing, parse_qs(url.query))
+                    return
+                pulls = RE_PULLS.match(url.path)
+                if pulls:
+                    self.send_pulls(*pulls.groups(), parse_qs(url.query))
+                    return
+                pull = RE_PULL.match(self.path)
+                diff = RE_DIFF.match(self.path)
+                match = pull or diff
+                key = f"{match.group(1)}/{match.group(2)}/{match.group(3)}" if match else None
+                if key not in fake.diffs:
+                    self.send_body(404, b'{"message": "Not Found"}', "application/json")
+                    return
+
+                text = fake.diffs[key]
+                if diff or "diff" in self.headers.get("Accept", ""):
+                    body = text.encode()
+                    fake.count("diff_bytes", len(body))
+                    self.send_body(200, body, "text/plain; charset=utf-8")
+                    return
+
+                self.send_body(200, json.dumps(fake.pull_json(*match.groups())).encode(), "application/json")
+
+            def send_pulls(self, owner, repo, query):
+                prefix = f"{owner}/{repo}/"
+                numbers = sorted(int(key[len(prefix) :]) for key in list(fake.diffs) if key.startswith(prefix))
+                per_page = int(query.get("per_page", ["30"])[0])
+                page = int(query.get("page", ["1"])[0])
+                numbers = numbers[(page - 1) * per_page : page * per_page]
+                body = json.dumps([fake.pull_json(owner, repo, str(number)) for number in numbers]).encode()
+                etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    fake.count("not_modified")
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                self.send_body(200, body, "application/json", {"ETag": etag})
+
+            def send_page(self, match, query):
+                owner, repo, number, kind = match.groups()
+                items = getattr(fake, kind).get(f"{owner}/{repo}/{number}", [])
+                per_page = int(query.get("per_page", ["30"])[0])
+                page = int(query.get("page", ["1"])[0])
+                batch = items[(page - 1) * per_page : page * per_page]
+                self.send_body(200, json.dumps(batch).encode(), "application/json")
+
+            def do_POST(self):
+                fake.count("requests")
+                match = RE_PULL_LIST.match(self.path)
+                key = "/".join(match.groups()[:3]) if match and match.group(4) == "reviews" else None
+                if key not in fake.diffs:
+                    self.send_body(404, b'{"message": "Not Found"}', "application/json")
+                    return
+
+                payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with fake.lock:
+                    fake._next_id += 1
+                    review = {
+                        "id": fake._next_id,
+                        "body": payload.get("body", ""),
+                        "commit_id": payload.get("commit_id"),
+                        "state": "COMMENTED",
+                    }
+                    fake.reviews.setdefault(key, []).append(review)
+                    for comment in payload.get("comments", []):
+                        fake._next_id += 1
+                        fake.comments.setdefault(key, []).append(
+                            dict(comment, id=fake._next_id, pull_request_review_id=review["id"])
+                        )
+                fake.count("reviews_posted")
+                self.send_body(200, json.dumps(review).encode(), "application/json")
+
+        return Handler
@@ -1,21 +1,41 @@
+import argparse
 import os
 import sys
-from typing import Callable
+from functools import partial
+from typing import Callable, List, Optional
 
-import openai
 import logging
-from dotenv import load_dotenv
-from html2text import html2text
-from markdown import markdown
 
-load_dotenv()
-logging.basicConfig(level=logging.INFO)
+from review_common.ast_chunking import AstChunker, CodeChunk, anchor_findings, is_python_file, render_chunk
+from review_common.chunking import DiffChunk, estimate_tokens, review_chunks
+from review_common.openai_client import ModelRequestError, OpenAIClient
+from review_common.rendering import OUTPUT_FORMATS, markdown_to_text, render_review
+from review_common.response_cache import ResponseCache
+
 logger = logging.getLogger(__name__)
 
+SYSTEM_PROMPT = """You are an AI language model designed to assist developers in reviewing code. Analyze the provided code and commit message carefully, and provide a comprehensive code review that includes:
+
+- Identifying potential bugs or issues in the code.
+- Pointing out any missed best-practices or areas for improvement.
+- Assessing whether the code achieves its intended purpose based on the provided context.
+- Focusing on significant concerns and avoiding minor nitpicks.
+- Presenting your feedback in a clear, concise, and organized manner using bullet points for multiple comments.
+- Suggesting security recommendations if applicable.
+
+Remember, your goal is to help the developer improve their code by providing constructive feedback and guidance."""
+
 
 class CodeReviewer:
-    def __init__(self):
+    def __init__(
+        self,
+        cache: Optional[ResponseCache] = None,
+        client: Optional[OpenAIClient] = None,
+        chunker: Optional[AstChunker] = None,
+    ):
         logging.info("Initializing CodeReviewer...")
+        self.client = client if client is not None else OpenAIClient(cache=cache)
+        self.chunker = chunker if chunker is not None else AstChunker()
 
     def message_reviewer(
         self,
@@ -24,39 +44,31 @@ class CodeReviewer:
         model="gpt-4",
         temperature=0.7,
         max_tokens=3000,
+        progress_callback: Optional[Callable[[str], None]] = None,
     ) -> str:
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": prompt},
-        ]
-
-        try:
-            response = openai.ChatCompletion.create(
-                model=model,
-                messages=messages,
-                temperature=temperature,
-                max_tokens=max_tokens,
-            )
-        except openai.Error as e:
-            logging.error(f"Error calling OpenAI API: {e}")
-            raise
-
-        return response.choices[0]['message']['content'].strip()
+        return self.client.chat(
+            system_prompt,
+            prompt,
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            progress_callback=progress_callback,
+        )
 
     def fetch_and_parse_code(self, code_file_path: str):
         try:
-            with open(code_file_path, 'r') as code_file:
-                code = code_file.read()
+            with self.client.instrumentation.span("read_file"):
+                with open(code_file_path, 'r') as code_file:
+                    code = code_file.read()
         except (IOError, OSError) as e:
             logging.error(f"Error reading file: {e}")
             raise
         return code
 
-    def review_code_changes(self, code_file_path: str, commit_message: str, progress_callback: Callable[[str], None] = print):
-        code = self.fetch_and_parse_code(code_file_path)
-        context_message = f"""The change has the following commit message: {commit_message}.
+    def build_context_message(self, commit_message: str, code: str, language: str = "python") -> str:
+        return f"""The change has the following commit message: {commit_message}.
 Here is the code:
-```python
+```{language}
 {code}
 ```
 
@@ -69,39 +81,142 @@ Your task is to:
 - Use bullet points if you have multiple comments.
 - Provide security recommendations if there are any."""
 
-        system_prompt = """You are an AI language model designed to assist developers in reviewing code. Analyze the provided code and commit message carefully, and provide a comprehensive code review that includes:
-
-- Identifying potential bugs or issues in the code.
-- Pointing out any missed best-practices or areas for improvement.
-- Assessing whether the code achieves its intended purpose based on the provided context.
-- Focusing on significant concerns and avoiding minor nitpicks.
-- Presenting your feedback in a clear, concise, and organized manner using bullet points for multiple comments.
-- Suggesting security recommendations if applicable.
+    def build_chunk_message(self, commit_message: str, path: str, chunk: CodeChunk, code: str) -> str:
+        return f"""The change has the following commit message: {commit_message}.
+Here is part of {path} ({', '.join(chunk.names)}, lines {chunk.start}-{chunk.end}). Every line starts with its line number in the file. Lines outside {chunk.start}-{chunk.end} are only shown for context.
+```python
+{code}
+```
 
-Remember, your goal is to help the developer improve their code by providing constructive feedback and guidance."""
+Your task is to:
+- Review lines {chunk.start}-{chunk.end} and provide feedback.
+- If there are any bugs, highlight them.
+- Provide details on missed use of best-practices.
+- Does the code do what it says in the commit messages?
+- Do not highlight minor issues and nitpicks.
+- Use bullet points if you have multiple comments, and cite line numbers as `{path}:<line>`.
+- Provide security recommendations if there are any."""
 
-    result = self.message_reviewer(
-        system_prompt=system_prompt, prompt=context_message
+    def review_code_chunks(
+        self,
+        path: str,
+        commit_message: str,
+        code: str,
+        chunks: List[CodeChunk],
+        max_workers: int = 4,
+    ) -> str:
+        with self.client.instrumentation.span("build_prompt", chunks=len(chunks)):
+            lines = code.splitlines()
+            prompts = []
+            for chunk in chunks:
+                prompt = self.build_chunk_message(commit_message, path, chunk, render_chunk(lines, chunk))
+                prompts.append(DiffChunk(chunk.names, prompt, estimate_tokens(prompt)))
+        results, stats = review_chunks(
+            prompts,
+            lambda prompt: self.message_reviewer(system_prompt=SYSTEM_PROMPT, prompt=prompt),
+            max_workers=max_workers,
+        )
+        logger.info(stats.summary())
+
+        sections = []
+        for index, (chunk, result) in enumerate(zip(chunks, results)):
+            heading = f"### Part {index + 1}/{len(chunks)}: lines {chunk.start}-{chunk.end} ({', '.join(chunk.names)})"
+            if result:
+                body = anchor_findings(result, path, chunk.start)
+            else:
+                body = "_No review was returned for this part._"
+            sections.append(f"{heading}\n\n{body}")
+        return "\n\n".join(sections)
+
+    def review_code_changes(
+        self,
+        code_file_path: str,
+        commit_message: str,
+        progress_callback: Callable[[str], None] = print,
+        stream: bool = False,
+        raw: bool = False,
+        chunk_tokens: Optional[int] = None,
+        max_workers: int = 4,
+    ):
+        instrumentation = self.client.instrumentation
+        code = self.fetch_and_parse_code(code_file_path)
+        chunks = None
+        # Large Python files are split along function and class boundaries.
+        if chunk_tokens and is_python_file(code_file_path) and estimate_tokens(code) > chunk_tokens:
+            with instrumentation.span("parse_code"):
+                chunks = self.chunker.plan(code_file_path, code, chunk_tokens)
+        if chunks and len(chunks) > 1:
+            result = self.review_code_chunks(code_file_path, commit_message, code, chunks, max_workers)
+        else:
+            with instrumentation.span("build_prompt"):
+                prompt = self.build_context_message(commit_message, code)
+            result = self.message_reviewer(
+                system_prompt=SYSTEM_PROMPT,
+                prompt=prompt,
+                progress_callback=progress_callback if stream else None,
+            )
+        if raw:
+            return result
+        with instrumentation.span("render"):
+            result_text = markdown_to_text(result)
+        print("\nCode Review Results:\n", result_text)
+        return result_text
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Review a single code file with GPT-4.")
+    parser.add_argument("code_file_path", help="path to the code file to review")
+    parser.add_argument("commit_message", help="commit message describing the change")
+    parser.add_argument(
+        "--format",
+        choices=OUTPUT_FORMATS,
+        default=os.getenv("REVIEW_OUTPUT_FORMAT", "text"),
+        help="output format (default: text)",
     )
-    result_html = markdown(result)
-    result_text = html2text(result_html).strip()
-    print("\nCode Review Results:\n", result_text)
+    args = parser.parse_args(argv)
 
-if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python code_reviewer.py [code_file_path] [commit_message]")
-        sys.exit(1)
+    from dotenv import load_dotenv
 
-    code_file_path = sys.argv[1]
-    commit_message = sys.argv[2]
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
 
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
     if not OPENAI_API_KEY:
         print("Please set the OPENAI_API_KEY environment variable.")
         sys.exit(1)
 
-    openai.api_key = OPENAI_API_KEY
+    chunk_tokens = int(os.getenv("REVIEW_CHUNK_TOKENS", "0")) or None
+    max_workers = int(os.getenv("REVIEW_MAX_WORKERS", "4"))
+
+    cache = ResponseCache.from_env()
+    code_review_assistant = CodeReviewer(client=OpenAIClient.from_env(cache=cache), chunker=AstChunker.from_env())
+    try:
+        if args.format == "text":
+            code_review_assistant.review_code_changes(
+                args.code_file_path,
+                args.commit_message,
+                stream=os.getenv("REVIEW_STREAM", "0") == "1",
+                chunk_tokens=chunk_tokens,
+                max_workers=max_workers,
+            )
+        else:
+            result = code_review_assistant.review_code_changes(
+                args.code_file_path,
+                args.commit_message,
+                progress_callback=partial(print, file=sys.stderr),
+                stream=os.getenv("REVIEW_STREAM", "0") == "1",
+                raw=True,
+                chunk_tokens=chunk_tokens,
+                max_workers=max_workers,
+            )
+            render_review(args.format, sys.stdout, args.code_file_path, result, args.code_file_path)
+    except ModelRequestError as e:
+        print(e)
+        sys.exit(1)
+    if cache is not None:
+        logger.info(f"Response cache: {cache.hits} hit(s), {cache.misses} miss(es)")
+    logger.info(code_review_assistant.client.usage_summary())
 
-    code_review_assistant = CodeReviewer()
-    code_review_assistant.review_code_changes(code_file_path, commit_message)
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+import argparse
+import glob
+import hashlib
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+import logging
+
+from code_reviewer.code_reviewer import SYSTEM_PROMPT, CodeReviewer
+from review_common.openai_client import OpenAIClient
+from review_common.rendering import OUTPUT_FORMATS, ReviewRenderer, make_renderer
+from review_common.response_cache import ResponseCache
+from review_common.triage import GENERATED_MARKER, GENERATED_MARKER_LINES, DiffTriage, is_minified
+
+logger = logging.getLogger(__name__)
+
+# File extensions that are reviewed, and the language used for their code fence.
+LANGUAGES = {
+    ".py": "python",
+    ".js": "javascript",
+    ".jsx": "jsx",
+    ".ts": "typescript",
+    ".tsx": "tsx",
+    ".go": "go",
+    ".java": "java",
+    ".kt": "kotlin",
+    ".scala": "scala",
+    ".rb": "ruby",
+    ".php": "php",
+    ".rs": "rust",
+    ".c": "c",
+    ".h": "c",
+    ".cc": "cpp",
+    ".cpp": "cpp",
+    ".hpp": "cpp",
+    ".cs": "csharp",
+    ".swift": "swift",
+    ".m": "objectivec",
+    ".sh": "bash",
+    ".sql": "sql",
+}
+
+# Directories that never hold reviewable source; they are pruned from the walk
+# instead of being listed and excluded file by file.
+SKIPPED_DIRS = {
+    ".git",
+    ".hg",
+    ".svn",
+    ".tox",
+    ".venv",
+    "venv",
+    "__pycache__",
+    ".mypy_cache",
+    ".pytest_cache",
+    "node_modules",
+    "build",
+    "dist",
+}
+
+DEFAULT_MAX_BYTES = 100_000
+# Files with a NUL byte in their first block are treated as binary.
+BINARY_SNIFF_BYTES = 8192
+DEFAULT_MESSAGE = "Review of the existing code"
+
+
+class SourceFile(NamedTuple):
+    path: str
+    digest: str
+    size: int
+
+
+class RepoReviewStats:
+    def __init__(self):
+        self.files_found = 0
+        self.unique_files = 0
+        self.duplicates = 0
+        self.reviewed = 0
+        self.failed = 0
+        self.skipped = Counter()
+        self.elapsed = 0.0
+
+    def summary(self) -> str:
+        reasons = ", ".join(f"{reason}: {count}" for reason, count in self.skipped.most_common())
+        rate = self.reviewed / self.elapsed if self.elapsed else 0.0
+        return (
+            f"Found {self.files_found} file(s): reviewed {self.reviewed} unique file(s) "
+            f"({self.duplicates} duplicate(s) reused, {self.failed} failed) "
+            f"in {self.elapsed:.2f}s, {rate:.2f} files/s"
+            + (f"; skipped {sum(self.skipped.values())} [{reasons}]" if reasons else "")
+        )
+
+
+def iter_target_paths(targets: Iterable[str]) -> Iterator[str]:
+    for target in targets:
+        if os.path.isdir(target):
+            for root, dirs, files in os.walk(target):
+                dirs[:] = sorted(d for d in dirs if d not in SKIPPED_DIRS)
+                for name in sorted(files):
+                    yield os.path.join(root, name)
+        elif glob.has_magic(target):
+            yield from sorted(glob.glob(target, recursive=True))
+        else:
+            yield target
+
+
+def skip_reason(path: str, triage: DiffTriage, max_bytes: Optional[int]) -> Optional[str]:
+    if not os.path.isfile(path):
+        return "missing"
+    if triage.is_excluded(os.path.normpath(path)):
+        return "excluded"
+    if os.path.splitext(path)[1].lower() not in LANGUAGES:
+        return "type"
+    size = os.path.getsize(path)
+    if size == 0:
+        return "empty"
+    if max_bytes is not None and size > max_bytes:
+        return "too large"
+    return None
+
+
+def content_skip_reason(content: bytes, triage: DiffTriage) -> Optional[str]:
+    if b"\0" in content[:BINARY_SNIFF_BYTES]:
+        return "binary"
+    lines = content.splitlines()
+    if is_minified((len(line) for line in lines), triage.max_line_length):
+        return "minified"
+    if triage.detect_generated and any(
+        GENERATED_MARKER.search(line.decode("utf-8", "replace"))
+        for line in lines[:GENERATED_MARKER_LINES]
+    ):
+        return "generated"
+    return None
+
+
+def collect_source_files(
+    targets: Iterable[str],
+    triage: DiffTriage,
+    max_bytes: Optional[int],
+    stats: RepoReviewStats,
+) -> Dict[str, List[SourceFile]]:
+    by_digest: Dict[str, List[SourceFile]] = {}
+    seen = set()
+    for path in iter_target_paths(targets):
+        path = os.path.normpath(path)
+        if path in seen:
+            continue
+        seen.add(path)
+        stats.files_found += 1
+        reason = skip_reason(path, triage, max_bytes)
+        if reason is None:
+            try:
+                with open(path, "rb") as source:
+                    content = source.read()
+            except OSError as e:
+                logger.warning(f"Could not read {path}: {e}")
+                reason = "unreadable"
+            else:
+                reason = content_skip_reason(content, triage)
+        if reason is not None:
+            logger.debug(f"Skipping {path}: {reason}")
+            stats.skipped[reason] += 1
+            continue
+        digest = hashlib.sha256(content).hexdigest()
+        by_digest.setdefault(digest, []).append(SourceFile(path, digest, len(content)))
+    stats.unique_files = len(by_digest)
+    stats.duplicates = sum(len(files) - 1 for files in by_digest.values())
+    return by_digest
+
+
+def review_file(reviewer: CodeReviewer, path: str, commit_message: str) -> str:
+    code = reviewer.fetch_and_parse_code(path)
+    language = LANGUAGES[os.path.splitext(path)[1].lower()]
+    return reviewer.message_reviewer(
+        system_prompt=SYSTEM_PROMPT,
+        prompt=reviewer.build_context_message(commit_message, code, language),
+    )
+
+
+def review_repository(
+    targets: Iterable[str],
+    reviewer: CodeReviewer,
+    renderer: ReviewRenderer,
+    commit_message: str = DEFAULT_MESSAGE,
+    triage: Optional[DiffTriage] = None,
+    max_bytes: Optional[int] = DEFAULT_MAX_BYTES,
+    max_workers: int = 4,
+    progress_callback: Callable[[str], None] = print,
+) -> RepoReviewStats:
+    stats = RepoReviewStats()
+    start = time.perf_counter()
+    files = collect_source_files(targets, triage or DiffTriage(), max_bytes, stats)
+    progress_callback(
+        f"Reviewing {stats.unique_files} unique file(s) of {stats.files_found} found "
+        f"({stats.duplicates} duplicate(s), {sum(stats.skipped.values())} skipped)"
+    )
+
+    def review(group: List[SourceFile]):
+        started = time.perf_counter()
+        return review_file(reviewer, group[0].path, commit_message), time.perf_counter() - started
+
+    renderer.begin()
+    # File contents are read by the workers, so only paths and digests are held
+    # for files that are still waiting for a worker.
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {executor.submit(review, group): group for group in files.values()}
+        for done, future in enumerate(as_completed(futures), start=1):
+            group = futures[future]
+            try:
+                review_text, latency = future.result()
+            except Exception as e:
+                logger.error(f"Error reviewing {group[0].path}: {e}")
+                stats.failed += 1
+                for source in group:
+                    renderer.error(source.path, str(e) or type(e).__name__)
+                status = "failed"
+            else:
+                stats.reviewed += 1
+                # Identical copies share one review, reported under every path.
+                for source in group:
+                    renderer.write(source.path, review_text, default_path=source.path)
+                status = f"reviewed in {latency:.1f}s"
+            elapsed = time.perf_counter() - start
+            progress_callback(
+                f"[{done}/{len(futures)}] {group[0].path} {status} "
+                f"({stats.reviewed / elapsed:.2f} files/s)"
+            )
+    renderer.end()
+    stats.elapsed = time.perf_counter() - start
+    return stats
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Review every source file under one or more directories or glob patterns."
+    )
+    parser.add_argument("targets", nargs="+", help="directories, files or glob patterns (quote ** globs)")
+    parser.add_argument("-m", "--message", default=DEFAULT_MESSAGE, help="context passed to the model as the commit message")
+    parser.add_argument(
+        "--format",
+        choices=OUTPUT_FORMATS,
+        default=os.getenv("REVIEW_OUTPUT_FORMAT", "markdown"),
+        help="report format (default: markdown)",
+    )
+    parser.add_argument("-o", "--output", help="file to write the report to (default: stdout)")
+    parser.add_argument(
+        "--max-bytes",
+        type=int,
+        default=int(os.getenv("REVIEW_MAX_FILE_BYTES", str(DEFAULT_MAX_BYTES))),
+        help="skip files larger than this many bytes (0 disables the limit)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("REVIEW_MAX_WORKERS", "4")),
+        help="number of files reviewed concurrently",
+    )
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+    if not OPENAI_API_KEY:
+        print("Please set the OPENAI_API_KEY environment variable.")
+        sys.exit(1)
+
+    cache = ResponseCache.from_env()
+    reviewer = CodeReviewer(client=OpenAIClient.from_env(cache=cache))
+    output = open(args.output, "w") if args.output else sys.stdout
+    try:
+        stats = review_repository(
+            args.targets,
+            reviewer,
+            make_renderer(args.format, output),
+            commit_message=args.message,
+            triage=DiffTriage.from_env(),
+            max_bytes=args.max_bytes or None,
+            max_workers=args.workers,
+            progress_callback=partial(print, file=sys.stderr),
+        )
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    logger.info(stats.summary())
+    logger.info(reviewer.client.usage_summary())
+    if cache is not None:
+        logger.info(f"Response cache: {cache.hits} hit(s), {cache.misses} miss(es)")
+    if stats.failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
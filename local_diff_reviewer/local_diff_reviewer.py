@@ -1,22 +1,57 @@
+import argparse
 import os
 import sys
-from typing import Callable
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, List, Optional, Tuple
 
-import openai
 import logging
-from dotenv import load_dotenv
-from html2text import html2text
-from markdown import markdown
-from unidiff import PatchSet
 
-load_dotenv()
-logging.basicConfig(level=logging.INFO)
+from review_common.diff_stream import iter_file_lines, iter_patched_files
+from review_common.cascade import ModelCascade
+from review_common.chunking import format_code_change, iter_chunks, map_reduce_review
+from review_common.compaction import DiffCompactor
+from review_common.git_source import Commit, GitError, commit_diff_lines, list_commits, staged_diff_lines
+from review_common.openai_client import ModelRequestError, OpenAIClient
+from review_common.rendering import OUTPUT_FORMATS, make_renderer, markdown_to_text, render_review
+from review_common.response_cache import ResponseCache
+from review_common.symbol_index import SymbolIndex
+from review_common.triage import DiffTriage, TriageStats, skipped_section
+
+if TYPE_CHECKING:
+    from unidiff import PatchSet, PatchedFile
+
 logger = logging.getLogger(__name__)
 
+SYSTEM_PROMPT = """You are an AI language model designed to assist developers in reviewing code changes in a GitHub pull request. Analyze the provided code changes, title, and description carefully, and provide a comprehensive code review that includes:
+
+- Identifying potential bugs or issues in the code.
+- Pointing out any missed best-practices or areas for improvement.
+- Assessing whether the code achieves its intended purpose based on the provided context.
+- Focusing on significant concerns and avoiding minor nitpicks.
+- Presenting your feedback in a clear, concise, and organized manner using bullet points for multiple comments.
+- Suggesting security recommendations if applicable.
+
+Remember, your goal is to help the developer improve their code by providing constructive feedback and guidance."""
+
 
 class LocalCodeReviewer:
-    def __init__(self):
+    def __init__(
+        self,
+        cache: Optional[ResponseCache] = None,
+        triage: Optional[DiffTriage] = None,
+        client: Optional[OpenAIClient] = None,
+        compactor: Optional[DiffCompactor] = None,
+        cascade: Optional[ModelCascade] = None,
+        symbols: Optional[SymbolIndex] = None,
+    ):
         logger.info("Initializing LocalCodeReviewer...")
+        self.client = client if client is not None else OpenAIClient(cache=cache)
+        self.triage = triage if triage is not None else DiffTriage()
+        self.compactor = compactor
+        self.cascade = cascade
+        self.symbols = symbols
 
     def message_reviewer(
         self,
@@ -25,24 +60,16 @@ class LocalCodeReviewer:
         model="gpt-4",
         temperature=0.7,
         max_tokens=3000,
-    ):
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": prompt},
-        ]
-
-        try:
-            response = openai.ChatCompletion.create(
-                model=model,
-                messages=messages,
-                temperature=temperature,
-                max_tokens=max_tokens,
-            )
-        except openai.OpenAIError as e:
-            print(f"Error calling OpenAI API: {e}")
-            return ""
-
-        return response.choices[0]['message']['content'].strip()
+        progress_callback: Optional[Callable[[str], None]] = None,
+    ) -> str:
+        return self.client.chat(
+            system_prompt,
+            prompt,
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            progress_callback=progress_callback,
+        )
 
     def fetch_and_parse_diff(self, diff_path: str):
         try:
@@ -51,22 +78,42 @@ class LocalCodeReviewer:
         except IOError as e:
             logger.error(f"Error calling OpenAI API: {e}")
             sys.exit(1)
+        from unidiff import PatchSet
+
         patch = PatchSet(raw_diff)
         return patch
 
-    def prepare_code_changes_messages(self, patch: PatchSet):
-        code_changes = []
-        for file in patch:
-            if file.path != "package-lock.json":
-                code_changes.append(f"```diff\n{file}\n```")
-        return code_changes
+    def iter_diff_files(self, diff_path: str) -> Iterator["PatchedFile"]:
+        try:
+            lines = iter_file_lines(diff_path)
+        except IOError as e:
+            logger.error(f"Error reading diff file: {e}")
+            sys.exit(1)
+        return self.parse_diff_lines(lines)
 
-    def review_code_changes(self, diff_path: str, commit_message: str, progress_callback: Callable = print):
-        patch = self.fetch_and_parse_diff(diff_path)
-        code_changes_messages = self.prepare_code_changes_messages(patch)
+    def parse_diff_lines(self, lines: Iterable[str]) -> Iterator["PatchedFile"]:
+        return self.client.instrumentation.timed_iter("parse_diff", iter_patched_files(lines))
 
-        code_changes_text = "\n".join(code_changes_messages)
-        context_message = f"""The change has the following commit message: {commit_message}.
+    def select_files(
+        self, files: Iterable["PatchedFile"], stats: Optional[TriageStats] = None
+    ) -> Iterator["PatchedFile"]:
+        return self.triage.filter(files, stats)
+
+    def compact_files(self, files: Iterable["PatchedFile"], stats: Optional[TriageStats] = None) -> Iterator:
+        files = self.select_files(files, stats)
+        return files if self.compactor is None else self.compactor.compact(files)
+
+    def prepare_code_changes_messages(self, patch: "PatchSet"):
+        return [format_code_change(str(file)) for file in self.compact_files(patch)]
+
+    def add_symbol_context(self, code_changes_text: str) -> str:
+        if self.symbols is None:
+            return code_changes_text
+        context = self.symbols.context_for_diff(code_changes_text)
+        return f"{code_changes_text}\n\n{context}" if context else code_changes_text
+
+    def build_context_message(self, commit_message: str, code_changes_text: str) -> str:
+        return f"""The change has the following commit message: {commit_message}.
 Here are the code changes in unidiff format:
 {code_changes_text}
 
@@ -79,39 +126,245 @@ Your task is to:
 - Use bullet points if you have multiple comments.
 - Provide security recommendations if there are any."""
 
-        system_prompt = """You are an AI language model designed to assist developers in reviewing code changes in a GitHub pull request. Analyze the provided code changes, title, and description carefully, and provide a comprehensive code review that includes:
-
-- Identifying potential bugs or issues in the code.
-- Pointing out any missed best-practices or areas for improvement.
-- Assessing whether the code achieves its intended purpose based on the provided context.
-- Focusing on significant concerns and avoiding minor nitpicks.
-- Presenting your feedback in a clear, concise, and organized manner using bullet points for multiple comments.
-- Suggesting security recommendations if applicable.
-
-Remember, your goal is to help the developer improve their code by providing constructive feedback and guidance."""
+    def request_review(
+        self,
+        files: Iterable,
+        commit_message: str,
+        chunk_tokens: Optional[int] = None,
+        max_workers: int = 4,
+        progress_callback: Optional[Callable[[str], None]] = None,
+        model: str = "gpt-4",
+    ) -> str:
+        instrumentation = self.client.instrumentation
+        if chunk_tokens:
+            chunks = instrumentation.timed_iter("build_prompt", iter_chunks(files, chunk_tokens))
+            result, stats = map_reduce_review(
+                chunks,
+                lambda text: self.message_reviewer(
+                    system_prompt=SYSTEM_PROMPT,
+                    model=model,
+                    prompt=self.build_context_message(commit_message, self.add_symbol_context(text)),
+                ),
+                max_workers=max_workers,
+            )
+            logger.info(stats.summary())
+            return result
+        with instrumentation.span("build_prompt"):
+            code_changes_text = "\n".join(format_code_change(str(file)) for file in files)
+            prompt = self.build_context_message(commit_message, self.add_symbol_context(code_changes_text))
+        return self.message_reviewer(
+            system_prompt=SYSTEM_PROMPT,
+            prompt=prompt,
+            model=model,
+            progress_callback=progress_callback,
+        )
 
-        result = self.message_reviewer(
-            system_prompt=system_prompt, prompt=context_message
+    def review_code_changes(
+        self,
+        diff_path: str,
+        commit_message: str,
+        progress_callback: Callable = print,
+        chunk_tokens: Optional[int] = None,
+        max_workers: int = 4,
+        stream: bool = False,
+        raw: bool = False,
+    ):
+        return self.review_files(
+            self.iter_diff_files(diff_path),
+            commit_message,
+            progress_callback=progress_callback,
+            chunk_tokens=chunk_tokens,
+            max_workers=max_workers,
+            stream=stream,
+            raw=raw,
         )
-        result_html = markdown(result)
-        result_text = html2text(result_html).strip()
+
+    def review_files(
+        self,
+        files: Iterable["PatchedFile"],
+        commit_message: str,
+        progress_callback: Callable = print,
+        chunk_tokens: Optional[int] = None,
+        max_workers: int = 4,
+        stream: bool = False,
+        raw: bool = False,
+    ):
+        instrumentation = self.client.instrumentation
+        if self.symbols is not None:
+            self.symbols.refresh()
+        triage_stats = TriageStats()
+        files = self.compact_files(files, triage_stats)
+        progress_callback = progress_callback if stream else None
+        if self.cascade is not None:
+            result = self.cascade.review(
+                files,
+                commit_message,
+                lambda escalated: self.request_review(
+                    escalated, commit_message, chunk_tokens, max_workers, progress_callback,
+                    model=self.cascade.review_model,
+                ),
+            )
+        else:
+            result = self.request_review(files, commit_message, chunk_tokens, max_workers, progress_callback)
+        logger.info(triage_stats.summary())
+        if triage_stats.skipped:
+            result = "\n\n".join(section for section in (result, skipped_section(triage_stats.skipped)) if section)
+        if self.compactor is not None:
+            logger.info(self.compactor.stats.summary())
+        if self.cascade is not None:
+            logger.info(self.cascade.stats.summary())
+        if self.symbols is not None:
+            logger.info(self.symbols.stats.summary())
+        if raw:
+            return result
+        with instrumentation.span("render"):
+            result_text = markdown_to_text(result)
         print("\nCode Review Results:\n", result_text)
+        return result_text
 
+    def review_commits(
+        self,
+        commits: Iterable[Commit],
+        repo: str = ".",
+        chunk_tokens: Optional[int] = None,
+        max_workers: int = 4,
+        commit_workers: int = 2,
+    ) -> Iterator[Tuple[Commit, Optional[str], Optional[str]]]:
+        def review(commit: Commit) -> str:
+            files = self.parse_diff_lines(commit_diff_lines(commit.sha, repo))
+            return self.review_files(
+                files, commit.message, chunk_tokens=chunk_tokens, max_workers=max_workers, raw=True
+            )
 
-if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python local_code_reviewer.py [diff_file_path] [commit_message]")
-        sys.exit(1)
+        def outcome(commit: Commit, future) -> Tuple[Commit, Optional[str], Optional[str]]:
+            try:
+                return commit, future.result(), None
+            except Exception as e:
+                logger.error(f"Error reviewing {commit.sha[:7]}: {e}")
+                return commit, None, str(e) or type(e).__name__
+
+        # Several commits are in flight at once, so the next commit's diff is
+        # read and parsed while the model reviews the current one. Reviews are
+        # still yielded in commit order.
+        commit_workers = max(1, commit_workers)
+        with ThreadPoolExecutor(max_workers=commit_workers) as executor:
+            pending = deque()
+            for commit in commits:
+                pending.append((commit, executor.submit(review, commit)))
+                if len(pending) > commit_workers:
+                    yield outcome(*pending.popleft())
+            while pending:
+                yield outcome(*pending.popleft())
 
-    diff_file_path = sys.argv[1]
-    commit_message = sys.argv[2]
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Review the code changes in a local diff file or git repository with GPT-4."
+    )
+    parser.add_argument("diff_file_path", nargs="?", help="path to a unified diff file")
+    parser.add_argument("commit_message", nargs="?", help="commit message describing the change")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--rev", help="commit or revision range to review, e.g. HEAD or main..HEAD")
+    source.add_argument("--staged", action="store_true", help="review the changes staged for commit")
+    parser.add_argument("-m", "--message", default="Staged changes", help="commit message for --staged")
+    parser.add_argument("--repo", default=".", help="path to the git repository (default: .)")
+    parser.add_argument(
+        "--commit-workers",
+        type=int,
+        default=int(os.getenv("REVIEW_COMMIT_WORKERS", "2")),
+        help="commits of a range reviewed concurrently (default: 2)",
+    )
+    parser.add_argument(
+        "--format",
+        choices=OUTPUT_FORMATS,
+        default=os.getenv("REVIEW_OUTPUT_FORMAT", "text"),
+        help="output format (default: text)",
+    )
+    args = parser.parse_args(argv)
+    use_git = args.rev is not None or args.staged
+    if use_git and args.diff_file_path:
+        parser.error("a diff file cannot be combined with --rev or --staged")
+    if not use_git and not (args.diff_file_path and args.commit_message):
+        parser.error("a diff file and commit message, --rev or --staged is required")
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
 
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
     if not OPENAI_API_KEY:
         print("Please set the OPENAI_API_KEY environment variable.")
         sys.exit(1)
 
-    openai.api_key = OPENAI_API_KEY
+    chunk_tokens = int(os.getenv("REVIEW_CHUNK_TOKENS", "0")) or None
+    max_workers = int(os.getenv("REVIEW_MAX_WORKERS", "4"))
 
-    code_review_assistant = LocalCodeReviewer()
-    code_review_assistant.review_code_changes(diff_file_path, commit_message)
+    cache = ResponseCache.from_env()
+    client = OpenAIClient.from_env(cache=cache)
+    code_review_assistant = LocalCodeReviewer(
+        triage=DiffTriage.from_env(),
+        client=client,
+        compactor=DiffCompactor.from_env(),
+        cascade=ModelCascade.from_env(client),
+        symbols=SymbolIndex.from_env(args.repo),
+    )
+    failed = False
+    try:
+        if args.rev is not None:
+            renderer = make_renderer(args.format, sys.stdout)
+            renderer.begin()
+            for commit, review, error in code_review_assistant.review_commits(
+                list_commits(args.rev, args.repo),
+                repo=args.repo,
+                chunk_tokens=chunk_tokens,
+                max_workers=max_workers,
+                commit_workers=args.commit_workers,
+            ):
+                source = f"{commit.sha[:7]} {commit.subject}"
+                if error is None:
+                    renderer.write(source, review)
+                else:
+                    renderer.error(source, error)
+                    failed = True
+            renderer.end()
+        elif args.staged:
+            result = code_review_assistant.review_files(
+                code_review_assistant.parse_diff_lines(staged_diff_lines(args.repo)),
+                args.message,
+                chunk_tokens=chunk_tokens,
+                max_workers=max_workers,
+                raw=True,
+            )
+            render_review(args.format, sys.stdout, "staged changes", result)
+        elif args.format == "text":
+            code_review_assistant.review_code_changes(
+                args.diff_file_path,
+                args.commit_message,
+                chunk_tokens=chunk_tokens,
+                max_workers=max_workers,
+                stream=os.getenv("REVIEW_STREAM", "0") == "1",
+            )
+        else:
+            result = code_review_assistant.review_code_changes(
+                args.diff_file_path,
+                args.commit_message,
+                progress_callback=partial(print, file=sys.stderr),
+                chunk_tokens=chunk_tokens,
+                max_workers=max_workers,
+                stream=os.getenv("REVIEW_STREAM", "0") == "1",
+                raw=True,
+            )
+            render_review(args.format, sys.stdout, args.diff_file_path, result)
+    except (ModelRequestError, GitError) as e:
+        print(e)
+        sys.exit(1)
+    if cache is not None:
+        logger.info(f"Response cache: {cache.hits} hit(s), {cache.misses} miss(es)")
+    logger.info(code_review_assistant.client.usage_summary())
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import IO, Iterable, List, Optional
+
+import logging
+
+from pull_request_reviewer.pull_request_reviewer import PRReviewer
+from review_common.cascade import ModelCascade
+from review_common.compaction import DiffCompactor
+from review_common.github_client import GitHubClient
+from review_common.openai_client import OpenAIClient
+from review_common.rate_limit import RateLimiter
+from review_common.rendering import OUTPUT_FORMATS, make_renderer
+from review_common.response_cache import ResponseCache
+from review_common.symbol_index import SymbolIndex
+from review_common.triage import DiffTriage
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitedPRReviewer(PRReviewer):
+    def __init__(
+        self,
+        github_limiter: Optional[RateLimiter] = None,
+        cache: Optional[ResponseCache] = None,
+        github: Optional[GitHubClient] = None,
+        triage: Optional[DiffTriage] = None,
+        client: Optional[OpenAIClient] = None,
+        compactor: Optional[DiffCompactor] = None,
+        cascade: Optional[ModelCascade] = None,
+        symbols: Optional[SymbolIndex] = None,
+    ):
+        super().__init__(
+            cache=cache,
+            github=github,
+            triage=triage,
+            client=client,
+            compactor=compactor,
+            cascade=cascade,
+            symbols=symbols,
+        )
+        self.github_limiter = github_limiter
+
+    def extract_pr_info(self, pr_url: str):
+        if self.github_limiter is not None:
+            self.github_limiter.acquire()
+        return super().extract_pr_info(pr_url)
+
+    def fetch_and_parse_diff(self, diff_url: str):
+        if self.github_limiter is not None:
+            self.github_limiter.acquire()
+        return super().fetch_and_parse_diff(diff_url)
+
+
+def read_pr_urls(source: IO) -> List[str]:
+    urls = []
+    for line in source:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            urls.append(line)
+    return urls
+
+
+async def review_pull_requests(
+    pr_urls: Iterable[str],
+    output: IO,
+    reviewer: PRReviewer,
+    concurrency: int = 8,
+    chunk_tokens: Optional[int] = None,
+    output_format: Optional[str] = None,
+) -> dict:
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    counts = {"reviewed": 0, "failed": 0}
+    # Without an output format each pull request gets one summary record.
+    renderer = make_renderer(output_format, output) if output_format else None
+    if renderer is not None:
+        renderer.begin()
+
+    # The stages of one review run one after another, so one thread per
+    # in-flight review is enough; chunked reviews fan out on their own pool.
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+
+        def run(func, *args, **kwargs):
+            return loop.run_in_executor(executor, partial(func, *args, **kwargs))
+
+        async def review_one(pr_url: str):
+            async with semaphore:
+                start = time.perf_counter()
+                record = {"url": pr_url}
+                try:
+                    diff_url, description, title = await run(reviewer.extract_pr_info, pr_url)
+                    patch = await run(reviewer.fetch_and_parse_diff, diff_url)
+                    record["title"] = title
+                    record["review"] = await run(
+                        reviewer.review_patch,
+                        patch,
+                        title,
+                        description,
+                        chunk_tokens=chunk_tokens,
+                        raw=renderer is not None,
+                    )
+                    counts["reviewed"] += 1
+                except Exception as e:
+                    logger.error(f"Error reviewing {pr_url}: {e}")
+                    record["error"] = str(e) or type(e).__name__
+                    counts["failed"] += 1
+                record["elapsed"] = round(time.perf_counter() - start, 3)
+
+            # Results are written from the event loop thread as soon as each
+            # review finishes, so lines never interleave.
+            if renderer is None:
+                output.write(json.dumps(record) + "\n")
+                output.flush()
+            elif "error" in record:
+                renderer.error(pr_url, record["error"])
+            else:
+                renderer.write(pr_url, record["review"])
+
+        await asyncio.gather(*(review_one(pr_url) for pr_url in pr_urls))
+
+    if renderer is not None:
+        renderer.end()
+
+    return counts
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Review many GitHub pull requests concurrently.")
+    parser.add_argument("pr_url_file", help="file with one pull request URL per line, or - for stdin")
+    parser.add_argument("output_file", nargs="?", help="file to append results to (default: stdout)")
+    parser.add_argument(
+        "--format",
+        choices=OUTPUT_FORMATS,
+        default=os.getenv("REVIEW_OUTPUT_FORMAT"),
+        help="render reviews in this format instead of one JSON summary record per pull request",
+    )
+    args = parser.parse_args(argv)
+
+    import asyncio
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+    if not OPENAI_API_KEY:
+        print("Please set the OPENAI_API_KEY environment variable.")
+        sys.exit(1)
+
+    if args.pr_url_file == "-":
+        pr_urls = read_pr_urls(sys.stdin)
+    else:
+        with open(args.pr_url_file) as url_file:
+            pr_urls = read_pr_urls(url_file)
+
+    concurrency = int(os.getenv("REVIEW_BATCH_CONCURRENCY", "8"))
+    chunk_tokens = int(os.getenv("REVIEW_CHUNK_TOKENS", "0")) or None
+    client = OpenAIClient.from_env(cache=ResponseCache.from_env())
+    reviewer = RateLimitedPRReviewer(
+        github_limiter=RateLimiter(float(os.getenv("GITHUB_REQUESTS_PER_MINUTE", "60"))),
+        github=GitHubClient.from_env(pool_size=concurrency),
+        triage=DiffTriage.from_env(),
+        client=client,
+        compactor=DiffCompactor.from_env(),
+        cascade=ModelCascade.from_env(client),
+    )
+
+    output = open(args.output_file, "a") if args.output_file else sys.stdout
+    try:
+        counts = asyncio.run(
+            review_pull_requests(
+                pr_urls,
+                output,
+                reviewer,
+                concurrency=concurrency,
+                chunk_tokens=chunk_tokens,
+                output_format=args.format,
+            )
+        )
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    logger.info(f"Batch finished: {counts['reviewed']} reviewed, {counts['failed']} failed")
+    logger.info(reviewer.client.usage_summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,82 @@
+import argparse
 import os
 import sys
-from typing import Callable
+import threading
+from functools import partial
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
-import openai
-import requests
 import logging
-from bs4 import BeautifulSoup
-from dotenv import load_dotenv
-from html2text import html2text
-from markdown import markdown
-from unidiff import PatchSet
-from github import Github
-
-load_dotenv()
-logging.basicConfig(level=logging.INFO)
+
+from review_common.diff_stream import iter_patched_files
+from review_common.cascade import ModelCascade, RiskScore, format_verdict
+from review_common.chunking import (
+    DiffChunk,
+    estimate_tokens,
+    format_code_change,
+    iter_chunks,
+    map_reduce_review,
+    review_chunks,
+)
+from review_common.compaction import DiffCompactor
+from review_common.github_client import DIFF_MEDIA_TYPE, GitHubClient
+from review_common.github_review import DiffLineIndex, PostedReview, ReviewPostError, post_review
+from review_common.incremental import (
+    ReviewStateStore,
+    fingerprint_hunk,
+    merge_file_reviews,
+    plan_file_review,
+    with_hunks,
+)
+from review_common.openai_client import ModelRequestError, OpenAIClient
+from review_common.rendering import OUTPUT_FORMATS, markdown_to_text, render_review
+from review_common.response_cache import ResponseCache
+from review_common.symbol_index import SymbolIndex
+from review_common.triage import DiffTriage, TriageStats, skipped_section
+
+if TYPE_CHECKING:
+    from unidiff import PatchSet, PatchedFile
+
 logger = logging.getLogger(__name__)
 
+SYSTEM_PROMPT = """You are an AI language model designed to assist developers in reviewing code changes in a GitHub pull request. Analyze the provided code changes, title, and description carefully, and provide a comprehensive code review that includes:
+
+- Identifying potential bugs or issues in the code.
+- Pointing out any missed best-practices or areas for improvement.
+- Assessing whether the code achieves its intended purpose based on the provided context.
+- Focusing on significant concerns and avoiding minor nitpicks.
+- Presenting your feedback in a clear, concise, and organized manner using bullet points for multiple comments.
+- Suggesting security recommendations if applicable.
+
+Remember, your goal is to help the developer improve their code by providing constructive feedback and guidance."""
+
 class PRReviewer:
-    def __init__(self):
-        print("Initializing CodeReviewAssistant...")
+    def __init__(
+        self,
+        cache: Optional[ResponseCache] = None,
+        github: Optional[GitHubClient] = None,
+        triage: Optional[DiffTriage] = None,
+        client: Optional[OpenAIClient] = None,
+        compactor: Optional[DiffCompactor] = None,
+        cascade: Optional[ModelCascade] = None,
+        symbols: Optional[SymbolIndex] = None,
+    ):
+        logger.info("Initializing PRReviewer...")
+        self.client = client if client is not None else OpenAIClient(cache=cache)
+        self.triage = triage if triage is not None else DiffTriage()
+        self.compactor = compactor
+        self.cascade = cascade
+        self.symbols = symbols
+        self._github = github
+        self._github_lock = threading.Lock()
+
+    @property
+    def github(self) -> GitHubClient:
+        # Built on first use and then shared, so every metadata and diff fetch
+        # from this reviewer reuses the same pooled connections.
+        with self._github_lock:
+            if self._github is None:
+                self._github = GitHubClient.from_env()
+            return self._github
 
     def message_prreviewer(
         self,
@@ -27,59 +85,83 @@ class PRReviewer:
         model="gpt-4",
         temperature=0.7,
         max_tokens=3000,
+        progress_callback: Optional[Callable[[str], None]] = None,
+        cancelled: Optional[threading.Event] = None,
     ) -> str:
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": prompt},
-        ]
-
-        try:
-            response = openai.ChatCompletion.create(
-                model=model,
-                messages=messages,
-                temperature=temperature,
-                max_tokens=max_tokens,
-            )
-        except openai.Error as e:
-            logger.error(f"Error calling OpenAI API: {e}")
-            return ""
+        return self.client.chat(
+            system_prompt,
+            prompt,
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            progress_callback=progress_callback,
+            cancelled=cancelled,
+        )
 
-        return response.choices[0]['message']['content'].strip()
+    def fetch_pull_request(self, pr_url: str):
+        owner, repo, _, pr_id = pr_url.rstrip("/").split("/")[-4:]
+        with self.client.instrumentation.span("fetch_metadata"):
+            return self.github.get_pull(f"{owner}/{repo}", int(pr_id))
 
     def extract_pr_info(self, pr_url: str):
-        pr_id = int(pr_url.split('/')[-1])
-        repo_name = f"{pr_url.split('/')[-3]}/{pr_url.split('/')[-2]}"
-        gh = Github(os.getenv("GITHUB_TOKEN"))
-        repo = gh.get_repo(repo_name)
-        pr = repo.get_pull(pr_id)
+        pr = self.fetch_pull_request(pr_url)
 
-        diff_url = pr.diff_url
-        description = pr.body
-        title = pr.title
+        diff_url = pr["diff_url"]
+        description = pr["body"]
+        title = pr["title"]
 
         return diff_url, description, title
 
     def fetch_and_parse_diff(self, diff_url: str):
-        with requests.get(diff_url) as response:
-            raw_diff = response.text
-        patch = PatchSet(raw_diff)
+        instrumentation = self.client.instrumentation
+        with instrumentation.span("fetch_diff"):
+            raw_diff = self.github.get(diff_url, accept=DIFF_MEDIA_TYPE)
+        from unidiff import PatchSet
+
+        with instrumentation.span("parse_diff"):
+            patch = PatchSet(raw_diff)
         return patch
 
-    def prepare_code_changes_messages(self, patch: PatchSet):
-        code_changes = []
-        for file in patch:
-            if file.path != "package-lock.json":
-                code_changes.append(f"```diff\n{file}\n```")
-        return code_changes
+    def iter_diff_files(self, diff_url: str) -> Iterator["PatchedFile"]:
+        instrumentation = self.client.instrumentation
+        lines = instrumentation.timed_iter("fetch_diff", self.github.iter_lines(diff_url, accept=DIFF_MEDIA_TYPE))
+        return instrumentation.timed_iter("parse_diff", iter_patched_files(lines))
 
-    def review_pull_request(self, pr_url: str, progress_callback: Callable = print):
-        diff_url, description, title = self.extract_pr_info(pr_url)
+    def select_files(
+        self, files: Iterable["PatchedFile"], stats: Optional[TriageStats] = None
+    ) -> Iterator["PatchedFile"]:
+        return self.triage.filter(files, stats)
 
-        patch = self.fetch_and_parse_diff(diff_url)
-        code_changes_messages = self.prepare_code_changes_messages(patch)
+    def compact_files(self, files: Iterable["PatchedFile"], stats: Optional[TriageStats] = None) -> Iterator:
+        files = self.select_files(files, stats)
+        return files if self.compactor is None else self.compactor.compact(files)
 
-        code_changes_text = "\n".join(code_changes_messages)
-        context_message = f"""The change has the following title: {title}.
+    def prepare_code_changes_messages(self, patch: "PatchSet"):
+        return [format_code_change(str(file)) for file in self.compact_files(patch)]
+
+    def symbols_at(self, head_sha: Optional[str]) -> Optional[SymbolIndex]:
+        # The checkout only has the right definitions when it is at the head
+        # under review; at any other revision it could show code the pull
+        # request has changed, so the review goes without symbol context.
+        if self.symbols is None or head_sha is None:
+            return None
+        revision = self.symbols.revision()
+        if revision != head_sha:
+            logger.info(
+                f"Skipping symbol context: {self.symbols.root} is at {str(revision)[:7]}, not the head {head_sha[:7]}"
+            )
+            return None
+        self.symbols.refresh()
+        return self.symbols
+
+    def add_symbol_context(self, code_changes_text: str, symbols: Optional[SymbolIndex] = None) -> str:
+        if symbols is None:
+            return code_changes_text
+        context = symbols.context_for_diff(code_changes_text)
+        return f"{code_changes_text}\n\n{context}" if context else code_changes_text
+
+    def build_context_message(self, title: str, description: str, code_changes_text: str) -> str:
+        return f"""The change has the following title: {title}.
 {description}
 Here are the code changes in unidiff format:
 {code_changes_text}
@@ -93,30 +175,382 @@ Your task is to:
 - Use bullet points if you have multiple comments.
 - Provide security recommendations if there are any."""
 
-        system_prompt = """You are an AI language model designed to assist developers in reviewing code changes in a GitHub pull request. Analyze the provided code changes, title, and description carefully, and provide a comprehensive code review that includes:
+    def request_review(
+        self,
+        files: Iterable,
+        title: str,
+        description: str,
+        chunk_tokens: Optional[int] = None,
+        max_workers: int = 4,
+        progress_callback: Optional[Callable[[str], None]] = None,
+        model: str = "gpt-4",
+        cancelled: Optional[threading.Event] = None,
+        symbols: Optional[SymbolIndex] = None,
+    ) -> str:
+        instrumentation = self.client.instrumentation
+        if chunk_tokens:
+            chunks = instrumentation.timed_iter("build_prompt", iter_chunks(files, chunk_tokens))
+            result, stats = map_reduce_review(
+                chunks,
+                lambda text: self.message_prreviewer(
+                    system_prompt=SYSTEM_PROMPT,
+                    model=model,
+                    prompt=self.build_context_message(title, description, self.add_symbol_context(text, symbols)),
+                    cancelled=cancelled,
+                ),
+                max_workers=max_workers,
+            )
+            logger.info(stats.summary())
+            return result
+        with instrumentation.span("build_prompt"):
+            code_changes_text = "\n".join(format_code_change(str(file)) for file in files)
+            prompt = self.build_context_message(title, description, self.add_symbol_context(code_changes_text, symbols))
+        return self.message_prreviewer(
+            system_prompt=SYSTEM_PROMPT,
+            prompt=prompt,
+            model=model,
+            progress_callback=progress_callback,
+            cancelled=cancelled,
+        )
 
-- Identifying potential bugs or issues in the code.
-- Pointing out any missed best-practices or areas for improvement.
-- Assessing whether the code achieves its intended purpose based on the provided context.
-- Focusing on significant concerns and avoiding minor nitpicks.
-- Presenting your feedback in a clear, concise, and organized manner using bullet points for multiple comments.
-- Suggesting security recommendations if applicable.
+    def review_patch(
+        self,
+        patch: Iterable["PatchedFile"],
+        title: str,
+        description: str,
+        chunk_tokens: Optional[int] = None,
+        max_workers: int = 4,
+        progress_callback: Optional[Callable[[str], None]] = None,
+        raw: bool = False,
+        cancelled: Optional[threading.Event] = None,
+        head_sha: Optional[str] = None,
+    ) -> str:
+        # Setting cancelled stops the model calls in flight, for a review
+        # that has been superseded. Symbol context needs the head SHA.
+        instrumentation = self.client.instrumentation
+        symbols = self.symbols_at(head_sha)
+        triage_stats = TriageStats()
+        files = self.compact_files(patch, triage_stats)
+        if self.cascade is not None:
+            result = self.cascade.review(
+                files,
+                title,
+                lambda escalated: self.request_review(
+                    escalated, title, description, chunk_tokens, max_workers, progress_callback,
+                    model=self.cascade.review_model,
+                    cancelled=cancelled,
+                    symbols=symbols,
+                ),
+                cancelled=cancelled,
+            )
+        else:
+            result = self.request_review(
+                files, title, description, chunk_tokens, max_workers, progress_callback, cancelled=cancelled,
+                symbols=symbols,
+            )
+        logger.info(triage_stats.summary())
+        if triage_stats.skipped:
+            result = "\n\n".join(section for section in (result, skipped_section(triage_stats.skipped)) if section)
+        if self.compactor is not None:
+            logger.info(self.compactor.stats.summary())
+        if self.cascade is not None:
+            logger.info(self.cascade.stats.summary())
+        if symbols is not None:
+            logger.info(symbols.stats.summary())
+        if raw:
+            return result
+        with instrumentation.span("render"):
+            return markdown_to_text(result)
 
-Remember, your goal is to help the developer improve their code by providing constructive feedback and guidance."""
+    def review_pull_request_incrementally(
+        self,
+        pr_url: str,
+        state_store: ReviewStateStore,
+        max_workers: int = 4,
+        raw: bool = False,
+        chunk_tokens: Optional[int] = None,
+    ) -> str:
+        result = self.run_incremental_review(
+            pr_url, state_store, chunk_tokens=chunk_tokens, max_workers=max_workers
+        )["result"]
+        if raw:
+            return result
+        with self.client.instrumentation.span("render"):
+            return markdown_to_text(result)
+
+    def run_incremental_review(
+        self,
+        pr_url: str,
+        state_store: ReviewStateStore,
+        chunk_tokens: Optional[int] = None,
+        max_workers: int = 4,
+        pr: Optional[dict] = None,
+        patch: Optional[Iterable["PatchedFile"]] = None,
+    ) -> dict:
+        # Callers that already hold the pull request and its diff pass them in,
+        # so the review matches the head they act on.
+        if pr is None:
+            pr = self.fetch_pull_request(pr_url)
+        head_sha = pr["head"]["sha"]
+        state_key = "/".join(pr_url.rstrip("/").split("/")[-4:])
+        previous = state_store.load(state_key) or {}
+        if previous.get("head_sha") == head_sha:
+            logger.info(f"{state_key} was already reviewed at {head_sha[:7]}")
+            return previous
+
+        instrumentation = self.client.instrumentation
+        symbols = self.symbols_at(head_sha)
+        if patch is None:
+            patch = self.iter_diff_files(pr["diff_url"])
+        previous_files = previous.get("files", {})
+        files: Dict[str, dict] = {}
+        pending: Dict[str, List[str]] = {}
+        triage_stats = TriageStats()
+
+        def new_hunk_files() -> Iterator["PatchedFile"]:
+            # Only the hunks no earlier review covered go on to compaction,
+            # the cascade and chunking, as in a full review.
+            for file in self.select_files(patch, triage_stats):
+                plan = plan_file_review(file, previous_files.get(file.path))
+                files[file.path] = {"reviews": plan.carried_over}
+                if plan.new_hunks:
+                    pending[file.path] = [fingerprint_hunk(hunk) for hunk in plan.new_hunks]
+                    yield with_hunks(file, plan.new_hunks)
+
+        new_files = new_hunk_files()
+        if self.compactor is not None:
+            new_files = self.compactor.compact(new_files)
+        model = "gpt-4" if self.cascade is None else self.cascade.review_model
+        reviews: Dict[str, List[str]] = {}
+
+        def review_files(escalated: Iterable) -> str:
+            # Each chunk holds a single file, so every review is stored
+            # against the hunks it covered.
+            chunks = []
+            with instrumentation.span("build_prompt"):
+                for file in escalated:
+                    if chunk_tokens:
+                        chunks.extend(iter_chunks([file], chunk_tokens))
+                    else:
+                        message = format_code_change(str(file))
+                        chunks.append(DiffChunk([file.path], message, estimate_tokens(message)))
+            results, stats = review_chunks(
+                chunks,
+                lambda text: self.message_prreviewer(
+                    system_prompt=SYSTEM_PROMPT,
+                    model=model,
+                    prompt=self.build_context_message(pr["title"], pr["body"], self.add_symbol_context(text, symbols)),
+                ),
+                max_workers=max_workers,
+            )
+            logger.info(stats.summary())
+            for chunk, review in zip(chunks, results):
+                reviews.setdefault(chunk.paths[0], []).append(review)
+            return "\n\n".join(results)
+
+        if self.cascade is not None:
+            low_risk: List[Tuple[str, RiskScore]] = []
+            self.cascade.review_escalated(new_files, pr["title"], review_files, low_risk)
+            for path, score in low_risk:
+                reviews[path] = [f"- Low risk (triage only): {format_verdict(score)}"]
+        else:
+            review_files(new_files)
+        logger.info(triage_stats.summary())
+        if self.compactor is not None:
+            logger.info(self.compactor.stats.summary())
+        if self.cascade is not None:
+            logger.info(self.cascade.stats.summary())
+        logger.info(
+            f"Incremental review of {state_key}: {len(pending)} of {len(files)} file(s) "
+            f"have new hunks since {str(previous.get('head_sha'))[:7]}"
+        )
+
+        complete = True
+        for path, fingerprints in pending.items():
+            file_reviews = reviews.get(path)
+            # A file split into several chunks counts as reviewed only when
+            # every chunk came back.
+            if file_reviews and all(file_reviews):
+                files[path]["reviews"].append(
+                    {"hunks": fingerprints, "review": "\n\n".join(file_reviews), "head_sha": head_sha}
+                )
+            else:
+                complete = False
+
+        # A head SHA is only recorded once every file has a review, so files
+        # whose review failed are picked up again on the next run.
+        skipped = skipped_section(triage_stats.skipped) if triage_stats.skipped else ""
+        result = "\n\n".join(section for section in (merge_file_reviews(files, head_sha), skipped) if section)
+        state = {"head_sha": head_sha if complete else None, "files": files, "skipped": skipped, "result": result}
+        state_store.save(state_key, state)
+        return state
+
+    def review_pull_request(
+        self,
+        pr_url: str,
+        progress_callback: Callable = print,
+        chunk_tokens: Optional[int] = None,
+        max_workers: int = 4,
+        stream: bool = False,
+        state_store: Optional[ReviewStateStore] = None,
+        raw: bool = False,
+        post: bool = False,
+    ):
+        if post:
+            return self.review_and_post_pull_request(
+                pr_url,
+                progress_callback=progress_callback,
+                chunk_tokens=chunk_tokens,
+                max_workers=max_workers,
+                stream=stream,
+                state_store=state_store,
+                raw=raw,
+            )
+
+        if state_store is not None:
+            result_text = self.review_pull_request_incrementally(
+                pr_url, state_store, max_workers=max_workers, raw=raw, chunk_tokens=chunk_tokens
+            )
+            if not raw:
+                print("\nCode Review Results:\n", result_text)
+            return result_text
+
+        pr = self.fetch_pull_request(pr_url)
+
+        patch = self.iter_diff_files(pr["diff_url"])
 
-        result = self.message_prreviewer(
-            system_prompt=system_prompt, prompt=context_message
+        result_text = self.review_patch(
+            patch,
+            pr["title"],
+            pr["body"],
+            chunk_tokens=chunk_tokens,
+            max_workers=max_workers,
+            progress_callback=progress_callback if stream else None,
+            raw=raw,
+            head_sha=pr["head"]["sha"],
         )
-        result_html = markdown(result)
-        result_text = html2text(result_html).strip()
+        if not raw:
+            print("\nCode Review Results:\n", result_text)
+        return result_text
+
+    def review_and_post_pull_request(
+        self,
+        pr_url: str,
+        progress_callback: Callable = print,
+        chunk_tokens: Optional[int] = None,
+        max_workers: int = 4,
+        stream: bool = False,
+        state_store: Optional[ReviewStateStore] = None,
+        raw: bool = False,
+    ):
+        # The review is posted against the head SHA whose diff was reviewed,
+        # so the pull request and its diff are fetched once up front.
+        pr = self.fetch_pull_request(pr_url)
+        head_sha = pr["head"]["sha"]
+        index = DiffLineIndex()
+        files = index.track(self.iter_diff_files(pr["diff_url"]))
+        earlier = ""
+        if state_store is not None:
+            state = self.run_incremental_review(
+                pr_url, state_store, chunk_tokens=chunk_tokens, max_workers=max_workers, pr=pr, patch=files
+            )
+            # A head reviewed before leaves the diff unread; it is still
+            # needed to place the comments.
+            for _ in files:
+                pass
+            result = state["result"]
+            # Findings carried over from earlier heads use that head's line
+            # numbers, so only this head's findings are placed inline.
+            current = merge_file_reviews(state["files"], head_sha, current=True)
+            review = "\n\n".join(section for section in (current, state.get("skipped", "")) if section)
+            earlier = merge_file_reviews(state["files"], head_sha, current=False)
+        else:
+            result = review = self.review_patch(
+                files,
+                pr["title"],
+                pr["body"],
+                chunk_tokens=chunk_tokens,
+                max_workers=max_workers,
+                progress_callback=progress_callback if stream else None,
+                raw=True,
+                head_sha=head_sha,
+            )
+        self.post_review(pr_url, head_sha, review, index, earlier=earlier)
+        if raw:
+            return result
+        with self.client.instrumentation.span("render"):
+            result_text = markdown_to_text(result)
         print("\nCode Review Results:\n", result_text)
+        return result_text
 
+    def post_review(
+        self, pr_url: str, commit_id: str, review: str, index: DiffLineIndex, earlier: str = ""
+    ) -> PostedReview:
+        owner, repo, _, pr_id = pr_url.rstrip("/").split("/")[-4:]
+        with self.client.instrumentation.span("post_review"):
+            return post_review(self.github, f"{owner}/{repo}", int(pr_id), commit_id, review, index, earlier=earlier)
 
-if __name__ == "__main__":
-    OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-    openai.api_key = OPENAI_API_KEY
 
-    pr_url = sys.argv[1]  # Replace with the GitHub Pull Request URL you want to review
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Review a GitHub pull request with GPT-4.")
+    parser.add_argument("pr_url", help="URL of the pull request, e.g. https://github.com/owner/repo/pull/1")
+    parser.add_argument(
+        "--format",
+        choices=OUTPUT_FORMATS,
+        default=os.getenv("REVIEW_OUTPUT_FORMAT", "text"),
+        help="output format (default: text)",
+    )
+    parser.add_argument(
+        "--post",
+        action="store_true",
+        default=os.getenv("REVIEW_POST", "0") == "1",
+        help="post the findings to the pull request as one review with inline comments",
+    )
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    chunk_tokens = int(os.getenv("REVIEW_CHUNK_TOKENS", "0")) or None
+    max_workers = int(os.getenv("REVIEW_MAX_WORKERS", "4"))
 
-    code_review_assistant = PRReviewer()
-    code_review_assistant.review_pull_request(pr_url)
+    cache = ResponseCache.from_env()
+    client = OpenAIClient.from_env(cache=cache)
+    code_review_assistant = PRReviewer(
+        triage=DiffTriage.from_env(),
+        client=client,
+        compactor=DiffCompactor.from_env(),
+        cascade=ModelCascade.from_env(client),
+        symbols=SymbolIndex.from_env(),
+    )
+    raw = args.format != "text"
+    try:
+        result = code_review_assistant.review_pull_request(
+            args.pr_url,
+            progress_callback=partial(print, file=sys.stderr) if raw else print,
+            chunk_tokens=chunk_tokens,
+            max_workers=max_workers,
+            stream=os.getenv("REVIEW_STREAM", "0") == "1",
+            state_store=ReviewStateStore.from_env(),
+            raw=raw,
+            post=args.post,
+        )
+        if raw:
+            render_review(args.format, sys.stdout, args.pr_url, result)
+    except (ModelRequestError, ReviewPostError) as e:
+        print(e)
+        sys.exit(1)
+    if cache is not None:
+        logger.info(f"Response cache: {cache.hits} hit(s), {cache.misses} miss(es)")
+    github_stats = code_review_assistant.github.stats()
+    logger.info(
+        f"GitHub: {github_stats['requests_made']} request(s) made, "
+        f"{github_stats['requests_saved']} answered from the ETag store"
+    )
+    logger.info(code_review_assistant.client.usage_summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set
+
+from pull_request_reviewer.pull_request_reviewer import PRReviewer
+from review_common.cascade import ModelCascade
+from review_common.compaction import DiffCompactor
+from review_common.github_review import DiffLineIndex
+from review_common.incremental import DEFAULT_STATE_DIR, ReviewStateStore
+from review_common.openai_client import OpenAIClient
+from review_common.rendering import OUTPUT_FORMATS, make_renderer
+from review_common.response_cache import ResponseCache
+from review_common.symbol_index import SymbolIndex
+from review_common.triage import DiffTriage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 60.0
+DEFAULT_SETTLE = 30.0
+# A pull request that keeps receiving pushes is still reviewed once its
+# first push has waited this many settle windows.
+MAX_SETTLE_WINDOWS = 4
+
+
+class ReviewCancelled(Exception):
+    pass
+
+
+class WatchJob:
+    def __init__(self, pr: dict, queued_at: float, ready_at: float):
+        self.pr = pr
+        self.queued_at = queued_at
+        self.ready_at = ready_at
+        self.cancelled = threading.Event()
+        self.coalesced = 0
+
+    @property
+    def number(self) -> int:
+        return self.pr["number"]
+
+    @property
+    def head_sha(self) -> str:
+        return self.pr["head"]["sha"]
+
+    @property
+    def url(self) -> str:
+        return self.pr["html_url"]
+
+    def check(self):
+        if self.cancelled.is_set():
+            raise ReviewCancelled(f"#{self.number} at {self.head_sha[:7]} was superseded")
+
+
+def until_cancelled(files: Iterable, job: WatchJob) -> Iterator:
+    # Stops the diff download and any chunks not yet sent to the model as
+    # soon as the job goes stale.
+    for file in files:
+        job.check()
+        yield file
+
+
+class PullRequestWatcher:
+    def __init__(
+        self,
+        reviewer: PRReviewer,
+        repo_name: str,
+        interval: float = DEFAULT_INTERVAL,
+        settle: float = DEFAULT_SETTLE,
+        workers: int = 2,
+        chunk_tokens: Optional[int] = None,
+        max_workers: int = 4,
+        post: bool = False,
+        on_result: Optional[Callable[[WatchJob, Optional[str], Optional[str]], None]] = None,
+        clock: Callable[[], float] = time.monotonic,
+        state_store: Optional[ReviewStateStore] = None,
+    ):
+        self.reviewer = reviewer
+        self.repo_name = repo_name
+        self.interval = interval
+        self.settle = settle
+        self.workers = workers
+        self.chunk_tokens = chunk_tokens
+        self.max_workers = max_workers
+        self.post = post
+        self.on_result = on_result
+        self.clock = clock
+        self.heads: Dict[int, str] = {}
+        # The head last reviewed for each pull request, kept in state_store
+        # so a restarted watcher does not review every open pull request again.
+        self.state_store = state_store
+        self.state_key = f"watch/{repo_name}"
+        self.reviewed: Dict[int, str] = {}
+        if state_store is not None:
+            state = state_store.load(self.state_key) or {}
+            self.reviewed = {int(number): sha for number, sha in state.get("reviewed", {}).items()}
+        self.pending: Dict[int, WatchJob] = {}
+        self.running: Set[WatchJob] = set()
+        self.counts = {
+            "polls": 0,
+            "not_modified": 0,
+            "queued": 0,
+            "coalesced": 0,
+            "reviewed": 0,
+            "failed": 0,
+            "cancelled": 0,
+        }
+        self.cancelled_seconds = 0.0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers))
+
+    @classmethod
+    def from_env(cls, reviewer: PRReviewer, repo_name: str, **kwargs) -> "PullRequestWatcher":
+        return cls(
+            reviewer,
+            repo_name,
+            interval=float(os.getenv("REVIEW_WATCH_INTERVAL", str(DEFAULT_INTERVAL))),
+            settle=float(os.getenv("REVIEW_WATCH_SETTLE", str(DEFAULT_SETTLE))),
+            workers=int(os.getenv("REVIEW_WATCH_WORKERS", "2")),
+            chunk_tokens=int(os.getenv("REVIEW_CHUNK_TOKENS", "0")) or None,
+            max_workers=int(os.getenv("REVIEW_MAX_WORKERS", "4")),
+            state_store=(
+                ReviewStateStore(os.path.expanduser(os.getenv("REVIEW_STATE_DIR", DEFAULT_STATE_DIR)))
+                if os.getenv("REVIEW_WATCH_STATE", "1") == "1"
+                else None
+            ),
+            **kwargs,
+        )
+
+    def save_state(self):
+        # Called with the lock held.
+        if self.state_store is not None:
+            self.state_store.save(self.state_key, {"reviewed": self.reviewed})
+
+    def poll(self) -> int:
+        # The list of open pull requests is fetched through the ETag store, so
+        # a poll that finds nothing new is a 304 and costs no rate limit.
+        listing = self.reviewer.github.list_pulls(self.repo_name)
+        now = self.clock()
+        new_heads = 0
+        with self._lock:
+            self.counts["polls"] += 1
+            if listing.not_modified:
+                self.counts["not_modified"] += 1
+            open_numbers = set()
+            for pr in listing.pulls:
+                number, sha = pr["number"], pr["head"]["sha"]
+                open_numbers.add(number)
+                if self.heads.get(number) == sha:
+                    continue
+                self.heads[number] = sha
+                if self.reviewed.get(number) == sha:
+                    # Reviewed before the watcher restarted.
+                    continue
+                new_heads += 1
+                self._cancel_running(number, f"superseded by {sha[:7]}")
+                job = self.pending.get(number)
+                if job is None:
+                    self.pending[number] = WatchJob(pr, now, now + self.settle)
+                    self.counts["queued"] += 1
+                else:
+                    # A burst of pushes becomes one review of the last head.
+                    job.pr = pr
+                    job.coalesced += 1
+                    job.ready_at = min(now + self.settle, job.queued_at + MAX_SETTLE_WINDOWS * self.settle)
+                    self.counts["coalesced"] += 1
+            for number in set(self.heads) - open_numbers:
+                del self.heads[number]
+                if self.pending.pop(number, None) is not None:
+                    self.counts["cancelled"] += 1
+                self._cancel_running(number, "closed")
+            closed = set(self.reviewed) - open_numbers
+            if closed:
+                for number in closed:
+                    del self.reviewed[number]
+                self.save_state()
+        return new_heads
+
+    def _cancel_running(self, number: int, reason: str):
+        for job in self.running:
+            if job.number == number and not job.cancelled.is_set():
+                job.cancelled.set()
+                self.counts["cancelled"] += 1
+                logger.info(f"Cancelling the review of #{number} at {job.head_sha[:7]}: {reason}")
+
+    def dispatch(self) -> int:
+        now = self.clock()
+        started = 0
+        with self._lock:
+            ready = sorted((job for job in self.pending.values() if job.ready_at <= now), key=lambda job: job.ready_at)
+            for job in ready:
+                if len(self.running) >= self.workers:
+                    break
+                del self.pending[job.number]
+                self.running.add(job)
+                self._executor.submit(self.run_job, job)
+                started += 1
+        return started
+
+    def review(self, job: WatchJob) -> str:
+        job.check()
+        pr = job.pr
+        files = until_cancelled(self.reviewer.iter_diff_files(pr["diff_url"]), job)
+        index = None
+        if self.post:
+            index = DiffLineIndex()
+            files = index.track(files)
+        review = self.reviewer.review_patch(
+            files,
+            pr["title"],
+            pr["body"] or "",
+            chunk_tokens=self.chunk_tokens,
+            max_workers=self.max_workers,
+            raw=True,
+            cancelled=job.cancelled,
+            head_sha=job.head_sha,
+        )
+        # The model calls in flight stop when the job is cancelled; a review
+        # that still finished is never posted once a newer head has arrived.
+        job.check()
+        if index is not None:
+            self.reviewer.post_review(job.url, job.head_sha, review, index)
+        return review
+
+    def run_job(self, job: WatchJob):
+        start = time.perf_counter()
+        review = error = None
+        try:
+            review = self.review(job)
+        except ReviewCancelled:
+            pass
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.running.discard(job)
+            stale = job.cancelled.is_set()
+            if stale:
+                self.cancelled_seconds += elapsed
+            elif error is not None:
+                self.counts["failed"] += 1
+            else:
+                self.counts["reviewed"] += 1
+                self.reviewed[job.number] = job.head_sha
+                self.save_state()
+        self._wake.set()
+        if stale:
+            logger.info(f"Dropped the stale review of #{job.number} at {job.head_sha[:7]} after {elapsed:.2f}s")
+            return
+        if error is not None:
+            logger.error(f"Error reviewing {job.url} at {job.head_sha[:7]}: {error}")
+        if self.on_result is not None:
+            self.on_result(job, review, error)
+
+    def next_wakeup(self) -> Optional[float]:
+        with self._lock:
+            if len(self.running) >= self.workers or not self.pending:
+                return None
+            return min(job.ready_at for job in self.pending.values())
+
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                logger.warning(f"Polling {self.repo_name} failed: {e}")
+            next_poll = self.clock() + self.interval
+            while not self._stop.is_set():
+                self.dispatch()
+                now = self.clock()
+                if now >= next_poll:
+                    break
+                # Woken early when a settle window ends or a worker frees up.
+                wakeup = self.next_wakeup()
+                timeout = next_poll - now if wakeup is None else max(0.0, min(next_poll, wakeup) - now)
+                self._wake.wait(timeout)
+                self._wake.clear()
+            logger.info(self.summary())
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def shutdown(self, cancel: bool = True):
+        # Without cancel, reviews already running are allowed to finish.
+        self.stop()
+        if cancel:
+            with self._lock:
+                self.counts["cancelled"] += len(self.pending)
+                self.pending.clear()
+                for job in list(self.running):
+                    self._cancel_running(job.number, "shutting down")
+        self._executor.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(
+                self.counts,
+                queue_depth=len(self.pending),
+                running=len(self.running),
+                cancelled_seconds=round(self.cancelled_seconds, 3),
+            )
+
+    def summary(self) -> str:
+        stats = self.stats()
+        return (
+            f"Watch {self.repo_name}: {stats['queue_depth']} queued, {stats['running']} running; "
+            f"{stats['reviewed']} reviewed, {stats['failed']} failed, {stats['cancelled']} cancelled "
+            f"({stats['cancelled_seconds']:.2f}s of review work dropped), {stats['coalesced']} push(es) coalesced; "
+            f"{stats['polls']} poll(s), {stats['not_modified']} not modified"
+        )
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Watch a repository and review each new pull request head.")
+    parser.add_argument("repo", help="repository to watch, as owner/name")
+    parser.add_argument(
+        "--format",
+        choices=OUTPUT_FORMATS,
+        default=os.getenv("REVIEW_OUTPUT_FORMAT", "text"),
+        help="output format (default: text)",
+    )
+    parser.add_argument(
+        "--post",
+        action="store_true",
+        default=os.getenv("REVIEW_POST", "0") == "1",
+        help="post each review to its pull request",
+    )
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    client = OpenAIClient.from_env(cache=ResponseCache.from_env())
+    reviewer = PRReviewer(
+        triage=DiffTriage.from_env(),
+        client=client,
+        compactor=DiffCompactor.from_env(),
+        cascade=ModelCascade.from_env(client),
+        symbols=SymbolIndex.from_env(),
+    )
+    renderer = make_renderer(args.format, sys.stdout)
+    output_lock = threading.Lock()
+
+    def on_result(job: WatchJob, review: Optional[str], error: Optional[str]):
+        source = f"{job.url} ({job.head_sha[:7]})"
+        with output_lock:
+            if error is not None:
+                renderer.error(source, error)
+            else:
+                renderer.write(source, review)
+
+    watcher = PullRequestWatcher.from_env(reviewer, args.repo, post=args.post, on_result=on_result)
+    renderer.begin()
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.shutdown()
+        renderer.end()
+        logger.info(watcher.summary())
+        logger.info(client.usage_summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+import ast
+import hashlib
+import json
+import logging
+import os
+from typing import Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from review_common.chunking import CHARS_PER_TOKEN
+from review_common.rendering import RE_BULLET, RE_CODE_SPAN, RE_LINE, RE_PATH
+from review_common.response_cache import DEFAULT_CACHE_DIR, ResponseCache
+
+logger = logging.getLogger(__name__)
+
+PYTHON_EXTENSIONS = (".py", ".pyi")
+# Bumped whenever the chunk layout changes, so cached plans are not reused.
+PLAN_VERSION = 1
+# Module-level assignments longer than this are not repeated as context.
+MAX_CONTEXT_ASSIGNMENT_LINES = 5
+# Width taken by the "1234 | " prefix on every numbered line.
+LINE_PREFIX_CHARS = 8
+
+LineRange = Tuple[int, int]
+
+
+class CodeUnit(NamedTuple):
+    name: str
+    start: int
+    end: int
+    context: List[LineRange]
+
+
+class CodeChunk(NamedTuple):
+    names: List[str]
+    start: int
+    end: int
+    context: List[LineRange]
+
+
+def is_python_file(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() in PYTHON_EXTENSIONS
+
+
+def first_line(node: ast.AST) -> int:
+    decorators = getattr(node, "decorator_list", [])
+    return min([node.lineno] + [decorator.lineno for decorator in decorators])
+
+
+def used_names(nodes: Iterable[ast.AST]) -> Set[str]:
+    return {child.id for node in nodes for child in ast.walk(node) if isinstance(child, ast.Name)}
+
+
+def bound_names(node: ast.stmt) -> Set[str]:
+    if isinstance(node, (ast.Import, ast.ImportFrom)):
+        return {(alias.asname or alias.name).split(".")[0] for alias in node.names}
+    targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+    return {child.id for target in targets for child in ast.walk(target) if isinstance(child, ast.Name)}
+
+
+class ModuleHeader:
+    # The module docstring, imports and short constants, from which each
+    # chunk takes the lines it depends on.
+    def __init__(self, tree: ast.Module):
+        self.docstring: Optional[LineRange] = None
+        self.definitions: List[Tuple[Set[str], LineRange]] = []
+        body = tree.body
+        if body and isinstance(body[0], ast.Expr) and isinstance(getattr(body[0], "value", None), ast.Constant):
+            if isinstance(body[0].value.value, str):
+                self.docstring = (body[0].lineno, body[0].end_lineno)
+        for node in body:
+            if isinstance(node, (ast.Import, ast.ImportFrom)):
+                names = {"*"} if any(alias.name == "*" for alias in node.names) else bound_names(node)
+                self.definitions.append((names, (node.lineno, node.end_lineno)))
+            elif isinstance(node, (ast.Assign, ast.AnnAssign)):
+                if node.end_lineno - node.lineno < MAX_CONTEXT_ASSIGNMENT_LINES:
+                    self.definitions.append((bound_names(node), (node.lineno, node.end_lineno)))
+
+    def context_for(self, nodes: Iterable[ast.AST]) -> List[LineRange]:
+        names = used_names(nodes)
+        context = [self.docstring] if self.docstring else []
+        context += [lines for bound, lines in self.definitions if "*" in bound or bound & names]
+        return context
+
+
+def prefix_sizes(lines: List[str]) -> List[int]:
+    # Prefix sums of rendered line lengths, so any range is measured in O(1).
+    line_chars = [0]
+    for line in lines:
+        line_chars.append(line_chars[-1] + len(line) + 1 + LINE_PREFIX_CHARS)
+    return line_chars
+
+
+def split_units(tree: ast.Module, line_chars: List[int], max_tokens: int) -> List[CodeUnit]:
+    header = ModuleHeader(tree)
+    max_chars = max_tokens * CHARS_PER_TOKEN
+
+    units: List[CodeUnit] = []
+    previous_end = 0
+    for node in tree.body:
+        # Comments and blank lines above a statement belong to it.
+        start, end = previous_end + 1, node.end_lineno
+        previous_end = end
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            units.append(CodeUnit(node.name, start, end, header.context_for([node])))
+        elif isinstance(node, ast.ClassDef):
+            methods = [child for child in node.body if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef))]
+            if line_chars[end] - line_chars[start - 1] <= max_chars or not methods:
+                units.append(CodeUnit(node.name, start, end, header.context_for([node])))
+            else:
+                units.extend(split_class(node, start, header))
+        elif units and units[-1].name == "<module>":
+            last = units[-1]
+            units[-1] = last._replace(end=end, context=last.context + header.context_for([node]))
+        else:
+            units.append(CodeUnit("<module>", start, end, header.context_for([node])))
+    last_line = len(line_chars) - 1
+    if units and units[-1].end < last_line:
+        units[-1] = units[-1]._replace(end=last_line)
+    return units
+
+
+def split_class(node: ast.ClassDef, start: int, header: ModuleHeader) -> List[CodeUnit]:
+    # Each method is shown below the class statement, docstring and class
+    # attributes, which are reviewed as a unit of their own.
+    body = node.body
+    first_method = next(
+        index for index, child in enumerate(body) if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef))
+    )
+    header_end = first_line(body[first_method]) - 1
+    class_context = [(start, header_end)]
+    class_nodes = [*node.bases, *node.keywords, *node.decorator_list, *body[:first_method]]
+    units = [CodeUnit(node.name, start, header_end, header.context_for(class_nodes))]
+    previous_end = header_end
+    for child in body[first_method:]:
+        child_start, child_end = previous_end + 1, child.end_lineno
+        previous_end = child_end
+        if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            name = f"{node.name}.{child.name}"
+            units.append(CodeUnit(name, child_start, child_end, class_context + header.context_for([child])))
+        else:
+            last = units[-1]
+            units[-1] = last._replace(end=child_end, context=last.context + header.context_for([child]))
+    units[-1] = units[-1]._replace(end=node.end_lineno)
+    return units
+
+
+def chunk_lines(chunk: CodeChunk) -> List[int]:
+    numbers = set(range(chunk.start, chunk.end + 1))
+    for start, end in chunk.context:
+        numbers.update(range(start, end + 1))
+    return sorted(numbers)
+
+
+def pack_units(units: List[CodeUnit], line_chars: List[int], max_tokens: int) -> List[CodeChunk]:
+    max_chars = max_tokens * CHARS_PER_TOKEN
+
+    def size(chunk: CodeChunk) -> int:
+        return sum(line_chars[number] - line_chars[number - 1] for number in chunk_lines(chunk))
+
+    chunks: List[CodeChunk] = []
+    for unit in units:
+        candidate = CodeChunk([unit.name], unit.start, unit.end, unit.context)
+        if chunks:
+            last = chunks[-1]
+            merged = CodeChunk(last.names + [unit.name], last.start, unit.end, last.context + unit.context)
+            if size(merged) <= max_chars:
+                chunks[-1] = merged
+                continue
+        if size(candidate) > max_chars:
+            logger.warning(
+                f"{unit.name} is ~{size(candidate) // CHARS_PER_TOKEN} tokens, "
+                f"over the {max_tokens} token chunk budget"
+            )
+        chunks.append(candidate)
+
+    # Context is kept only where it lies outside the chunk's own lines.
+    return [
+        chunk._replace(
+            names=[name for index, name in enumerate(chunk.names) if name not in chunk.names[:index]],
+            context=sorted({(start, end) for start, end in chunk.context if start < chunk.start or end > chunk.end}),
+        )
+        for chunk in chunks
+    ]
+
+
+def plan_chunks(code: str, max_tokens: int) -> Optional[List[CodeChunk]]:
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError) as e:
+        logger.warning(f"Cannot parse the file, reviewing it whole: {e}")
+        return None
+    line_chars = prefix_sizes(code.splitlines())
+    return pack_units(split_units(tree, line_chars, max_tokens), line_chars, max_tokens)
+
+
+def render_chunk(lines: List[str], chunk: CodeChunk) -> str:
+    # Every line carries its number in the file, so the model can cite real
+    # line numbers; "..." marks lines left out.
+    numbers = chunk_lines(chunk)
+    width = len(str(numbers[-1])) if numbers else 1
+    rendered = []
+    previous = None
+    for number in numbers:
+        if number > len(lines):
+            break
+        if previous is not None and number != previous + 1:
+            rendered.append(f"{'...':>{width}}")
+        rendered.append(f"{number:>{width}} | {lines[number - 1]}")
+        previous = number
+    return "\n".join(rendered)
+
+
+def anchor_findings(review: str, path: str, line: int) -> str:
+    # Top-level findings that name no line are pinned to the start of the
+    # chunk they came from.
+    anchored = []
+    for text in review.splitlines():
+        match = RE_BULLET.match(text)
+        if match and not match.group(1) and not RE_LINE.search(text):
+            spans = [RE_PATH.match(span) for span in RE_CODE_SPAN.findall(text)]
+            if not any(span and span.group(1) for span in spans):
+                text = f"{text} (line {line})"
+        anchored.append(text)
+    return "\n".join(anchored)
+
+
+class AstChunker:
+    def __init__(self, cache: Optional[ResponseCache] = None):
+        self.cache = cache
+        self.parses = 0
+
+    @classmethod
+    def from_env(cls) -> "AstChunker":
+        cache = None
+        if os.getenv("REVIEW_CACHE", "1") != "0":
+            cache_dir = os.path.expanduser(os.getenv("REVIEW_CACHE_DIR", DEFAULT_CACHE_DIR))
+            cache = ResponseCache(cache_dir=os.path.join(cache_dir, "ast"))
+        return cls(cache=cache)
+
+    @staticmethod
+    def cache_key(path: str, code: str, max_tokens: int) -> str:
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = 0
+        digest = hashlib.sha256(code.encode("utf-8", "surrogatepass")).hexdigest()
+        return f"ast:{PLAN_VERSION}:{digest}:{mtime}:{max_tokens}"
+
+    def plan(self, path: str, code: str, max_tokens: int) -> Optional[List[CodeChunk]]:
+        key = self.cache_key(path, code, max_tokens) if self.cache is not None else None
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return [
+                    CodeChunk(names, start, end, [tuple(lines) for lines in context])
+                    for names, start, end, context in json.loads(cached)
+                ]
+        self.parses += 1
+        chunks = plan_chunks(code, max_tokens)
+        if key is not None and chunks is not None:
+            self.cache.put(key, json.dumps([list(chunk) for chunk in chunks]))
+        return chunks
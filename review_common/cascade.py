@@ -0,0 +1,245 @@
+import itertools
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from review_common.chunking import estimate_tokens, format_code_change
+from review_common.instrumentation import estimate_cost
+from review_common.openai_client import OpenAIClient, RequestCancelled
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TRIAGE_MODEL = "gpt-3.5-turbo"
+DEFAULT_REVIEW_MODEL = "gpt-4"
+DEFAULT_THRESHOLD = 4
+# gpt-3.5-turbo has a 4K context; larger files go to the review model unscored.
+DEFAULT_MAX_TRIAGE_TOKENS = 3000
+
+TRIAGE_SYSTEM_PROMPT = """You triage code changes before a senior engineer reviews them.
+Rate how likely the change is to contain a bug, a security problem or a design issue worth a careful review.
+Answer with a JSON object only: {"risk": <integer from 0 (trivial) to 10 (risky)>, "verdict": "<one sentence>"}."""
+
+RE_RISK = re.compile(r'"?risk"?\s*[:=]\s*(\d+)', re.IGNORECASE)
+RE_VERDICT = re.compile(r'"verdict"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+
+class RiskScore(NamedTuple):
+    risk: int
+    verdict: str
+
+
+def parse_risk(text: str) -> Optional[RiskScore]:
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    if match:
+        try:
+            data = json.loads(match.group(0))
+            return RiskScore(max(0, min(10, int(data["risk"]))), str(data.get("verdict", "")).strip())
+        except (ValueError, KeyError, TypeError):
+            pass
+    # Small models do not always return valid JSON.
+    risk = RE_RISK.search(text)
+    if risk is None:
+        return None
+    verdict = RE_VERDICT.search(text)
+    return RiskScore(min(10, int(risk.group(1))), verdict.group(1) if verdict else "")
+
+
+def build_triage_prompt(context: str, path: str, text: str) -> str:
+    return f"""The change is described as: {context}
+Here is the change to {path} in unidiff format:
+{format_code_change(text)}"""
+
+
+def format_verdict(score: RiskScore) -> str:
+    return f"{score.verdict or 'No issues expected.'} (risk {score.risk}/10)"
+
+
+def low_risk_section(scores: List[Tuple[str, RiskScore]]) -> str:
+    lines = ["### Low-risk changes (triage only)", ""]
+    for path, score in scores:
+        lines.append(f"- `{path}`: {format_verdict(score)}")
+    return "\n".join(lines)
+
+
+class CascadeStats:
+    def __init__(self):
+        self.files = 0
+        self.escalated = 0
+        self.tokens = 0
+        self.escalated_tokens = 0
+        self.triage_seconds = 0.0
+        self.triage_cost = 0.0
+        self.review_seconds = 0.0
+        self.review_cost = 0.0
+        self.unpriced = False
+        self._lock = threading.Lock()
+
+    def record(self, **amounts):
+        with self._lock:
+            for name, amount in amounts.items():
+                setattr(self, name, getattr(self, name) + amount)
+
+    def summary(self) -> str:
+        share = 100 * self.escalated / self.files if self.files else 0.0
+        text = (
+            f"Cascade escalated {self.escalated} of {self.files} file(s) ({share:.0f}%) to the review model; "
+            f"triage took {self.triage_seconds:.2f}s"
+        )
+        if self.unpriced:
+            return text + "; savings unknown for unpriced models"
+        # An all-large-model run would have sent every file's tokens to the
+        # review model, so its time and cost are extrapolated from the
+        # escalated files by token count.
+        if self.escalated_tokens:
+            scale = self.tokens / self.escalated_tokens
+            saved_seconds = self.review_seconds * scale - self.review_seconds - self.triage_seconds
+            saved_cost = self.review_cost * scale - self.review_cost - self.triage_cost
+            return text + f"; ~{saved_seconds:.2f}s and ~${saved_cost:.4f} saved against an all-large-model run"
+        return text + "; no file needed the review model"
+
+
+class ModelCascade:
+    def __init__(
+        self,
+        client: OpenAIClient,
+        triage_model: str = DEFAULT_TRIAGE_MODEL,
+        review_model: str = DEFAULT_REVIEW_MODEL,
+        threshold: int = DEFAULT_THRESHOLD,
+        max_triage_tokens: int = DEFAULT_MAX_TRIAGE_TOKENS,
+        max_workers: int = 4,
+    ):
+        self.client = client
+        self.triage_model = triage_model
+        self.review_model = review_model
+        self.threshold = threshold
+        self.max_triage_tokens = max_triage_tokens
+        self.max_workers = max_workers
+        self.stats = CascadeStats()
+
+    @classmethod
+    def from_env(cls, client: OpenAIClient) -> Optional["ModelCascade"]:
+        if os.getenv("REVIEW_CASCADE", "0") != "1":
+            return None
+        return cls(
+            client,
+            triage_model=os.getenv("REVIEW_CASCADE_MODEL", DEFAULT_TRIAGE_MODEL),
+            review_model=os.getenv("REVIEW_CASCADE_REVIEW_MODEL", DEFAULT_REVIEW_MODEL),
+            threshold=int(os.getenv("REVIEW_CASCADE_THRESHOLD", str(DEFAULT_THRESHOLD))),
+            max_workers=int(os.getenv("REVIEW_MAX_WORKERS", "4")),
+        )
+
+    def score(
+        self, context: str, path: str, text: str, cancelled: Optional[threading.Event] = None
+    ) -> Optional[RiskScore]:
+        prompt = build_triage_prompt(context, path, text)
+        reply = self.client.chat(
+            TRIAGE_SYSTEM_PROMPT, prompt, model=self.triage_model, temperature=0, max_tokens=100, cancelled=cancelled
+        )
+        cost = estimate_cost(self.triage_model, estimate_tokens(TRIAGE_SYSTEM_PROMPT + prompt), estimate_tokens(reply))
+        if cost is None:
+            self.stats.unpriced = True
+        else:
+            self.stats.record(triage_cost=cost)
+        return parse_risk(reply)
+
+    def score_file(self, context: str, file, cancelled: Optional[threading.Event] = None) -> Optional[RiskScore]:
+        # Anything that cannot be scored goes to the review model.
+        text = str(file)
+        if estimate_tokens(text) > self.max_triage_tokens:
+            return None
+        try:
+            score = self.score(context, file.path, text, cancelled)
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            logger.warning(f"Triage of {file.path} failed, escalating: {e}")
+            return None
+        if score is None:
+            logger.warning(f"Triage of {file.path} returned no risk score, escalating")
+        return score
+
+    def scored_files(
+        self, files: Iterable, context: str, cancelled: Optional[threading.Event] = None
+    ) -> Iterator[Tuple[object, Optional[RiskScore]]]:
+        # Files are scored in a window a few files ahead of the reviewer, in
+        # diff order, so a streamed diff is never held in memory in full.
+        window = deque()
+        with ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as executor:
+            for file in files:
+                window.append((file, executor.submit(self.score_file, context, file, cancelled)))
+                if len(window) > 2 * max(1, self.max_workers):
+                    file, future = window.popleft()
+                    yield file, future.result()
+            while window:
+                file, future = window.popleft()
+                yield file, future.result()
+
+    def review(
+        self,
+        files: Iterable,
+        context: str,
+        review_files: Callable[[Iterable], str],
+        cancelled: Optional[threading.Event] = None,
+    ) -> str:
+        low_risk: List[Tuple[str, RiskScore]] = []
+        result = self.review_escalated(files, context, review_files, low_risk, cancelled)
+        sections = [] if result is None else [result]
+        if low_risk:
+            sections.append(low_risk_section(low_risk))
+        return "\n\n".join(sections)
+
+    def review_escalated(
+        self,
+        files: Iterable,
+        context: str,
+        review_files: Callable[[Iterable], str],
+        low_risk: List[Tuple[str, RiskScore]],
+        cancelled: Optional[threading.Event] = None,
+    ) -> Optional[str]:
+        # Escalated files reach review_files as they are scored; the low-risk
+        # ones are appended to low_risk with their score. Returns None when
+        # no file needed the review model.
+        totals = {"files": 0, "escalated": 0, "tokens": 0, "escalated_tokens": 0, "triage_seconds": 0.0}
+
+        def escalated_files():
+            scored = self.scored_files(files, context, cancelled)
+            while True:
+                start = time.perf_counter()
+                item = next(scored, None)
+                totals["triage_seconds"] += time.perf_counter() - start
+                if item is None:
+                    return
+                file, score = item
+                file_tokens = estimate_tokens(str(file))
+                totals["files"] += 1
+                totals["tokens"] += file_tokens
+                if score is None or score.risk >= self.threshold:
+                    totals["escalated"] += 1
+                    totals["escalated_tokens"] += file_tokens
+                    yield file
+                else:
+                    low_risk.append((file.path, score))
+
+        escalated = escalated_files()
+        start = time.perf_counter()
+        first = next(escalated, None)
+        result = None
+        # An empty diff is still reviewed as before, so the output is unchanged.
+        if first is not None or not totals["files"]:
+            result = review_files(itertools.chain([first], escalated) if first is not None else [])
+            # Scoring the files the reviewer pulls overlaps the review and is
+            # counted as triage.
+            review_seconds = time.perf_counter() - start - totals["triage_seconds"]
+            review_cost = estimate_cost(self.review_model, totals["escalated_tokens"], estimate_tokens(result))
+            if review_cost is None:
+                self.stats.unpriced = True
+            self.stats.record(review_seconds=max(0.0, review_seconds), review_cost=review_cost or 0.0)
+        self.stats.record(**totals)
+        logger.info(f"Cascade: {totals['escalated']} of {totals['files']} file(s) escalated to {self.review_model}")
+        return result
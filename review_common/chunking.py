@@ -0,0 +1,160 @@
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+if TYPE_CHECKING:
+    from unidiff import PatchedFile
+
+logger = logging.getLogger(__name__)
+
+# Rough average for English text and source code with the GPT tokenizers.
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def format_code_change(text: str) -> str:
+    return f"```diff\n{text}\n```"
+
+
+class DiffChunk(NamedTuple):
+    paths: List[str]
+    text: str
+    tokens: int
+
+
+class ChunkTiming(NamedTuple):
+    index: int
+    paths: List[str]
+    tokens: int
+    latency: float
+    error: Optional[str]
+
+
+class MapReduceStats(NamedTuple):
+    chunks: List[ChunkTiming]
+    wall_clock: float
+
+    def summary(self) -> str:
+        lines = [
+            f"Reviewed {len(self.chunks)} chunk(s) in {self.wall_clock:.2f}s wall-clock"
+        ]
+        for timing in self.chunks:
+            status = f"failed: {timing.error}" if timing.error else "ok"
+            lines.append(
+                f"  chunk {timing.index + 1}: ~{timing.tokens} tokens, "
+                f"{timing.latency:.2f}s, {status}"
+            )
+        return "\n".join(lines)
+
+
+def split_patched_file(file: "PatchedFile", max_tokens: int) -> List[str]:
+    text = str(file)
+    if estimate_tokens(text) <= max_tokens or len(file) < 2:
+        return [text]
+
+    # Repeat the file header on every piece so each one is a valid diff.
+    hunks = [str(hunk) for hunk in file]
+    header = text[: len(text) - sum(len(hunk) for hunk in hunks)]
+    pieces = []
+    current = header
+    for hunk in hunks:
+        if current != header and estimate_tokens(current + hunk) > max_tokens:
+            pieces.append(current)
+            current = header
+        current += hunk
+    pieces.append(current)
+    return pieces
+
+
+def iter_chunks(files: Iterable["PatchedFile"], max_tokens: int) -> Iterator[DiffChunk]:
+    if max_tokens <= 0:
+        raise ValueError("max_tokens must be a positive number of tokens")
+
+    paths: List[str] = []
+    messages: List[str] = []
+    tokens = 0
+
+    for file in files:
+        for piece in split_patched_file(file, max_tokens):
+            message = format_code_change(piece)
+            message_tokens = estimate_tokens(message)
+            if messages and tokens + message_tokens > max_tokens:
+                yield DiffChunk(paths, "\n".join(messages), tokens)
+                paths, messages, tokens = [], [], 0
+            if message_tokens > max_tokens:
+                logger.warning(
+                    f"{file.path} has a hunk of ~{message_tokens} tokens, "
+                    f"over the {max_tokens} token chunk budget"
+                )
+            if file.path not in paths:
+                paths.append(file.path)
+            messages.append(message)
+            tokens += message_tokens
+    if messages:
+        yield DiffChunk(paths, "\n".join(messages), tokens)
+
+
+def chunk_patched_files(files: Iterable["PatchedFile"], max_tokens: int) -> List[DiffChunk]:
+    return list(iter_chunks(files, max_tokens))
+
+
+def review_chunks(
+    chunks: Iterable[DiffChunk],
+    review_chunk: Callable[[str], str],
+    max_workers: int = 4,
+) -> Tuple[List[str], MapReduceStats]:
+    def review(index: int, chunk: DiffChunk) -> Tuple[str, ChunkTiming]:
+        start = time.perf_counter()
+        error = None
+        try:
+            result = review_chunk(chunk.text)
+        except Exception as e:
+            logger.error(f"Error reviewing chunk {index + 1}: {e}")
+            result = ""
+            error = str(e) or type(e).__name__
+        latency = time.perf_counter() - start
+        logger.info(
+            f"Chunk {index + 1} reviewed in {latency:.2f}s "
+            f"(~{chunk.tokens} tokens)"
+        )
+        return result, ChunkTiming(index, chunk.paths, chunk.tokens, latency, error)
+
+    # Chunks are pulled from the iterable only as workers free up, so a lazily
+    # produced diff is never held in memory in full.
+    max_workers = max(1, max_workers)
+    outcomes = []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = deque()
+        for index, chunk in enumerate(chunks):
+            if len(in_flight) >= 2 * max_workers:
+                outcomes.append(in_flight.popleft().result())
+            in_flight.append(executor.submit(review, index, chunk))
+        outcomes.extend(future.result() for future in in_flight)
+    wall_clock = time.perf_counter() - start
+
+    results = [result for result, _ in outcomes]
+    stats = MapReduceStats([timing for _, timing in outcomes], wall_clock)
+    return results, stats
+
+
+def map_reduce_review(
+    chunks: Iterable[DiffChunk],
+    review_chunk: Callable[[str], str],
+    max_workers: int = 4,
+) -> Tuple[str, MapReduceStats]:
+    results, stats = review_chunks(chunks, review_chunk, max_workers)
+    if len(results) == 1:
+        return results[0], stats
+
+    sections = []
+    for result, timing in zip(results, stats.chunks):
+        heading = f"### Part {timing.index + 1}/{len(results)}: {', '.join(timing.paths)}"
+        body = result or "_No review was returned for this part._"
+        sections.append(f"{heading}\n\n{body}")
+    return "\n\n".join(sections), stats
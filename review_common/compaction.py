@@ -0,0 +1,217 @@
+import logging
+import os
+import re
+import threading
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from unidiff import Hunk, PatchedFile
+
+from review_common.chunking import estimate_tokens
+from review_common.incremental import fingerprint_hunk
+
+logger = logging.getLogger(__name__)
+
+RE_WHITESPACE = re.compile(r"\s+")
+RE_INDENT = re.compile(r"[ \t]*")
+
+
+class CompactFile:
+    # Stands in for a PatchedFile after compaction: str() gives the header
+    # followed by the hunks, as split_patched_file and the prompts expect.
+    def __init__(self, path: str, header: str, hunks: List[str]):
+        self.path = path
+        self.header = header
+        self.hunks = hunks
+
+    def __str__(self) -> str:
+        return self.header + "".join(self.hunks)
+
+    def __len__(self) -> int:
+        return len(self.hunks)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.hunks)
+
+
+class CompactionStats:
+    def __init__(self):
+        self.tokens_before = 0
+        self.tokens_after = 0
+        self.context_lines_trimmed = 0
+        self.whitespace_hunks = 0
+        self.files_summarized = 0
+        self.duplicate_hunks = 0
+        self._lock = threading.Lock()
+
+    def record(self, tokens_before: int, tokens_after: int, **counts: int):
+        with self._lock:
+            self.tokens_before += tokens_before
+            self.tokens_after += tokens_after
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+
+    def summary(self) -> str:
+        saved = self.tokens_before - self.tokens_after
+        percent = 100 * saved / self.tokens_before if self.tokens_before else 0.0
+        return (
+            f"Compaction cut the diff from ~{self.tokens_before} to ~{self.tokens_after} tokens "
+            f"({percent:.0f}% saved): {self.context_lines_trimmed} context line(s) trimmed, "
+            f"{self.whitespace_hunks} whitespace-only hunk(s) and {self.files_summarized} "
+            f"rename/mode-only file(s) summarized, {self.duplicate_hunks} repeated hunk(s) deduplicated"
+        )
+
+
+def hunk_header(source_start: int, source_length: int, target_start: int, target_length: int, section: str) -> str:
+    return f"@@ -{source_start},{source_length} +{target_start},{target_length} @@{' ' + section if section else ''}\n"
+
+
+def normalize_lines(lines: Iterable[str]) -> List[str]:
+    # Leading indentation is kept as is: in Python, YAML or a Makefile moving
+    # a line in or out of a block changes what it means. Blank lines drop out.
+    normalized = []
+    for value in lines:
+        rest = RE_WHITESPACE.sub("", value)
+        if rest:
+            normalized.append(RE_INDENT.match(value).group() + rest)
+    return normalized
+
+
+def is_whitespace_only(hunk: "Hunk") -> bool:
+    removed = normalize_lines(line.value for line in hunk if line.is_removed)
+    added = normalize_lines(line.value for line in hunk if line.is_added)
+    return removed == added and bool(hunk.added or hunk.removed)
+
+
+def trim_context(hunk: "Hunk", context_lines: int) -> Tuple[List[str], int]:
+    lines = list(hunk)
+    changed = [index for index, line in enumerate(lines) if line.is_added or line.is_removed]
+    if not changed:
+        return [str(hunk)], 0
+
+    keep = [False] * len(lines)
+    for index in changed:
+        for kept in range(max(0, index - context_lines), min(len(lines), index + context_lines + 1)):
+            keep[kept] = True
+    for index, line in enumerate(lines):
+        # "\ No newline at end of file" belongs to the line before it.
+        if line.line_type == "\\" and index and keep[index - 1]:
+            keep[index] = True
+    if all(keep):
+        return [str(hunk)], 0
+
+    # Kept runs separated by dropped context become hunks of their own, with
+    # line numbers recomputed so each one is still a valid unified diff hunk.
+    pieces = []
+    source_line, target_line = hunk.source_start, hunk.target_start
+    current: List[str] = []
+    start = lengths = None
+    for index, line in enumerate(lines):
+        if keep[index]:
+            if not current:
+                start, lengths = (source_line, target_line), [0, 0]
+            current.append(str(line))
+            lengths[0] += line.is_context or line.is_removed
+            lengths[1] += line.is_context or line.is_added
+        elif current:
+            pieces.append((start, lengths, current))
+            current = []
+        source_line += line.is_context or line.is_removed
+        target_line += line.is_context or line.is_added
+    if current:
+        pieces.append((start, lengths, current))
+
+    hunks = []
+    for (source_start, target_start), (source_length, target_length), body in pieces:
+        # As in git, an empty side of a hunk points at the line before it.
+        if not source_length:
+            source_start = max(0, source_start - 1)
+        if not target_length:
+            target_start = max(0, target_start - 1)
+        header = hunk_header(source_start, source_length, target_start, target_length, hunk.section_header)
+        hunks.append(header + "".join(body))
+    return hunks, len(lines) - sum(keep)
+
+
+def summarize_file(file: "PatchedFile") -> Optional[str]:
+    if len(file):
+        return None
+    if file.is_rename:
+        return f"renamed {file.source_file[2:]} -> {file.target_file[2:]} (no content changes)\n"
+    source_mode, target_mode = getattr(file, "source_mode", None), getattr(file, "target_mode", None)
+    if source_mode and target_mode and source_mode != target_mode:
+        return f"{file.path}: mode changed {source_mode} -> {target_mode} (no content changes)\n"
+    return None
+
+
+class DiffCompactor:
+    def __init__(
+        self,
+        context_lines: Optional[int] = 3,
+        collapse_whitespace: bool = True,
+        collapse_metadata: bool = True,
+        dedupe_hunks: bool = True,
+    ):
+        self.context_lines = context_lines
+        self.collapse_whitespace = collapse_whitespace
+        self.collapse_metadata = collapse_metadata
+        self.dedupe_hunks = dedupe_hunks
+        self.stats = CompactionStats()
+
+    @classmethod
+    def from_env(cls) -> Optional["DiffCompactor"]:
+        if os.getenv("REVIEW_COMPACT", "0") != "1":
+            return None
+        context_lines = os.getenv("REVIEW_CONTEXT_LINES", "3")
+        return cls(context_lines=int(context_lines) if context_lines else None)
+
+    def compact_file(self, file: "PatchedFile", seen: Dict[str, Tuple[str, int]]) -> CompactFile:
+        text = str(file)
+        hunk_texts = [str(hunk) for hunk in file]
+        header = text[: len(text) - sum(len(hunk) for hunk in hunk_texts)]
+
+        summary = self.collapse_metadata and summarize_file(file)
+        if summary:
+            compact = CompactFile(file.path, summary, [])
+            self.stats.record(estimate_tokens(text), estimate_tokens(summary), files_summarized=1)
+            return compact
+
+        hunks = []
+        trimmed = whitespace = duplicates = 0
+        for hunk, hunk_text in zip(file, hunk_texts):
+            at = hunk_header(hunk.source_start, hunk.source_length, hunk.target_start, hunk.target_length, "")
+            if self.collapse_whitespace and is_whitespace_only(hunk):
+                hunks.append(f"{at.rstrip()} whitespace-only change ({hunk.added + hunk.removed} lines)\n")
+                whitespace += 1
+                continue
+            if self.dedupe_hunks:
+                fingerprint = fingerprint_hunk(hunk)
+                if fingerprint in seen:
+                    first_path, count = seen[fingerprint]
+                    seen[fingerprint] = (first_path, count + 1)
+                    hunks.append(f"{at.rstrip()} same change as in {first_path} (repeat #{count})\n")
+                    duplicates += 1
+                    continue
+                seen[fingerprint] = (file.path, 1)
+            if self.context_lines is None:
+                hunks.append(hunk_text)
+            else:
+                pieces, dropped = trim_context(hunk, self.context_lines)
+                hunks.extend(pieces)
+                trimmed += dropped
+
+        compact = CompactFile(file.path, header, hunks)
+        self.stats.record(
+            estimate_tokens(text),
+            estimate_tokens(str(compact)),
+            context_lines_trimmed=trimmed,
+            whitespace_hunks=whitespace,
+            duplicate_hunks=duplicates,
+        )
+        return compact
+
+    def compact(self, files: Iterable["PatchedFile"]) -> Iterator[CompactFile]:
+        # Repeated hunks are only looked for within one diff.
+        seen: Dict[str, Tuple[str, int]] = {}
+        for file in files:
+            yield self.compact_file(file, seen)
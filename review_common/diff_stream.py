@@ -0,0 +1,98 @@
+import mmap
+import re
+from typing import TYPE_CHECKING, Iterable, Iterator, List
+
+if TYPE_CHECKING:
+    from unidiff import PatchedFile
+
+RE_HUNK_HEADER = re.compile(r"^@@ -\d+(?:,(\d+))? \+\d+(?:,(\d+))? @@")
+RELEASE_BYTES = 8 * 1024 * 1024
+
+
+def iter_file_lines(path: str, encoding: str = "utf-8") -> Iterator[str]:
+    # The file is opened here rather than inside the generator so a missing
+    # or unreadable file fails at call time, like open() would.
+    diff_file = open(path, "rb")
+    try:
+        mapped = mmap.mmap(diff_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        # Empty files cannot be memory-mapped.
+        diff_file.close()
+        return iter(())
+
+    def lines() -> Iterator[str]:
+        released = 0
+        try:
+            for line in iter(mapped.readline, b""):
+                yield line.decode(encoding, errors="replace")
+                # Pages that have been read still count towards RSS, so hand
+                # them back to the kernel as we go to keep the footprint flat.
+                consumed = mapped.tell() - mapped.tell() % mmap.PAGESIZE
+                if hasattr(mmap, "MADV_DONTNEED") and consumed - released >= RELEASE_BYTES:
+                    mapped.madvise(mmap.MADV_DONTNEED, released, consumed - released)
+                    released = consumed
+        finally:
+            mapped.close()
+            diff_file.close()
+
+    return lines()
+
+
+def iter_chunked_lines(chunks: Iterable[bytes], encoding: str = "utf-8") -> Iterator[str]:
+    pending = b""
+    for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield (line + b"\n").decode(encoding, errors="replace")
+    if pending:
+        yield pending.decode(encoding, errors="replace")
+
+
+def iter_file_segments(lines: Iterable[str]) -> Iterator[List[str]]:
+    # Splits a diff into the lines belonging to each file. Hunk line counts
+    # are tracked so removed lines such as "--- foo" inside a hunk are never
+    # mistaken for the start of the next file.
+    segment: List[str] = []
+    in_header = False
+    source_left = target_left = 0
+
+    for line in lines:
+        if source_left > 0 or target_left > 0:
+            segment.append(line)
+            if line.startswith("-"):
+                source_left -= 1
+            elif line.startswith("+"):
+                target_left -= 1
+            elif not line.startswith("\\"):
+                source_left -= 1
+                target_left -= 1
+            continue
+
+        hunk_header = RE_HUNK_HEADER.match(line)
+        if hunk_header:
+            source_left = int(hunk_header.group(1) or 1)
+            target_left = int(hunk_header.group(2) or 1)
+            in_header = False
+            segment.append(line)
+            continue
+
+        starts_file = line.startswith("diff ") or (line.startswith("--- ") and not in_header)
+        if starts_file:
+            if segment:
+                yield segment
+            segment = []
+            in_header = True
+        segment.append(line)
+
+    if segment:
+        yield segment
+
+
+def iter_patched_files(lines: Iterable[str]) -> Iterator["PatchedFile"]:
+    # Only one file's lines are held at a time, so memory is bounded by the
+    # largest file in the diff rather than by the diff as a whole.
+    from unidiff import PatchSet
+
+    for segment in iter_file_segments(lines):
+        yield from PatchSet(segment)
@@ -0,0 +1,88 @@
+import subprocess
+import tempfile
+from typing import Iterator, List, NamedTuple, Sequence
+
+# Output must not depend on the user's git configuration: no colour, no
+# external diff drivers, and renames detected so compaction can summarize them.
+DIFF_OPTIONS = ("--no-color", "--no-ext-diff", "-M")
+
+
+class GitError(Exception):
+    pass
+
+
+class Commit(NamedTuple):
+    sha: str
+    message: str
+
+    @property
+    def subject(self) -> str:
+        return self.message.splitlines()[0] if self.message else ""
+
+
+def run_git(args: Sequence[str], repo: str = ".") -> str:
+    try:
+        completed = subprocess.run(
+            ["git", *args], cwd=repo, capture_output=True, text=True, check=False
+        )
+    except FileNotFoundError as e:
+        raise GitError(f"git is not installed: {e}") from e
+    if completed.returncode != 0:
+        raise GitError(f"git {' '.join(args)} failed: {completed.stderr.strip()}")
+    return completed.stdout
+
+
+def iter_git_lines(args: Sequence[str], repo: str = ".") -> Iterator[str]:
+    # Diffs are read from the pipe as git writes them, so a large commit is
+    # parsed file by file instead of being buffered in full. stderr goes to a
+    # file: a pipe nobody reads until stdout ends would stall git once its
+    # warnings filled the pipe buffer.
+    with tempfile.TemporaryFile() as stderr_file:
+        try:
+            process = subprocess.Popen(
+                ["git", *args],
+                cwd=repo,
+                stdout=subprocess.PIPE,
+                stderr=stderr_file,
+                text=True,
+                errors="replace",
+            )
+        except FileNotFoundError as e:
+            raise GitError(f"git is not installed: {e}") from e
+        try:
+            yield from process.stdout
+        finally:
+            process.stdout.close()
+            returncode = process.wait()
+        if returncode != 0:
+            stderr_file.seek(0)
+            stderr = stderr_file.read().decode("utf-8", "replace")
+            raise GitError(f"git {' '.join(args)} failed: {stderr.strip()}")
+
+
+def list_commits(revision: str, repo: str = ".") -> List[Commit]:
+    # One git log call returns every commit's sha and message, separated by
+    # NULs, which a message cannot contain.
+    if ".." in revision:
+        # Merge commits only repeat changes that are reviewed in their own
+        # commits, so ranges skip them.
+        args = ["--reverse", "--no-merges", revision]
+    else:
+        args = ["-1", f"{revision}^{{commit}}"]
+    output = run_git(["log", "-z", "--format=%H%n%B", *args, "--"], repo)
+    commits = []
+    for entry in output.split("\0"):
+        sha, _, message = entry.partition("\n")
+        if sha.strip():
+            commits.append(Commit(sha.strip(), message.strip()))
+    return commits
+
+
+def commit_diff_lines(sha: str, repo: str = ".") -> Iterator[str]:
+    return iter_git_lines(
+        ["diff-tree", "-p", "--root", "--no-commit-id", "-m", "--first-parent", *DIFF_OPTIONS, sha], repo
+    )
+
+
+def staged_diff_lines(repo: str = ".") -> Iterator[str]:
+    return iter_git_lines(["diff", "--cached", *DIFF_OPTIONS], repo)
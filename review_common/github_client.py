@@ -0,0 +1,209 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+from review_common.diff_stream import iter_chunked_lines
+from review_common.response_cache import DEFAULT_CACHE_DIR, ResponseCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_API_URL = "https://api.github.com"
+JSON_MEDIA_TYPE = "application/vnd.github+json"
+DIFF_MEDIA_TYPE = "application/vnd.github.v3.diff"
+# Streamed bodies larger than this are not kept in the ETag store, so a huge
+# diff is never held in memory in full.
+MAX_STREAMED_ETAG_BYTES = 16 * 1024 * 1024
+
+
+class Fetched(NamedTuple):
+    text: str
+    # True when GitHub answered 304 and the body came from the ETag store.
+    not_modified: bool
+
+
+class PullListing(NamedTuple):
+    pulls: List[dict]
+    not_modified: bool
+
+
+class GitHubClient:
+    def __init__(
+        self,
+        token: Optional[str] = None,
+        api_url: str = DEFAULT_API_URL,
+        etag_cache: Optional[ResponseCache] = None,
+        max_retries: int = 3,
+        backoff_factor: float = 0.5,
+        pool_size: int = 10,
+        timeout: float = 30,
+    ):
+        self.api_url = api_url.rstrip("/")
+        self.etag_cache = etag_cache
+        self.timeout = timeout
+        self.requests_made = 0
+        self.requests_saved = 0
+        self._lock = threading.Lock()
+
+        # requests and urllib3 are imported here rather than at module level
+        # so the CLIs can start without paying for them until a fetch is needed.
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["GET", "HEAD"]),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers["User-Agent"] = "GPT-Code-Analyzer"
+        if token:
+            self.session.headers["Authorization"] = f"token {token}"
+
+    @classmethod
+    def from_env(cls, pool_size: int = 10) -> "GitHubClient":
+        etag_cache = None
+        if os.getenv("REVIEW_CACHE", "1") != "0":
+            cache_dir = os.path.expanduser(os.getenv("REVIEW_CACHE_DIR", DEFAULT_CACHE_DIR))
+            etag_cache = ResponseCache(cache_dir=os.path.join(cache_dir, "etags"))
+        return cls(
+            token=os.getenv("GITHUB_TOKEN"),
+            api_url=os.getenv("GITHUB_API_URL", DEFAULT_API_URL),
+            etag_cache=etag_cache,
+            pool_size=pool_size,
+        )
+
+    def get(self, url: str, accept: str = JSON_MEDIA_TYPE) -> str:
+        return self.fetch(url, accept).text
+
+    def _etag_key(self, url: str, accept: str) -> str:
+        return hashlib.sha256(f"{accept} {url}".encode("utf-8")).hexdigest()
+
+    def _conditional_headers(self, cache_key: str, accept: str) -> Tuple[dict, Optional[dict]]:
+        headers = {"Accept": accept}
+        cached = None
+        if self.etag_cache is not None:
+            stored = self.etag_cache.get(cache_key)
+            if stored is not None:
+                cached = json.loads(stored)
+                headers["If-None-Match"] = cached["etag"]
+        return headers, cached
+
+    def _count_request(self, response, cached: Optional[dict]) -> bool:
+        # Returns whether the response is a 304 answered from the ETag store.
+        not_modified = response.status_code == 304 and cached is not None
+        with self._lock:
+            self.requests_made += 1
+            if not_modified:
+                self.requests_saved += 1
+        return not_modified
+
+    def fetch(self, url: str, accept: str = JSON_MEDIA_TYPE) -> Fetched:
+        # GitHub does not count 304 responses against the rate limit, so a
+        # stored ETag turns a repeated fetch into a free revalidation.
+        cache_key = self._etag_key(url, accept)
+        headers, cached = self._conditional_headers(cache_key, accept)
+        response = self.session.get(url, headers=headers, timeout=self.timeout)
+        if self._count_request(response, cached):
+            return Fetched(cached["body"], True)
+
+        response.raise_for_status()
+        etag = response.headers.get("ETag")
+        if etag and self.etag_cache is not None:
+            self.etag_cache.put(cache_key, json.dumps({"etag": etag, "body": response.text}))
+        return Fetched(response.text, False)
+
+    def iter_lines(self, url: str, accept: str = JSON_MEDIA_TYPE, chunk_size: int = 64 * 1024) -> Iterator[str]:
+        # Revalidates against the same ETag store as fetch. A streamed body is
+        # stored once it has been read to the end, unless it is too large.
+        cache_key = self._etag_key(url, accept)
+        headers, cached = self._conditional_headers(cache_key, accept)
+        response = self.session.get(url, headers=headers, timeout=self.timeout, stream=True)
+        if self._count_request(response, cached):
+            response.close()
+            return iter_chunked_lines([cached["body"].encode("utf-8")])
+        try:
+            response.raise_for_status()
+        except Exception:
+            response.close()
+            raise
+        etag = response.headers.get("ETag") if self.etag_cache is not None else None
+
+        def lines() -> Iterator[str]:
+            kept: Optional[List[str]] = [] if etag else None
+            size = 0
+            with response:
+                for line in iter_chunked_lines(response.iter_content(chunk_size=chunk_size)):
+                    if kept is not None:
+                        size += len(line)
+                        if size > MAX_STREAMED_ETAG_BYTES:
+                            kept = None
+                        else:
+                            kept.append(line)
+                    yield line
+            if kept is not None:
+                self.etag_cache.put(cache_key, json.dumps({"etag": etag, "body": "".join(kept)}))
+
+        return lines()
+
+    def get_json(self, path: str):
+        return json.loads(self.get(f"{self.api_url}/{path.lstrip('/')}"))
+
+    def get_pull(self, repo_name: str, number: int) -> dict:
+        return self.get_json(f"repos/{repo_name}/pulls/{number}")
+
+    def get_pages(self, path: str, per_page: int = 100) -> List[dict]:
+        return self._pages(path, per_page)[0]
+
+    def _pages(self, path: str, per_page: int) -> Tuple[List[dict], bool]:
+        # Also reports whether every page was a 304.
+        items = []
+        not_modified = True
+        page = 1
+        while True:
+            separator = "&" if "?" in path else "?"
+            fetched = self.fetch(f"{self.api_url}/{path.lstrip('/')}{separator}per_page={per_page}&page={page}")
+            batch = json.loads(fetched.text)
+            items.extend(batch)
+            not_modified = not_modified and fetched.not_modified
+            if len(batch) < per_page:
+                return items, not_modified
+            page += 1
+
+    def post_json(self, path: str, payload: dict) -> dict:
+        # POSTs are not retried by the session: a retried review would be
+        # posted twice.
+        response = self.session.post(
+            f"{self.api_url}/{path.lstrip('/')}",
+            json=payload,
+            headers={"Accept": JSON_MEDIA_TYPE},
+            timeout=self.timeout,
+        )
+        with self._lock:
+            self.requests_made += 1
+        response.raise_for_status()
+        return response.json()
+
+    def list_pulls(self, repo_name: str, state: str = "open") -> PullListing:
+        return PullListing(*self._pages(f"repos/{repo_name}/pulls?state={state}", 100))
+
+    def list_review_comments(self, repo_name: str, number: int) -> List[dict]:
+        return self.get_pages(f"repos/{repo_name}/pulls/{number}/comments")
+
+    def list_reviews(self, repo_name: str, number: int) -> List[dict]:
+        return self.get_pages(f"repos/{repo_name}/pulls/{number}/reviews")
+
+    def create_review(self, repo_name: str, number: int, payload: dict) -> dict:
+        return self.post_json(f"repos/{repo_name}/pulls/{number}/reviews", payload)
+
+    def stats(self) -> dict:
+        return {"requests_made": self.requests_made, "requests_saved": self.requests_saved}
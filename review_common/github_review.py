@@ -0,0 +1,167 @@
+import logging
+from collections import defaultdict
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+if TYPE_CHECKING:
+    from unidiff import PatchedFile
+
+from review_common.github_client import GitHubClient
+from review_common.rendering import Finding, extract_findings
+
+logger = logging.getLogger(__name__)
+
+REVIEW_HEADING = "### Automated code review"
+
+
+class ReviewPostError(Exception):
+    pass
+
+
+class InlineComment(NamedTuple):
+    path: str
+    line: int
+    side: str
+    body: str
+
+
+class PostedReview(NamedTuple):
+    review_id: Optional[int]
+    comments: int
+    duplicates: int
+    general: int
+
+
+class DiffLineIndex:
+    # GitHub only accepts inline comments on lines that appear in the pull
+    # request diff: added and context lines on the RIGHT side, removed lines
+    # on the LEFT.
+    def __init__(self, files: Iterable["PatchedFile"] = ()):
+        self.right: Dict[str, Set[int]] = defaultdict(set)
+        self.left: Dict[str, Set[int]] = defaultdict(set)
+        for file in files:
+            self.add(file)
+
+    def add(self, file: "PatchedFile"):
+        right, left = self.right[file.path], self.left[file.path]
+        for hunk in file:
+            for line in hunk:
+                if line.is_removed:
+                    left.add(line.source_line_no)
+                elif line.target_line_no is not None:
+                    right.add(line.target_line_no)
+
+    def track(self, files: Iterable["PatchedFile"]) -> Iterator["PatchedFile"]:
+        # Indexes streamed files as the review consumes them.
+        for file in files:
+            self.add(file)
+            yield file
+
+    def resolve_path(self, path: Optional[str]) -> Optional[str]:
+        if not path:
+            return None
+        if path in self.right:
+            return path
+        # Reviews sometimes shorten paths; accept an unambiguous suffix.
+        suffix = "/" + (path[2:] if path.startswith("./") else path)
+        matches = [known for known in self.right if known.endswith(suffix)]
+        return matches[0] if len(matches) == 1 else None
+
+    def locate(self, finding: Finding) -> Optional[Tuple[str, int, str]]:
+        path = self.resolve_path(finding.path)
+        if path is None or finding.line is None:
+            return None
+        if finding.line in self.right[path]:
+            return path, finding.line, "RIGHT"
+        if finding.line in self.left[path]:
+            return path, finding.line, "LEFT"
+        return None
+
+
+def split_findings(review: str, index: DiffLineIndex) -> Tuple[List[InlineComment], List[Finding]]:
+    comments, general = [], []
+    for finding in extract_findings(review):
+        location = index.locate(finding)
+        if location is None:
+            general.append(finding)
+        else:
+            comments.append(InlineComment(*location, finding.message))
+    return comments, general
+
+
+def format_review_body(general: List[Finding], comments: int) -> str:
+    lines = [REVIEW_HEADING, ""]
+    for finding in general:
+        # Continuation lines stay inside the bullet.
+        lines.append("- " + finding.message.replace("\n", "\n  "))
+    if comments:
+        if general:
+            lines.append("")
+        lines.append(f"{comments} comment(s) were left inline.")
+    return "\n".join(lines)
+
+
+def post_review(
+    github: GitHubClient,
+    repo_name: str,
+    number: int,
+    commit_id: str,
+    review: str,
+    index: DiffLineIndex,
+    event: str = "COMMENT",
+    earlier: str = "",
+) -> PostedReview:
+    # Findings from the review of an earlier head refer to that head's line
+    # numbers, so they always go in the review body.
+    comments, general = split_findings(review, index)
+    general.extend(extract_findings(earlier))
+
+    # Comments already on the pull request, for example from an earlier run
+    # over an unchanged hunk, are not posted again.
+    try:
+        posted = {
+            (comment["path"], comment.get("line") or comment.get("original_line"), comment["body"])
+            for comment in github.list_review_comments(repo_name, number)
+        }
+    except Exception as e:
+        raise ReviewPostError(f"Could not list review comments on {repo_name}#{number}: {e}") from e
+    new_comments = []
+    for comment in comments:
+        key = (comment.path, comment.line, comment.body)
+        if key not in posted:
+            posted.add(key)
+            new_comments.append(comment)
+    duplicates = len(comments) - len(new_comments)
+
+    body = format_review_body(general, len(new_comments))
+    if not new_comments:
+        try:
+            bodies = {existing.get("body") for existing in github.list_reviews(repo_name, number)} if general else set()
+        except Exception as e:
+            raise ReviewPostError(f"Could not list reviews on {repo_name}#{number}: {e}") from e
+        # An earlier review carrying the same general findings counts as a
+        # duplicate, whatever it said about its inline comments.
+        findings = format_review_body(general, 0)
+        if not general or any(existing and existing.startswith(findings) for existing in bodies):
+            logger.info(f"Nothing new to post on {repo_name}#{number} ({duplicates} duplicate comment(s) skipped)")
+            return PostedReview(None, 0, duplicates, len(general))
+
+    # One review with every inline comment is one API call, however many
+    # findings there are, which keeps clear of the secondary rate limits.
+    payload = {
+        "commit_id": commit_id,
+        "event": event,
+        "body": body,
+        "comments": [
+            {"path": comment.path, "line": comment.line, "side": comment.side, "body": comment.body}
+            for comment in new_comments
+        ],
+    }
+    try:
+        created = github.create_review(repo_name, number, payload)
+    except Exception as e:
+        raise ReviewPostError(f"Could not post the review to {repo_name}#{number}: {e}") from e
+    logger.info(
+        f"Posted review {created.get('id')} to {repo_name}#{number}: {len(new_comments)} inline comment(s), "
+        f"{len(general)} general finding(s), {duplicates} duplicate comment(s) skipped"
+    )
+    return PostedReview(created.get("id"), len(new_comments), duplicates, len(general))
@@ -0,0 +1,367 @@
+import logging
+import math
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Callable, Dict, List, Optional
+
+from review_common.instrumentation import Instrumentation
+from review_common.openai_client import OpenAIClient, RequestCancelled
+from review_common.response_cache import ResponseCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PERCENTILE = 0.95
+# Used until a model has enough latency samples for a percentile.
+DEFAULT_HEDGE_DELAY = 10.0
+DEFAULT_MIN_SAMPLES = 20
+LATENCY_WINDOW = 500
+# A backend that failed this many calls in a row is raced or skipped until it
+# answers again; a skipped backup is probed again after the cooldown.
+MAX_CONSECUTIVE_FAILURES = 3
+DEFAULT_COOLDOWN = 30.0
+DEFAULT_MAX_THREADS = 32
+# How often a hedged call checks its caller's cancel event while it waits.
+CANCEL_POLL_SECONDS = 0.1
+
+PRIMARY = "primary"
+BACKUP = "backup"
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class LatencyHistogram:
+    # A rolling window, so percentiles follow a backend that speeds up or
+    # slows down during a run.
+    def __init__(self, size: int = LATENCY_WINDOW):
+        self.samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        with self._lock:
+            samples = list(self.samples)
+        return percentile(samples, fraction) if samples else None
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+
+class BackendHealth:
+    def __init__(self, name: str, cooldown: float = DEFAULT_COOLDOWN, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.latencies: Dict[str, LatencyHistogram] = {}
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.last_failure = 0.0
+        self.cooldown = cooldown
+        self.clock = clock
+        self._lock = threading.Lock()
+
+    def latency(self, model: str) -> LatencyHistogram:
+        # Models are tracked apart: triage calls would otherwise drag the
+        # review model's percentiles down.
+        with self._lock:
+            return self.latencies.setdefault(model, LatencyHistogram())
+
+    def record_success(self, model: str, seconds: float):
+        self.latency(model).record(seconds)
+        with self._lock:
+            self.successes += 1
+            self.consecutive_failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            self.last_failure = self.clock()
+
+    @property
+    def healthy(self) -> bool:
+        return self.consecutive_failures < MAX_CONSECUTIVE_FAILURES
+
+    @property
+    def probing(self) -> bool:
+        # An unhealthy backend is tried again once the cooldown since its
+        # last failure has passed; a failed probe starts a new cooldown.
+        return not self.healthy and self.clock() - self.last_failure >= self.cooldown
+
+
+class HedgeStats:
+    def __init__(self):
+        self.calls = 0
+        self.hedged = 0
+        self.failovers = 0
+        self.backup_wins = 0
+        self.cancelled = 0
+        # Tokens billed for replies that lost the race.
+        self.wasted_tokens = 0
+        # What the primary backend took on its own, and what callers saw.
+        self.primary_latencies = LatencyHistogram(size=10000)
+        self.call_latencies = LatencyHistogram(size=10000)
+        self._lock = threading.Lock()
+
+    def record(self, **amounts):
+        with self._lock:
+            for name, amount in amounts.items():
+                setattr(self, name, getattr(self, name) + amount)
+
+    def summary(self) -> str:
+        share = 100 * self.hedged / self.calls if self.calls else 0.0
+        text = (
+            f"Hedging: {self.hedged} of {self.calls} call(s) hedged ({share:.1f}%), {self.backup_wins} won by the "
+            f"backup, {self.failovers} failover(s), {self.cancelled} duplicate(s) cancelled "
+            f"({self.wasted_tokens} token(s) wasted)"
+        )
+        if not len(self.primary_latencies) or not len(self.call_latencies):
+            return text
+        return text + (
+            f"; p50/p99 {self.primary_latencies.percentile(0.5):.2f}s/{self.primary_latencies.percentile(0.99):.2f}s "
+            f"unhedged, {self.call_latencies.percentile(0.5):.2f}s/{self.call_latencies.percentile(0.99):.2f}s hedged"
+        )
+
+
+class AttemptPool:
+    # Attempts run on a bounded set of long-lived daemon threads. openai keeps
+    # one requests session per thread, so reused threads keep their
+    # connections to the API open; and a losing request that is still waiting
+    # on the API does not hold up the process when it exits.
+    def __init__(self, max_threads: int = DEFAULT_MAX_THREADS):
+        self.max_threads = max(2, max_threads)
+        self.threads: List[threading.Thread] = []
+        self._queue = queue.SimpleQueue()
+        self._idle = threading.Semaphore(0)
+        self._lock = threading.Lock()
+
+    def submit(self, function: Callable, *args) -> Future:
+        future = Future()
+        self._queue.put((future, function, args))
+        if not self._idle.acquire(timeout=0):
+            with self._lock:
+                if len(self.threads) < self.max_threads:
+                    thread = threading.Thread(target=self._work, name=f"model-hedge-{len(self.threads)}", daemon=True)
+                    thread.start()
+                    self.threads.append(thread)
+        return future
+
+    def _work(self):
+        while True:
+            future, function, args = self._queue.get()
+            if not future.set_running_or_notify_cancel():
+                self._idle.release()
+                continue
+            # The thread counts as idle before the caller is woken, so the
+            # caller's next attempt reuses it instead of starting another.
+            try:
+                result = function(*args)
+            except BaseException as e:
+                self._idle.release()
+                future.set_exception(e)
+            else:
+                self._idle.release()
+                future.set_result(result)
+
+
+class HedgedClient(OpenAIClient):
+    def __init__(
+        self,
+        backup: OpenAIClient,
+        backup_model: Optional[str] = None,
+        hedge_percentile: float = DEFAULT_PERCENTILE,
+        hedge_delay: float = DEFAULT_HEDGE_DELAY,
+        min_samples: int = DEFAULT_MIN_SAMPLES,
+        cooldown: float = DEFAULT_COOLDOWN,
+        max_threads: int = DEFAULT_MAX_THREADS,
+        clock: Callable[[], float] = time.monotonic,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.backup = backup
+        self.backup_model = backup_model
+        self.hedge_percentile = hedge_percentile
+        self.hedge_delay = hedge_delay
+        self.min_samples = min_samples
+        self.health = {
+            PRIMARY: BackendHealth(PRIMARY, cooldown, clock),
+            BACKUP: BackendHealth(BACKUP, cooldown, clock),
+        }
+        self.hedge_stats = HedgeStats()
+        self.pool = AttemptPool(max_threads)
+
+    @classmethod
+    def from_env(cls, cache: Optional[ResponseCache] = None) -> "HedgedClient":
+        api_key = os.getenv("OPENAI_API_KEY")
+        api_base = os.getenv("OPENAI_API_BASE") or None
+        max_retries = int(os.getenv("OPENAI_MAX_RETRIES", "5"))
+        instrumentation = Instrumentation.from_env()
+        backup = OpenAIClient(
+            api_key=os.getenv("REVIEW_HEDGE_API_KEY") or api_key,
+            api_base=os.getenv("REVIEW_HEDGE_API_BASE") or api_base,
+            requests_per_minute=float(os.getenv("REVIEW_HEDGE_REQUESTS_PER_MINUTE", "0")) or None,
+            tokens_per_minute=float(os.getenv("REVIEW_HEDGE_TOKENS_PER_MINUTE", "0")) or None,
+            max_retries=max_retries,
+            instrumentation=instrumentation,
+        )
+        return cls(
+            backup,
+            backup_model=os.getenv("REVIEW_HEDGE_MODEL") or None,
+            hedge_percentile=float(os.getenv("REVIEW_HEDGE_PERCENTILE", str(DEFAULT_PERCENTILE * 100))) / 100,
+            hedge_delay=float(os.getenv("REVIEW_HEDGE_DELAY", str(DEFAULT_HEDGE_DELAY))),
+            cooldown=float(os.getenv("REVIEW_HEDGE_COOLDOWN", str(DEFAULT_COOLDOWN))),
+            max_threads=int(os.getenv("REVIEW_HEDGE_THREADS", str(DEFAULT_MAX_THREADS))),
+            cache=cache,
+            api_key=api_key,
+            api_base=api_base,
+            requests_per_minute=float(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "0")) or None,
+            tokens_per_minute=float(os.getenv("OPENAI_TOKENS_PER_MINUTE", "0")) or None,
+            max_retries=max_retries,
+            instrumentation=instrumentation,
+        )
+
+    def delay_for(self, model: str) -> Optional[float]:
+        # None means the call is not hedged at all.
+        backup = self.health[BACKUP]
+        if not backup.healthy and not backup.probing:
+            return None
+        if not self.health[PRIMARY].healthy:
+            return 0.0
+        latency = self.health[PRIMARY].latency(model)
+        if len(latency) < self.min_samples:
+            return self.hedge_delay
+        return latency.percentile(self.hedge_percentile)
+
+    def attempt(self, backend: str, model: str, args: tuple, span: dict, cancelled: threading.Event) -> str:
+        health = self.health[backend]
+        start = time.perf_counter()
+        try:
+            if backend == PRIMARY:
+                content = OpenAIClient.complete(self, *args, span, cancelled)
+            else:
+                content = self.backup.complete(*args, span, cancelled)
+        except RequestCancelled:
+            raise
+        except Exception:
+            health.record_failure()
+            raise
+        elapsed = time.perf_counter() - start
+        health.record_success(model, elapsed)
+        if backend == PRIMARY:
+            self.hedge_stats.primary_latencies.record(elapsed)
+        return content
+
+    def complete(
+        self,
+        system_prompt: str,
+        prompt: str,
+        model: str,
+        temperature: float,
+        max_tokens: int,
+        progress_callback: Optional[Callable[[str], None]],
+        span: dict,
+        cancelled: Optional[threading.Event] = None,
+    ) -> str:
+        if progress_callback is not None or (cancelled is not None and cancelled.is_set()):
+            # Streamed output reaches the caller as it arrives, so it cannot
+            # be raced.
+            return super().complete(
+                system_prompt, prompt, model, temperature, max_tokens, progress_callback, span, cancelled
+            )
+
+        start = time.perf_counter()
+        delay = self.delay_for(model)
+        backup_model = self.backup_model or model
+        spans = {PRIMARY: {}, BACKUP: {}}
+        cancel = {PRIMARY: threading.Event(), BACKUP: threading.Event()}
+        names: Dict[Future, str] = {}
+
+        def launch(backend: str, backend_model: str) -> Future:
+            args = (system_prompt, prompt, backend_model, temperature, max_tokens, None)
+            future = self.pool.submit(self.attempt, backend, backend_model, args, spans[backend], cancel[backend])
+            names[future] = backend
+            return future
+
+        pending = {launch(PRIMARY, model)}
+        hedge_at = None if delay is None else start + delay
+        winner, content, errors = None, None, {}
+        hedged = failover = False
+        while pending:
+            timeout = None if hedge_at is None else max(0.0, hedge_at - time.perf_counter())
+            if cancelled is not None:
+                timeout = CANCEL_POLL_SECONDS if timeout is None else min(timeout, CANCEL_POLL_SECONDS)
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    content = future.result()
+                except Exception as e:
+                    errors[names[future]] = e
+                else:
+                    winner = names[future]
+                    break
+            if winner is not None or (cancelled is not None and cancelled.is_set()):
+                break
+            if hedge_at is not None and (done or time.perf_counter() >= hedge_at):
+                # The primary is slower than its own percentile, or failed
+                # outright: the same request goes to the backup.
+                if done:
+                    failover = True
+                    logger.warning(f"Primary model backend failed ({errors[PRIMARY]}), failing over")
+                else:
+                    hedged = True
+                    logger.info(f"No reply from {model} after {delay:.2f}s, hedging to {backup_model}")
+                pending.add(launch(BACKUP, backup_model))
+                hedge_at = None
+
+        # The loser's stream is closed at its next chunk, so the API stops
+        # generating its reply. What it was billed for by then, or in full if
+        # it finished anyway, is counted as wasted once it returns.
+        for future in pending:
+            backend = names[future]
+            cancel[backend].set()
+            future.add_done_callback(
+                lambda _, loser=spans[backend]: self.hedge_stats.record(wasted_tokens=loser.get("total_tokens", 0))
+            )
+        self.hedge_stats.record(
+            calls=1,
+            hedged=int(hedged),
+            failovers=int(failover),
+            backup_wins=int(winner == BACKUP),
+            cancelled=len(pending),
+        )
+        if winner is None:
+            if cancelled is not None and cancelled.is_set():
+                raise RequestCancelled("The request was cancelled")
+            raise errors.get(PRIMARY) or errors[BACKUP]
+        self.hedge_stats.call_latencies.record(time.perf_counter() - start)
+        span.update(spans[winner], backend=winner, hedged=hedged or failover)
+        return content
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        backup = self.backup.stats()
+        for name in ("requests", "retries", "prompt_tokens", "completion_tokens"):
+            stats[name] += backup[name]
+        stats["cost_usd"] = round(stats["cost_usd"] + backup["cost_usd"], 4)
+        stats.update(
+            hedged=self.hedge_stats.hedged,
+            failovers=self.hedge_stats.failovers,
+            backup_wins=self.hedge_stats.backup_wins,
+            wasted_tokens=self.hedge_stats.wasted_tokens,
+        )
+        return stats
+
+    def usage_summary(self) -> str:
+        return (
+            f"{super().usage_summary()}; backup: {self.backup.requests} request(s), "
+            f"{self.backup.prompt_tokens} prompt + {self.backup.completion_tokens} completion tokens, "
+            f"~${self.backup.cost_usd:.4f}. {self.hedge_stats.summary()}"
+        )
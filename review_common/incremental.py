@@ -0,0 +1,119 @@
+import copy
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+from collections import Counter
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Optional
+
+if TYPE_CHECKING:
+    from unidiff import Hunk, PatchedFile
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "gpt-code-analyzer", "reviews")
+
+
+def fingerprint_hunk(hunk: "Hunk") -> str:
+    # Only the changed lines are hashed, and never the @@ line numbers, so a
+    # hunk keeps its fingerprint when a rebase shifts it up or down the file.
+    digest = hashlib.sha256()
+    for line in hunk:
+        if line.is_added or line.is_removed:
+            digest.update(line.line_type.encode("utf-8"))
+            digest.update(line.value.rstrip().encode("utf-8"))
+            digest.update(b"\n")
+    return digest.hexdigest()
+
+
+class FileReviewPlan(NamedTuple):
+    path: str
+    new_hunks: List["Hunk"]
+    carried_over: List[dict]
+
+
+def plan_file_review(file: "PatchedFile", previous: Optional[dict]) -> FileReviewPlan:
+    # The same change can appear more than once in a file, so hunks are
+    # counted rather than deduplicated by fingerprint.
+    hunks = [(fingerprint_hunk(hunk), hunk) for hunk in file]
+    present = {fingerprint for fingerprint, _ in hunks}
+    entries = previous.get("reviews", []) if previous else []
+
+    # An earlier review is still relevant while any of the hunks it covered
+    # is part of the diff.
+    carried_over = [entry for entry in entries if present.intersection(entry["hunks"])]
+    reviewed = Counter()
+    for entry in carried_over:
+        reviewed.update(entry["hunks"])
+
+    new_hunks = []
+    for fingerprint, hunk in hunks:
+        if reviewed[fingerprint]:
+            reviewed[fingerprint] -= 1
+        else:
+            new_hunks.append(hunk)
+    return FileReviewPlan(file.path, new_hunks, carried_over)
+
+
+def with_hunks(file: "PatchedFile", hunks: List["Hunk"]) -> "PatchedFile":
+    # A copy of the file, header and all, that only carries the given hunks.
+    reduced = copy.copy(file)
+    reduced[:] = hunks
+    return reduced
+
+
+class ReviewStateStore:
+    def __init__(self, state_dir: str = DEFAULT_STATE_DIR):
+        self.state_dir = state_dir
+        os.makedirs(state_dir, exist_ok=True)
+
+    @classmethod
+    def from_env(cls) -> Optional["ReviewStateStore"]:
+        if os.getenv("REVIEW_INCREMENTAL", "0") != "1":
+            return None
+        return cls(os.path.expanduser(os.getenv("REVIEW_STATE_DIR", DEFAULT_STATE_DIR)))
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.state_dir, re.sub(r"[^A-Za-z0-9_.-]", "_", key) + ".json")
+
+    def load(self, key: str) -> Optional[dict]:
+        try:
+            with open(self._path(key), "r") as state_file:
+                return json.load(state_file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable review state for {key}: {e}")
+            return None
+
+    def save(self, key: str, state: dict):
+        # Write to a temporary file and rename it into place so a concurrent
+        # reader never sees a half-written state file.
+        fd, tmp_path = tempfile.mkstemp(dir=self.state_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as tmp_file:
+                json.dump(state, tmp_file)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+def merge_file_reviews(files: Dict[str, dict], head_sha: str, current: Optional[bool] = None) -> str:
+    # current=True keeps only the reviews of head_sha, current=False only
+    # those carried over from earlier heads.
+    sections = []
+    for path, file_state in files.items():
+        reviews = []
+        for entry in file_state["reviews"]:
+            if current is not None and (entry["head_sha"] == head_sha) != current:
+                continue
+            review = entry["review"]
+            if entry["head_sha"] != head_sha:
+                review = f"_From the review of {entry['head_sha'][:7]}:_\n\n{review}"
+            reviews.append(review)
+        if reviews:
+            sections.append(f"### {path}\n\n" + "\n\n".join(reviews))
+    return "\n\n".join(sections)
@@ -0,0 +1,243 @@
+import atexit
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import IO, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+# USD per 1K prompt and completion tokens. Models are matched by prefix, so
+# dated snapshots such as gpt-4-0613 use their family's price.
+MODEL_PRICES = {
+    "gpt-4-32k": (0.06, 0.12),
+    "gpt-4": (0.03, 0.06),
+    "gpt-3.5-turbo-16k": (0.003, 0.004),
+    "gpt-3.5-turbo": (0.0015, 0.002),
+}
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> Optional[float]:
+    for prefix, (prompt_price, completion_price) in MODEL_PRICES.items():
+        if model.startswith(prefix):
+            return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+    return None
+
+
+class Span(NamedTuple):
+    name: str
+    duration: float
+    self_time: float
+    attributes: Dict
+
+
+class NullSpan:
+    # Shared by every span() call while no hook is registered, so disabled
+    # instrumentation costs one attribute check per stage.
+    def __enter__(self) -> Dict:
+        return {}
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Instrumentation:
+    def __init__(self, hooks: Iterable[Callable[[Span], None]] = ()):
+        self.hooks: List[Callable[[Span], None]] = list(hooks)
+        self._local = threading.local()
+
+    @classmethod
+    def from_env(cls) -> "Instrumentation":
+        instrumentation = cls()
+        jsonl_path = os.getenv("REVIEW_METRICS_JSONL")
+        if jsonl_path:
+            instrumentation.add_hook(JsonLinesExporter(open(os.path.expanduser(jsonl_path), "a")))
+        prometheus_path = os.getenv("REVIEW_METRICS_PROMETHEUS")
+        if prometheus_path:
+            instrumentation.add_hook(PrometheusExporter(os.path.expanduser(prometheus_path)))
+        if instrumentation.hooks:
+            atexit.register(instrumentation.close)
+        return instrumentation
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.hooks)
+
+    def add_hook(self, hook: Callable[[Span], None]):
+        self.hooks.append(hook)
+
+    def emit(self, span: Span):
+        for hook in self.hooks:
+            hook(span)
+
+    def close(self):
+        for hook in self.hooks:
+            close = getattr(hook, "close", None)
+            if close is not None:
+                close()
+
+    def _stack(self) -> List[List[float]]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _enter(self) -> Tuple[List[float], float]:
+        frame = [0.0]
+        self._stack().append(frame)
+        return frame, time.perf_counter()
+
+    def _exit(self, frame: List[float], start: float) -> Tuple[float, float]:
+        # Time spent in nested spans on the same thread is charged to them, so
+        # self times of all stages add up to the wall-clock time.
+        duration = time.perf_counter() - start
+        stack = self._stack()
+        stack.pop()
+        if stack:
+            stack[-1][0] += duration
+        return duration, duration - frame[0]
+
+    def span(self, name: str, **attributes):
+        if not self.hooks:
+            return NULL_SPAN
+        return self._span(name, attributes)
+
+    @contextmanager
+    def _span(self, name: str, attributes: Dict):
+        frame, start = self._enter()
+        try:
+            yield attributes
+        except BaseException as e:
+            attributes["error"] = type(e).__name__
+            raise
+        finally:
+            duration, self_time = self._exit(frame, start)
+            self.emit(Span(name, duration, self_time, attributes))
+
+    def timed_iter(self, name: str, iterable: Iterable, **attributes) -> Iterator:
+        if not self.hooks:
+            return iter(iterable)
+        return self._timed_iter(name, iterable, attributes)
+
+    def _timed_iter(self, name: str, iterable: Iterable, attributes: Dict) -> Iterator:
+        # Lazy stages (streamed fetches, parsing) run inside next(), so only
+        # the time spent producing items is charged, as one span per iterator.
+        iterator = iter(iterable)
+        duration = self_time = 0.0
+        items = 0
+        try:
+            while True:
+                frame, start = self._enter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    item_duration, item_self_time = self._exit(frame, start)
+                    duration += item_duration
+                    self_time += item_self_time
+                items += 1
+                yield item
+        finally:
+            self.emit(Span(name, duration, self_time, {**attributes, "items": items}))
+
+
+class JsonLinesExporter:
+    def __init__(self, stream: IO):
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def __call__(self, span: Span):
+        record = {
+            "span": span.name,
+            "duration": round(span.duration, 6),
+            "self_time": round(span.self_time, 6),
+            "timestamp": round(time.time(), 3),
+            **span.attributes,
+        }
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock:
+            self.stream.write(line)
+            self.stream.flush()
+
+    def close(self):
+        with self._lock:
+            if not self.stream.closed:
+                self.stream.close()
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class PrometheusExporter:
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.tokens = defaultdict(int)
+        self.cost = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def __call__(self, span: Span):
+        with self._lock:
+            self.seconds[span.name] += span.self_time
+            self.calls[span.name] += 1
+            model = span.attributes.get("model")
+            if model is None:
+                return
+            for kind in ("prompt", "completion"):
+                tokens = span.attributes.get(f"{kind}_tokens")
+                if tokens:
+                    self.tokens[model, kind] += tokens
+            if span.attributes.get("cost_usd"):
+                self.cost[model] += span.attributes["cost_usd"]
+
+    def render(self) -> str:
+        with self._lock:
+            lines = [
+                "# HELP review_stage_seconds_total Time spent in each review stage, excluding nested stages.",
+                "# TYPE review_stage_seconds_total counter",
+            ]
+            lines += [
+                f'review_stage_seconds_total{{stage="{escape_label(stage)}"}} {seconds:.6f}'
+                for stage, seconds in sorted(self.seconds.items())
+            ]
+            lines += [
+                "# HELP review_stage_calls_total Number of times each review stage ran.",
+                "# TYPE review_stage_calls_total counter",
+            ]
+            lines += [
+                f'review_stage_calls_total{{stage="{escape_label(stage)}"}} {calls}'
+                for stage, calls in sorted(self.calls.items())
+            ]
+            lines += [
+                "# HELP review_model_tokens_total Tokens sent to and received from the model.",
+                "# TYPE review_model_tokens_total counter",
+            ]
+            lines += [
+                f'review_model_tokens_total{{model="{escape_label(model)}",kind="{kind}"}} {tokens}'
+                for (model, kind), tokens in sorted(self.tokens.items())
+            ]
+            lines += [
+                "# HELP review_model_cost_usd_total Estimated model cost in US dollars.",
+                "# TYPE review_model_cost_usd_total counter",
+            ]
+            lines += [
+                f'review_model_cost_usd_total{{model="{escape_label(model)}"}} {cost:.6f}'
+                for model, cost in sorted(self.cost.items())
+            ]
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        # Written once at exit in the textfile-collector format, replacing the
+        # previous file atomically so a scrape never sees half a file.
+        if self.path is None:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as output:
+            output.write(self.render())
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,306 @@
+import logging
+import os
+import random
+import threading
+import time
+from typing import Callable, Iterable, Iterator, List, Optional
+
+from review_common.chunking import estimate_tokens
+from review_common.instrumentation import Instrumentation, estimate_cost
+from review_common.rate_limit import TokenBucket
+from review_common.response_cache import ResponseCache
+from review_common.streaming import collect_stream
+
+logger = logging.getLogger(__name__)
+
+
+def retryable_errors(openai) -> tuple:
+    return (
+        openai.error.RateLimitError,
+        openai.error.APIError,
+        openai.error.APIConnectionError,
+        openai.error.ServiceUnavailableError,
+        openai.error.Timeout,
+        openai.error.TryAgain,
+    )
+
+
+class ModelRequestError(Exception):
+    pass
+
+
+class RequestCancelled(ModelRequestError):
+    pass
+
+
+def stop_on_cancel(chunks: Iterable, cancelled: threading.Event, received: List[int]) -> Iterator:
+    # Counts the chunks received in received[0]; each carries about one token.
+    # Closing the stream drops the connection, so the API stops generating
+    # the rest of the reply.
+    try:
+        for chunk in chunks:
+            if cancelled.is_set():
+                raise RequestCancelled("The request was cancelled mid-reply")
+            received[0] += 1
+            yield chunk
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(error, "headers", None) or {}
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class OpenAIClient:
+    def __init__(
+        self,
+        cache: Optional[ResponseCache] = None,
+        api_key: Optional[str] = None,
+        api_base: Optional[str] = None,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        max_retries: int = 5,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        instrumentation: Optional[Instrumentation] = None,
+    ):
+        self.cache = cache
+        self.api_key = api_key
+        self.api_base = api_base
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost_usd = 0.0
+        self.instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, cache: Optional[ResponseCache] = None) -> "OpenAIClient":
+        if cls is OpenAIClient and os.getenv("REVIEW_HEDGE", "0") == "1":
+            from review_common.hedging import HedgedClient
+
+            return HedgedClient.from_env(cache=cache)
+        return cls(
+            cache=cache,
+            api_key=os.getenv("OPENAI_API_KEY"),
+            api_base=os.getenv("OPENAI_API_BASE") or None,
+            requests_per_minute=float(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "0")) or None,
+            tokens_per_minute=float(os.getenv("OPENAI_TOKENS_PER_MINUTE", "0")) or None,
+            max_retries=int(os.getenv("OPENAI_MAX_RETRIES", "5")),
+            instrumentation=Instrumentation.from_env(),
+        )
+
+    def backoff_delay(self, attempt: int, error: Exception) -> float:
+        # Full jitter keeps parallel reviewers that were throttled together
+        # from retrying in lockstep.
+        delay = retry_after(error)
+        if delay is None:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return delay
+
+    def _throttle(self, estimated_tokens: int):
+        waited = 0.0
+        if self.request_bucket is not None:
+            waited += self.request_bucket.acquire()
+        if self.token_bucket is not None:
+            waited += self.token_bucket.acquire(estimated_tokens)
+        if waited:
+            with self._lock:
+                self.throttled += waited
+
+    def chat(
+        self,
+        system_prompt: str,
+        prompt: str,
+        model: str = "gpt-4",
+        temperature: float = 0.7,
+        max_tokens: int = 3000,
+        progress_callback: Optional[Callable[[str], None]] = None,
+        cancelled: Optional[threading.Event] = None,
+    ) -> str:
+        with self.instrumentation.span("model_call", model=model) as span:
+            return self._chat(
+                system_prompt, prompt, model, temperature, max_tokens, progress_callback, span, cancelled
+            )
+
+    def _chat(
+        self,
+        system_prompt: str,
+        prompt: str,
+        model: str,
+        temperature: float,
+        max_tokens: int,
+        progress_callback: Optional[Callable[[str], None]],
+        span: dict,
+        cancelled: Optional[threading.Event] = None,
+    ) -> str:
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(system_prompt, prompt, model, temperature, max_tokens)
+            cached = self.cache.get(cache_key)
+            span["cached"] = cached is not None
+            if cached is not None:
+                return cached
+
+        content = self.complete(
+            system_prompt, prompt, model, temperature, max_tokens, progress_callback, span, cancelled
+        )
+        if cache_key is not None and content:
+            self.cache.put(cache_key, content)
+        return content
+
+    def complete(
+        self,
+        system_prompt: str,
+        prompt: str,
+        model: str,
+        temperature: float,
+        max_tokens: int,
+        progress_callback: Optional[Callable[[str], None]],
+        span: dict,
+        cancelled: Optional[threading.Event] = None,
+    ) -> str:
+        # Sends one request, with retries, past the response cache. A set
+        # cancelled event stops it at the next throttle or retry, or between
+        # two chunks of the reply: a call that can be cancelled is streamed,
+        # so it can be dropped mid-reply instead of being billed in full.
+        # openai is the slowest dependency to import, so it is only loaded once
+        # a request actually has to be sent.
+        import openai
+
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt},
+        ]
+        # Rate limits count the prompt plus the completion the request may use.
+        estimated_tokens = estimate_tokens(system_prompt) + estimate_tokens(prompt) + max_tokens
+
+        # A streamed reply that fails after lines were shown is not retried:
+        # the caller would see those lines printed twice.
+        emitted = []
+
+        def emit(line: str):
+            emitted.append(len(line))
+            progress_callback(line)
+
+        stream = progress_callback is not None or cancelled is not None
+        received = [0]
+        attempt = 0
+        while True:
+            if cancelled is not None and cancelled.is_set():
+                raise RequestCancelled("The request was cancelled")
+            with self.instrumentation.span("rate_limit_wait"):
+                self._throttle(estimated_tokens)
+            with self._lock:
+                self.requests += 1
+            try:
+                started = time.perf_counter()
+                response = openai.ChatCompletion.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    stream=stream,
+                    api_base=self.api_base,
+                    # Passed per request, so clients for different backends
+                    # can share the process.
+                    api_key=self.api_key,
+                )
+                if cancelled is not None:
+                    response = stop_on_cancel(response, cancelled, received)
+                if stream:
+                    content = collect_stream(response, emit if progress_callback else lambda line: None, started).text
+                else:
+                    content = response["choices"][0]["message"]["content"]
+                break
+            except RequestCancelled:
+                # The prompt and the part of the reply already sent are billed.
+                prompt_tokens = estimated_tokens - max_tokens
+                cost = self.record_usage(model, prompt_tokens, received[0])
+                span.update(
+                    attempts=attempt + 1,
+                    prompt_tokens=prompt_tokens,
+                    completion_tokens=received[0],
+                    total_tokens=prompt_tokens + received[0],
+                    estimated=True,
+                    cost_usd=cost,
+                    cancelled=True,
+                )
+                raise
+            except retryable_errors(openai) as e:
+                if emitted:
+                    logger.error(f"Streamed reply from OpenAI API failed after {len(emitted)} line(s) were shown: {e}")
+                    raise ModelRequestError(f"Error calling OpenAI API while streaming: {e}") from e
+                if attempt >= self.max_retries:
+                    logger.error(f"Error calling OpenAI API after {attempt + 1} attempt(s): {e}")
+                    raise ModelRequestError(f"Error calling OpenAI API: {e}") from e
+                delay = self.backoff_delay(attempt, e)
+                logger.warning(f"OpenAI API call failed ({e}), retrying in {delay:.1f}s")
+                with self._lock:
+                    self.retries += 1
+                with self.instrumentation.span("retry_backoff", error=type(e).__name__):
+                    if cancelled is not None:
+                        cancelled.wait(delay)
+                    else:
+                        time.sleep(delay)
+                attempt += 1
+            except openai.OpenAIError as e:
+                logger.error(f"Error calling OpenAI API: {e}")
+                raise ModelRequestError(f"Error calling OpenAI API: {e}") from e
+
+        # Streamed completions carry no usage, so their tokens are estimated.
+        usage = response.get("usage") if not stream else None
+        if usage and self.token_bucket is not None:
+            self.token_bucket.release(max(0, estimated_tokens - usage["total_tokens"]))
+        prompt_tokens = (usage or {}).get("prompt_tokens") or estimated_tokens - max_tokens
+        completion_tokens = (usage or {}).get("completion_tokens") or estimate_tokens(content)
+        cost = self.record_usage(model, prompt_tokens, completion_tokens)
+        span.update(
+            attempts=attempt + 1,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+            estimated=not (usage and "prompt_tokens" in usage),
+            cost_usd=cost,
+        )
+
+        return content.strip()
+
+    def record_usage(self, model: str, prompt_tokens: int, completion_tokens: int) -> Optional[float]:
+        cost = estimate_cost(model, prompt_tokens, completion_tokens)
+        with self._lock:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cost_usd += cost or 0.0
+        return cost
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "throttled_seconds": round(self.throttled, 2),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cost_usd": round(self.cost_usd, 4),
+        }
+
+    def usage_summary(self) -> str:
+        return (
+            f"Model usage: {self.requests} request(s), {self.retries} retried, "
+            f"{self.prompt_tokens} prompt + {self.completion_tokens} completion tokens, "
+            f"~${self.cost_usd:.4f}"
+        )
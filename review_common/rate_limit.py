@@ -0,0 +1,59 @@
+import threading
+import time
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute: float):
+        if requests_per_minute <= 0:
+            raise ValueError("requests_per_minute must be positive")
+        self.interval = 60.0 / requests_per_minute
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        # Reserve the next free slot under the lock, then sleep outside it so
+        # other threads can queue up behind us. Returns the time spent waiting.
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+
+class TokenBucket:
+    def __init__(self, capacity_per_minute: float):
+        if capacity_per_minute <= 0:
+            raise ValueError("capacity_per_minute must be positive")
+        self.capacity = capacity_per_minute
+        self.rate = capacity_per_minute / 60.0
+        self._tokens = capacity_per_minute
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, amount: float = 1) -> float:
+        # The balance may go negative: each caller takes its share straight
+        # away and sleeps until the bucket has refilled past it, so waiting
+        # callers are served in arrival order. Returns the time spent waiting.
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= amount
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def release(self, amount: float):
+        # Returns tokens that were reserved but not used, e.g. when a request
+        # turned out smaller than its estimate.
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.capacity, self._tokens + amount)
@@ -0,0 +1,244 @@
+import json
+import re
+from abc import ABC, abstractmethod
+from typing import IO, Iterator, List, NamedTuple, Optional, Sequence
+
+OUTPUT_FORMATS = ("text", "markdown", "jsonl", "sarif")
+
+SARIF_SCHEMA = "https://json.schemastore.org/sarif-2.1.0.json"
+SARIF_RULE_ID = "review-comment"
+TOOL_NAME = "gpt-code-analyzer"
+
+RE_HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+RE_BULLET = re.compile(r"^(\s*)(?:[-*+]|\d+[.)])\s+(.*)$")
+RE_PART = re.compile(r"^Part \d+/\d+:\s*(.*)$")
+RE_CODE_SPAN = re.compile(r"`([^`\s]+)`")
+RE_PATH = re.compile(r"^(?:[\w.-]+/)*[\w.-]*\w\.[A-Za-z0-9]+(?::(\d+))?$")
+RE_LINE = re.compile(r"\blines?\s+(\d+)", re.IGNORECASE)
+
+
+def markdown_to_text(text: str) -> str:
+    # markdown and html2text are only needed once there is a review to print,
+    # so they are not imported with the reviewer modules.
+    from html2text import html2text
+    from markdown import markdown
+
+    return html2text(markdown(text)).strip()
+
+
+class Finding(NamedTuple):
+    path: Optional[str]
+    line: Optional[int]
+    message: str
+
+
+def heading_paths(heading: str) -> List[str]:
+    # Map-reduce reviews use "Part i/N: a.py, b.py" headings and incremental
+    # reviews use one heading per file path.
+    match = RE_PART.match(heading)
+    candidates = match.group(1).split(",") if match else [heading]
+    paths = [candidate.strip().strip("`") for candidate in candidates]
+    if all(RE_PATH.match(path) for path in paths):
+        return paths
+    return []
+
+
+def locate_finding(message: str, paths: Sequence[str], default_path: Optional[str]) -> Finding:
+    path = next((path for path in paths if path in message), None)
+    if path is None and len(paths) == 1:
+        path = paths[0]
+    line = None
+    for span in RE_CODE_SPAN.findall(message):
+        match = RE_PATH.match(span)
+        if match and (path is None or span.split(":")[0] == path):
+            path = span.split(":")[0]
+            line = int(match.group(1)) if match.group(1) else None
+            break
+    if line is None:
+        match = RE_LINE.search(message)
+        line = int(match.group(1)) if match else None
+    return Finding(path or default_path, line, message)
+
+
+def extract_findings(review: str, default_path: Optional[str] = None) -> Iterator[Finding]:
+    section_level = 0
+    paths: List[str] = []
+    current: List[str] = []
+    found = False
+
+    def flush():
+        message = "\n".join(current).strip()
+        current.clear()
+        if message:
+            return locate_finding(message, paths, default_path)
+        return None
+
+    # Top-level bullets become findings; nested bullets and continuation lines
+    # stay with the bullet they belong to.
+    for line in review.splitlines():
+        heading = RE_HEADING.match(line)
+        bullet = RE_BULLET.match(line)
+        if heading:
+            finding = flush()
+            if finding:
+                yield finding
+            level = len(heading.group(1))
+            heading_file_paths = heading_paths(heading.group(2))
+            if heading_file_paths:
+                section_level, paths = level, heading_file_paths
+            elif level <= section_level:
+                section_level, paths = 0, []
+        elif bullet and not bullet.group(1):
+            finding = flush()
+            if finding:
+                yield finding
+            current.append(bullet.group(2))
+            found = True
+        elif current and line.startswith((" ", "\t")):
+            current.append(line.strip())
+        elif current and not line.strip():
+            current.append("")
+        elif current and current[-1]:
+            current.append(line.strip())
+        elif current:
+            # An unindented paragraph after a blank line closes the list.
+            finding = flush()
+            if finding:
+                yield finding
+    finding = flush()
+    if finding:
+        yield finding
+
+    if not found and review.strip():
+        yield Finding(default_path, None, review.strip())
+
+
+class ReviewRenderer(ABC):
+    def __init__(self, stream: IO):
+        self.stream = stream
+
+    def begin(self):
+        pass
+
+    @abstractmethod
+    def write(self, source: str, review: str, default_path: Optional[str] = None):
+        pass
+
+    @abstractmethod
+    def error(self, source: str, message: str):
+        pass
+
+    def end(self):
+        self.stream.flush()
+
+
+class TextRenderer(ReviewRenderer):
+    def write(self, source: str, review: str, default_path: Optional[str] = None):
+        self.stream.write(f"\nCode Review Results for {source}:\n{markdown_to_text(review)}\n")
+        self.stream.flush()
+
+    def error(self, source: str, message: str):
+        self.stream.write(f"\nCould not review {source}: {message}\n")
+        self.stream.flush()
+
+
+class MarkdownRenderer(ReviewRenderer):
+    def write(self, source: str, review: str, default_path: Optional[str] = None):
+        self.stream.write(f"## {source}\n\n{review.strip()}\n\n")
+        self.stream.flush()
+
+    def error(self, source: str, message: str):
+        self.stream.write(f"## {source}\n\n_Could not review: {message}_\n\n")
+        self.stream.flush()
+
+
+class JsonLinesRenderer(ReviewRenderer):
+    def write(self, source: str, review: str, default_path: Optional[str] = None):
+        for finding in extract_findings(review, default_path):
+            record = {"source": source, **finding._asdict()}
+            self.stream.write(json.dumps(record) + "\n")
+        self.stream.flush()
+
+    def error(self, source: str, message: str):
+        self.stream.write(json.dumps({"source": source, "error": message}) + "\n")
+        self.stream.flush()
+
+
+class SarifRenderer(ReviewRenderer):
+    def __init__(self, stream: IO):
+        super().__init__(stream)
+        self.results = 0
+        self.notifications: List[dict] = []
+
+    def begin(self):
+        # The log is written as results arrive; only the closing brackets and
+        # the (small) list of failures wait for end().
+        driver = {
+            "name": TOOL_NAME,
+            "rules": [
+                {
+                    "id": SARIF_RULE_ID,
+                    "shortDescription": {"text": "Code review comment"},
+                }
+            ],
+        }
+        self.stream.write(
+            f'{{"version": "2.1.0", "$schema": {json.dumps(SARIF_SCHEMA)}, "runs": [{{'
+            f'"tool": {{"driver": {json.dumps(driver)}}}, "results": ['
+        )
+
+    def write(self, source: str, review: str, default_path: Optional[str] = None):
+        for finding in extract_findings(review, default_path):
+            result = {
+                "ruleId": SARIF_RULE_ID,
+                "level": "warning",
+                "message": {"text": finding.message},
+                "properties": {"source": source},
+            }
+            if finding.path:
+                location = {"artifactLocation": {"uri": finding.path}}
+                if finding.line:
+                    location["region"] = {"startLine": finding.line}
+                result["locations"] = [{"physicalLocation": location}]
+            self.stream.write(("," if self.results else "") + "\n" + json.dumps(result))
+            self.results += 1
+        self.stream.flush()
+
+    def error(self, source: str, message: str):
+        self.notifications.append(
+            {"level": "error", "message": {"text": f"Could not review {source}: {message}"}}
+        )
+
+    def end(self):
+        invocation = {
+            "executionSuccessful": not self.notifications,
+            "toolExecutionNotifications": self.notifications,
+        }
+        self.stream.write(f'\n], "invocations": [{json.dumps(invocation)}]}}]}}\n')
+        self.stream.flush()
+
+
+RENDERERS = {
+    "text": TextRenderer,
+    "markdown": MarkdownRenderer,
+    "jsonl": JsonLinesRenderer,
+    "sarif": SarifRenderer,
+}
+
+
+def make_renderer(output_format: str, stream: IO) -> ReviewRenderer:
+    try:
+        return RENDERERS[output_format](stream)
+    except KeyError:
+        raise ValueError(
+            f"Unknown output format {output_format!r}, expected one of {', '.join(OUTPUT_FORMATS)}"
+        ) from None
+
+
+def render_review(
+    output_format: str, stream: IO, source: str, review: str, default_path: Optional[str] = None
+):
+    renderer = make_renderer(output_format, stream)
+    renderer.begin()
+    renderer.write(source, review, default_path)
+    renderer.end()
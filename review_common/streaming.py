@@ -0,0 +1,43 @@
+import logging
+import time
+from typing import Callable, Iterable, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class StreamedCompletion(NamedTuple):
+    text: str
+    time_to_first_token: Optional[float]
+    total_time: float
+
+
+def collect_stream(
+    chunks: Iterable,
+    progress_callback: Callable[[str], None],
+    started: Optional[float] = None,
+) -> StreamedCompletion:
+    # Hands complete lines to progress_callback as they arrive, so callers
+    # that print don't end up with one token per line.
+    if started is None:
+        started = time.perf_counter()
+    time_to_first_token = None
+    parts = []
+    pending = ""
+
+    for chunk in chunks:
+        delta = chunk["choices"][0].get("delta", {}).get("content")
+        if not delta:
+            continue
+        if time_to_first_token is None:
+            time_to_first_token = time.perf_counter() - started
+            logger.info(f"Time to first token: {time_to_first_token:.2f}s")
+        parts.append(delta)
+        pending += delta
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            progress_callback(line)
+
+    if pending:
+        progress_callback(pending)
+
+    return StreamedCompletion("".join(parts), time_to_first_token, time.perf_counter() - started)
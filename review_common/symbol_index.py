@@ -0,0 +1,531 @@
+import ast
+import builtins
+import hashlib
+import keyword
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from review_common.ast_chunking import first_line, is_python_file
+from review_common.chunking import estimate_tokens
+from review_common.git_source import GitError, run_git
+from review_common.response_cache import DEFAULT_CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever the stored layout changes, so old indexes are rebuilt.
+INDEX_VERSION = 1
+DEFAULT_CONTEXT_TOKENS = 1500
+# Walking the tree takes time in proportion to its size, so a long-running
+# reviewer walks it at most this often unless git has changed the checkout.
+DEFAULT_REFRESH_INTERVAL = 60.0
+# git rewrites these on a checkout, commit, merge or pull.
+GIT_MARKER_FILES = ("HEAD", "index")
+# Names defined in more places than this (get, run, __init__...) say too
+# little about which definition a hunk means.
+MAX_DEFINITIONS_PER_NAME = 3
+MAX_CALLERS = 5
+MAX_DOCSTRING_LINES = 6
+MAX_SUMMARY_LINES = 40
+SKIPPED_DIRS = {".git", ".hg", ".svn", ".tox", ".nox", ".venv", "venv", "env", "node_modules", "__pycache__", "build", "dist"}
+# SQLite limits the number of parameters in one statement.
+QUERY_BATCH = 500
+
+RE_FILE = re.compile(r"^\+\+\+ (?:b/)?(\S+)")
+RE_HUNK = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@")
+# Calls, and capitalised names used as types, bases or constructors.
+RE_CALL = re.compile(r"([A-Za-z_]\w*)\s*\(")
+RE_TYPE_NAME = re.compile(r"\b([A-Z]\w*)")
+RE_DEFINITION = re.compile(r"^\s*(?:async\s+def|def|class)\s+([A-Za-z_]\w*)")
+IGNORED_NAMES = set(keyword.kwlist) | set(dir(builtins)) | {"self", "cls"}
+
+CONTEXT_HEADING = "Definitions the changed code refers to, from the rest of the repository (for context only, not under review):"
+
+
+class Symbol(NamedTuple):
+    name: str
+    qualname: str
+    path: str
+    start: int
+    end: int
+    kind: str
+    summary: str
+
+
+class HunkRefs(NamedTuple):
+    path: str
+    start: int
+    end: int
+    names: Set[str]
+    defined: Set[str]
+
+
+class IndexUpdate(NamedTuple):
+    files: int
+    parsed: int
+    removed: int
+    symbols: int
+    seconds: float
+
+    def summary(self) -> str:
+        return (
+            f"Symbol index: {self.files} file(s), {self.parsed} parsed, {self.removed} removed, "
+            f"{self.symbols} definition(s), updated in {self.seconds:.2f}s"
+        )
+
+
+class LookupStats:
+    def __init__(self):
+        self.lookups = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.definitions = 0
+        self.callers = 0
+        self.tokens = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, definitions: int, callers: int, tokens: int):
+        with self._lock:
+            self.lookups += 1
+            self.seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+            self.definitions += definitions
+            self.callers += callers
+            self.tokens += tokens
+
+    def summary(self) -> str:
+        average = 1000 * self.seconds / self.lookups if self.lookups else 0.0
+        return (
+            f"Symbol index: {self.lookups} lookup(s), {average:.1f}ms average, {1000 * self.max_seconds:.1f}ms max; "
+            f"{self.definitions} definition(s) and {self.callers} caller list(s) added, ~{self.tokens} tokens"
+        )
+
+
+def source_lines(lines: List[str], start: int, end: int) -> List[str]:
+    return lines[start - 1 : end]
+
+
+def signature_lines(node: ast.AST, lines: List[str]) -> List[str]:
+    # Decorators and the def/class statement, however many lines it spans.
+    body_start = node.body[0].lineno
+    return source_lines(lines, first_line(node), body_start - 1 if body_start > node.lineno else node.lineno)
+
+
+def header_lines(node: ast.AST, lines: List[str]) -> List[str]:
+    body = node.body
+    header = signature_lines(node, lines)
+    if body[0].lineno > node.lineno and ast.get_docstring(node, clean=False) is not None:
+        docstring = source_lines(lines, body[0].lineno, body[0].end_lineno)
+        if len(docstring) > MAX_DOCSTRING_LINES:
+            docstring = docstring[: MAX_DOCSTRING_LINES - 1] + [docstring[-1]]
+        header += docstring
+    return header
+
+
+def body_indent(node: ast.AST, lines: List[str]) -> str:
+    line = lines[node.body[0].lineno - 1]
+    return line[: len(line) - len(line.lstrip())]
+
+
+def one_line_signature(node: ast.AST, lines: List[str]) -> List[str]:
+    # Decorators, then the def statement folded onto one line.
+    decorators = source_lines(lines, first_line(node), node.lineno - 1)
+    statement = source_lines(lines, node.lineno, max(node.lineno, node.body[0].lineno - 1))
+    text = ""
+    for part in (line.strip() for line in statement):
+        if not part or part.startswith("#"):
+            continue
+        text += part if not text or text.endswith(("(", "[")) or part.startswith((")", "]")) else " " + part
+    indent = statement[0][: len(statement[0]) - len(statement[0].lstrip())]
+    return decorators + [indent + text.replace(",)", ")").replace(", )", ")")]
+
+
+def summarize(node: ast.AST, lines: List[str]) -> str:
+    summary = header_lines(node, lines)
+    if isinstance(node, ast.ClassDef):
+        for child in node.body:
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                summary += one_line_signature(child, lines)
+    else:
+        summary.append(body_indent(node, lines) + "...")
+    if len(summary) > MAX_SUMMARY_LINES:
+        summary = summary[:MAX_SUMMARY_LINES] + [body_indent(node, lines) + "# ..."]
+    return "\n".join(summary)
+
+
+def extract_symbols(path: str, source: str) -> Tuple[List[Symbol], List[Tuple[str, int]]]:
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError) as e:
+        logger.debug(f"Cannot parse {path}, indexing nothing from it: {e}")
+        return [], []
+    lines = source.splitlines()
+    symbols = []
+
+    def visit(nodes, prefix: str):
+        for node in nodes:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                kind = "class" if isinstance(node, ast.ClassDef) else ("method" if prefix else "function")
+                symbols.append(
+                    Symbol(
+                        node.name,
+                        prefix + node.name,
+                        path,
+                        first_line(node),
+                        node.end_lineno,
+                        kind,
+                        summarize(node, lines),
+                    )
+                )
+                if isinstance(node, ast.ClassDef):
+                    visit(node.body, f"{prefix}{node.name}.")
+
+    visit(tree.body, "")
+    return symbols, sorted(call_references(tree))
+
+
+def call_references(tree: ast.AST) -> Set[Tuple[str, int]]:
+    # ast.walk would also visit every Load/Store context and constant, which
+    # roughly doubles the time spent indexing a large checkout.
+    references = set()
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if not isinstance(node, ast.AST):
+            continue
+        if isinstance(node, ast.Call):
+            function = node.func
+            name = function.id if isinstance(function, ast.Name) else getattr(function, "attr", None)
+            if name:
+                references.add((name, node.lineno))
+        for field in node._fields:
+            value = getattr(node, field, None)
+            if isinstance(value, list):
+                stack.extend(value)
+            elif isinstance(value, ast.AST) and not isinstance(value, (ast.expr_context, ast.Constant)):
+                stack.append(value)
+    return references
+
+
+def iter_python_files(root: str) -> Iterator[str]:
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories[:] = sorted(name for name in subdirectories if name not in SKIPPED_DIRS and not name.startswith("."))
+        for name in sorted(files):
+            if is_python_file(name):
+                yield os.path.join(directory, name)
+
+
+def parse_diff_refs(diff_text: str) -> List[HunkRefs]:
+    # Works on the rendered unidiff text of a prompt, so whole diffs and
+    # chunks are handled alike. Only changed lines count as references.
+    hunks: List[HunkRefs] = []
+    path = None
+    for line in diff_text.splitlines():
+        file_match = RE_FILE.match(line)
+        if file_match:
+            path = None if file_match.group(1) == "/dev/null" else file_match.group(1)
+            continue
+        hunk_match = RE_HUNK.match(line)
+        if hunk_match and path is not None:
+            start = int(hunk_match.group(1))
+            length = int(hunk_match.group(2) or 1)
+            hunks.append(HunkRefs(path, start, start + max(length, 1) - 1, set(), set()))
+            continue
+        if not hunks or line.startswith(("---", "+++")) or not line.startswith(("+", "-")):
+            continue
+        code = line[1:].split("#", 1)[0]
+        names = set(RE_CALL.findall(code)) | {name for name in RE_TYPE_NAME.findall(code) if not name.isupper()}
+        hunks[-1].names.update(names - IGNORED_NAMES)
+        definition = RE_DEFINITION.match(code)
+        if definition:
+            hunks[-1].defined.add(definition.group(1))
+    return hunks
+
+
+class SymbolIndex:
+    def __init__(
+        self,
+        root: str,
+        index_dir: str,
+        max_context_tokens: int = DEFAULT_CONTEXT_TOKENS,
+        refresh_interval: float = DEFAULT_REFRESH_INTERVAL,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.root = os.path.realpath(root)
+        digest = hashlib.sha256(self.root.encode("utf-8")).hexdigest()[:16]
+        os.makedirs(index_dir, exist_ok=True)
+        self.path = os.path.join(index_dir, f"{digest}.sqlite3")
+        self.max_context_tokens = max_context_tokens
+        self.stats = LookupStats()
+        self.refresh_interval = refresh_interval
+        self.clock = clock
+        self._refreshed_at: Optional[float] = None
+        self._git_marker = None
+        self._update_lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+            if row is None or row[0] != str(INDEX_VERSION):
+                for table in ("files", "symbols", "refs"):
+                    conn.execute(f"DROP TABLE IF EXISTS {table}")
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (str(INDEX_VERSION),))
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, digest TEXT)"
+            )
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS symbols (
+                    name TEXT NOT NULL,
+                    qualname TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    start INTEGER NOT NULL,
+                    end INTEGER NOT NULL,
+                    kind TEXT NOT NULL,
+                    summary TEXT NOT NULL
+                )"""
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS refs (name TEXT NOT NULL, path TEXT NOT NULL, line INTEGER NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS symbols_name ON symbols (name)")
+            conn.execute("CREATE INDEX IF NOT EXISTS symbols_path ON symbols (path)")
+            conn.execute("CREATE INDEX IF NOT EXISTS refs_name ON refs (name)")
+            conn.execute("CREATE INDEX IF NOT EXISTS refs_path ON refs (path)")
+
+    @classmethod
+    def from_env(cls, root: Optional[str] = None) -> Optional["SymbolIndex"]:
+        # Pull request reviews have no checkout of their own: they use
+        # REVIEW_SYMBOL_ROOT, and only while it is at the pull request head.
+        if os.getenv("REVIEW_SYMBOLS", "0") != "1":
+            return None
+        root = os.getenv("REVIEW_SYMBOL_ROOT") or root
+        if not root or not os.path.isdir(root):
+            logger.warning("REVIEW_SYMBOLS is set but there is no checkout to index; set REVIEW_SYMBOL_ROOT")
+            return None
+        cache_dir = os.path.expanduser(os.getenv("REVIEW_CACHE_DIR", DEFAULT_CACHE_DIR))
+        return cls(
+            root,
+            index_dir=os.path.join(cache_dir, "symbols"),
+            max_context_tokens=int(os.getenv("REVIEW_SYMBOL_TOKENS", str(DEFAULT_CONTEXT_TOKENS))),
+            refresh_interval=float(os.getenv("REVIEW_SYMBOL_REFRESH", str(DEFAULT_REFRESH_INTERVAL))),
+        )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def update(self) -> IndexUpdate:
+        # Files whose mtime and size are unchanged are not read at all; a
+        # changed mtime with the same content hash is not parsed again.
+        start = time.perf_counter()
+        with self._connect() as conn:
+            known = {row[0]: row[1:] for row in conn.execute("SELECT path, mtime_ns, size, digest FROM files")}
+        seen = set()
+        touched, parsed = [], []
+        for full_path in iter_python_files(self.root):
+            path = os.path.relpath(full_path, self.root).replace(os.sep, "/")
+            try:
+                stat = os.stat(full_path)
+            except OSError:
+                continue
+            seen.add(path)
+            previous = known.get(path)
+            if previous is not None and previous[:2] == (stat.st_mtime_ns, stat.st_size):
+                continue
+            try:
+                with open(full_path, "rb") as source_file:
+                    data = source_file.read()
+            except OSError:
+                continue
+            digest = hashlib.sha256(data).hexdigest()
+            if previous is not None and previous[2] == digest:
+                touched.append((stat.st_mtime_ns, stat.st_size, path))
+                continue
+            symbols, references = extract_symbols(path, data.decode("utf-8", "replace"))
+            parsed.append((path, stat.st_mtime_ns, stat.st_size, digest, symbols, references))
+        removed = [path for path in known if path not in seen]
+
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany("UPDATE files SET mtime_ns = ?, size = ? WHERE path = ?", touched)
+                for path in removed + [entry[0] for entry in parsed]:
+                    conn.execute("DELETE FROM files WHERE path = ?", (path,))
+                    conn.execute("DELETE FROM symbols WHERE path = ?", (path,))
+                    conn.execute("DELETE FROM refs WHERE path = ?", (path,))
+                for path, mtime_ns, size, digest, symbols, references in parsed:
+                    conn.execute("INSERT INTO files VALUES (?, ?, ?, ?)", (path, mtime_ns, size, digest))
+                    conn.executemany("INSERT INTO symbols VALUES (?, ?, ?, ?, ?, ?, ?)", symbols)
+                    conn.executemany("INSERT INTO refs VALUES (?, ?, ?)", [(name, path, line) for name, line in references])
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            total = conn.execute("SELECT COUNT(*) FROM symbols").fetchone()[0]
+        return IndexUpdate(len(seen), len(parsed), len(removed), total, time.perf_counter() - start)
+
+    def git_marker(self) -> Tuple:
+        # Cheap to read on every review, unlike a walk of the tree.
+        marker = []
+        for name in GIT_MARKER_FILES:
+            try:
+                stat = os.stat(os.path.join(self.root, ".git", name))
+            except OSError:
+                marker.append(None)
+                continue
+            marker.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(marker)
+
+    def revision(self) -> Optional[str]:
+        # The commit checked out at root, or None when it is not a git checkout.
+        try:
+            return run_git(["rev-parse", "HEAD"], repo=self.root).strip()
+        except GitError:
+            return None
+
+    def refresh(self) -> Optional[IndexUpdate]:
+        # Called before every review. The tree is walked again only once
+        # refresh_interval has passed or git has changed the checkout, so a
+        # watcher or daemon handling a stream of events does not walk it for
+        # each one. Reviews that start while another one is updating wait for
+        # it and use its result.
+        if not self._update_lock.acquire(blocking=False):
+            with self._update_lock:
+                return None
+        try:
+            now = self.clock()
+            marker = self.git_marker()
+            if (
+                self._refreshed_at is not None
+                and now - self._refreshed_at < self.refresh_interval
+                and marker == self._git_marker
+            ):
+                return None
+            update = self.update()
+            self._refreshed_at, self._git_marker = now, marker
+        finally:
+            self._update_lock.release()
+        logger.info(update.summary())
+        return update
+
+    def definitions(self, names: Iterable[str], paths: Iterable[str] = ()) -> Dict[str, List[Symbol]]:
+        # Names defined in more than MAX_DEFINITIONS_PER_NAME places are only
+        # resolved within the given paths; their other definitions are never
+        # loaded.
+        names = sorted(set(names))
+        paths = sorted(set(paths))
+        found: Dict[str, List[Symbol]] = {}
+        with self._connect() as conn:
+            for index in range(0, len(names), QUERY_BATCH):
+                batch = names[index : index + QUERY_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                counts = conn.execute(
+                    f"SELECT name, COUNT(*) FROM symbols WHERE name IN ({placeholders}) GROUP BY name", batch
+                ).fetchall()
+                unambiguous = [name for name, count in counts if count <= MAX_DEFINITIONS_PER_NAME]
+                ambiguous = [name for name, count in counts if count > MAX_DEFINITIONS_PER_NAME]
+                queries = []
+                if unambiguous:
+                    queries.append(
+                        (f"SELECT * FROM symbols WHERE name IN ({','.join('?' * len(unambiguous))})", unambiguous)
+                    )
+                if ambiguous and paths:
+                    queries.append(
+                        (
+                            f"SELECT * FROM symbols WHERE name IN ({','.join('?' * len(ambiguous))}) "
+                            f"AND path IN ({','.join('?' * len(paths))})",
+                            ambiguous + paths,
+                        )
+                    )
+                for query, parameters in queries:
+                    for row in conn.execute(query, parameters):
+                        found.setdefault(row[0], []).append(Symbol(*row))
+        return found
+
+    def callers(self, name: str, limit: int = MAX_CALLERS) -> Tuple[List[Tuple[str, int]], int]:
+        with self._connect() as conn:
+            total = conn.execute("SELECT COUNT(*) FROM refs WHERE name = ?", (name,)).fetchone()[0]
+            rows = conn.execute(
+                "SELECT path, line FROM refs WHERE name = ? ORDER BY path, line LIMIT ?", (name, limit)
+            ).fetchall()
+        return rows, total
+
+    def context_for_diff(self, diff_text: str, max_tokens: Optional[int] = None) -> str:
+        start = time.perf_counter()
+        max_tokens = self.max_context_tokens if max_tokens is None else max_tokens
+        hunks = parse_diff_refs(diff_text)
+        # Names a hunk defines itself are not looked up elsewhere.
+        changed_paths = {hunk.path for hunk in hunks}
+        found = self.definitions((name for hunk in hunks for name in hunk.names - hunk.defined), changed_paths)
+
+        def visible(symbol: Symbol) -> bool:
+            # Definitions that the diff itself shows are left out.
+            return any(
+                hunk.path == symbol.path and symbol.start <= hunk.end and symbol.end >= hunk.start for hunk in hunks
+            )
+
+        # Definitions in the changed file come first, then its package, then
+        # the rest of the repository.
+        changed_dirs = {os.path.dirname(path) for path in changed_paths}
+        selected: Dict[Tuple[str, str], Symbol] = {}
+        for name, symbols in found.items():
+            if len(symbols) > MAX_DEFINITIONS_PER_NAME:
+                continue
+            for symbol in symbols:
+                if not visible(symbol):
+                    selected[(symbol.path, symbol.qualname)] = symbol
+        # A class summary already lists its methods' signatures.
+        for path, qualname in list(selected):
+            if "." in qualname and (path, qualname.rsplit(".", 1)[0]) in selected:
+                del selected[(path, qualname)]
+        ranked = sorted(
+            selected.values(),
+            key=lambda symbol: (
+                symbol.path not in changed_paths,
+                os.path.dirname(symbol.path) not in changed_dirs,
+                symbol.path,
+                symbol.start,
+            ),
+        )
+
+        blocks, tokens = [], 0
+        for symbol in ranked:
+            block = f"# {symbol.path}:{symbol.start} ({symbol.kind} {symbol.qualname})\n{symbol.summary}"
+            block_tokens = estimate_tokens(block)
+            if tokens + block_tokens > max_tokens:
+                continue
+            blocks.append(block)
+            tokens += block_tokens
+
+        # Callers elsewhere of the definitions a hunk changes, which a
+        # signature change would break.
+        caller_lines = []
+        for hunk in hunks:
+            for name in sorted(hunk.defined):
+                rows, total = self.callers(name)
+                listed = len(rows)
+                rows = [(path, line) for path, line in rows if not (path == hunk.path and hunk.start <= line <= hunk.end)]
+                if not rows:
+                    continue
+                sites = ", ".join(f"`{path}:{line}`" for path, line in rows)
+                more = f" and {total - listed} more" if total > listed else ""
+                text = f"- `{name}` is called from {sites}{more}"
+                if tokens + estimate_tokens(text) > max_tokens:
+                    break
+                caller_lines.append(text)
+                tokens += estimate_tokens(text)
+
+        sections = []
+        if blocks:
+            sections.append(CONTEXT_HEADING + "\n```python\n" + "\n\n".join(blocks) + "\n```")
+        if caller_lines:
+            sections.append("Call sites of the changed definitions:\n" + "\n".join(caller_lines))
+        self.stats.record(time.perf_counter() - start, len(blocks), len(caller_lines), tokens)
+        return "\n\n".join(sections)
@@ -0,0 +1,213 @@
+import fnmatch
+import logging
+import os
+import re
+import threading
+from collections import Counter
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+if TYPE_CHECKING:
+    from unidiff import PatchedFile
+
+from review_common.chunking import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Patterns without a "/" match the file name anywhere in the tree; patterns
+# with one match the whole path.
+DEFAULT_EXCLUDE_GLOBS = (
+    # Lockfiles
+    "package-lock.json",
+    "npm-shrinkwrap.json",
+    "yarn.lock",
+    "pnpm-lock.yaml",
+    "poetry.lock",
+    "Pipfile.lock",
+    "uv.lock",
+    "Cargo.lock",
+    "Gemfile.lock",
+    "composer.lock",
+    "go.sum",
+    "mix.lock",
+    "pubspec.lock",
+    "Podfile.lock",
+    "packages.lock.json",
+    # Vendored trees
+    "vendor/*",
+    "*/vendor/*",
+    "third_party/*",
+    "*/third_party/*",
+    "node_modules/*",
+    "*/node_modules/*",
+    # Minified bundles and source maps
+    "*.min.js",
+    "*.min.css",
+    "*.bundle.js",
+    "*.map",
+    # Generated code
+    "*_pb2.py",
+    "*_pb2_grpc.py",
+    "*.pb.go",
+    "*.pb.cc",
+    "*.pb.h",
+    "*.g.dart",
+    "*.designer.cs",
+    # Snapshots
+    "*.snap",
+    "*/__snapshots__/*",
+)
+
+# Generators write "DO NOT EDIT" in capitals; a lower-case "do not edit"
+# is usually a note in a hand-written comment.
+GENERATED_MARKER = re.compile(
+    r"@generated|(?-i:DO NOT EDIT)|code generated by|auto-?generated|generated by the protocol buffer compiler",
+    re.IGNORECASE,
+)
+# Generated-file markers live in the first few lines of a file.
+GENERATED_MARKER_LINES = 10
+# A file is minified when lines over the length limit make up more than this
+# share of its text, not when it holds a single long string or data line.
+MINIFIED_SHARE = 0.5
+
+
+def compile_globs(globs: Sequence[str]) -> Optional["re.Pattern"]:
+    if not globs:
+        return None
+    return re.compile("|".join(fnmatch.translate(glob) for glob in globs))
+
+
+def is_minified(line_lengths: Iterable[int], max_line_length: Optional[int]) -> bool:
+    if max_line_length is None:
+        return False
+    total = long = 0
+    for length in line_lengths:
+        total += length
+        if length > max_line_length:
+            long += length
+    return long > MINIFIED_SHARE * total
+
+
+def skipped_section(skipped: List[Tuple[str, str]]) -> str:
+    lines = ["### Skipped files (not reviewed)", ""]
+    for path, reason in skipped:
+        lines.append(f"- `{path}` ({reason})")
+    return "\n".join(lines)
+
+
+class TriageStats:
+    def __init__(self):
+        self.files_kept = 0
+        self.files_dropped = 0
+        self.lines_dropped = 0
+        self.tokens_dropped = 0
+        self.reasons = Counter()
+        self.skipped: List[Tuple[str, str]] = []
+        self._lock = threading.Lock()
+
+    def record_kept(self):
+        with self._lock:
+            self.files_kept += 1
+
+    def record_dropped(self, path: str, reason: str, lines: int, tokens: int):
+        with self._lock:
+            self.files_dropped += 1
+            self.lines_dropped += lines
+            self.tokens_dropped += tokens
+            self.reasons[reason] += 1
+            self.skipped.append((path, reason))
+
+    def summary(self) -> str:
+        reasons = ", ".join(f"{reason}: {count}" for reason, count in self.reasons.most_common())
+        return (
+            f"Triage kept {self.files_kept} file(s) and dropped {self.files_dropped} "
+            f"({self.lines_dropped} changed lines, ~{self.tokens_dropped} tokens)"
+            + (f" [{reasons}]" if reasons else "")
+        )
+
+
+class DiffTriage:
+    def __init__(
+        self,
+        exclude_globs: Sequence[str] = DEFAULT_EXCLUDE_GLOBS,
+        exclude_patterns: Sequence[str] = (),
+        max_changed_lines: Optional[int] = 5000,
+        max_line_length: Optional[int] = 1000,
+        detect_generated: bool = True,
+        skip_binary: bool = True,
+    ):
+        name_globs = [glob for glob in exclude_globs if "/" not in glob]
+        path_globs = [glob for glob in exclude_globs if "/" in glob]
+        self.name_pattern = compile_globs(name_globs)
+        self.path_pattern = compile_globs(path_globs)
+        self.regex_pattern = re.compile("|".join(exclude_patterns)) if exclude_patterns else None
+        self.max_changed_lines = max_changed_lines
+        self.max_line_length = max_line_length
+        self.detect_generated = detect_generated
+        self.skip_binary = skip_binary
+        self.stats = TriageStats()
+
+    @classmethod
+    def from_env(cls) -> "DiffTriage":
+        def split(value: str):
+            return [item.strip() for item in value.split(",") if item.strip()]
+
+        exclude_globs = list(DEFAULT_EXCLUDE_GLOBS) + split(os.getenv("REVIEW_EXCLUDE", ""))
+        max_changed_lines = int(os.getenv("REVIEW_MAX_FILE_LINES", "5000"))
+        max_line_length = int(os.getenv("REVIEW_MAX_LINE_LENGTH", "1000"))
+        return cls(
+            exclude_globs=exclude_globs,
+            exclude_patterns=split(os.getenv("REVIEW_EXCLUDE_REGEX", "")),
+            max_changed_lines=max_changed_lines or None,
+            max_line_length=max_line_length or None,
+            detect_generated=os.getenv("REVIEW_DETECT_GENERATED", "1") == "1",
+        )
+
+    def is_excluded(self, path: str) -> bool:
+        if self.name_pattern is not None and self.name_pattern.match(os.path.basename(path)):
+            return True
+        if self.path_pattern is not None and self.path_pattern.match(path):
+            return True
+        return self.regex_pattern is not None and self.regex_pattern.search(path) is not None
+
+    def reason(self, file: "PatchedFile") -> Optional[str]:
+        if self.is_excluded(file.path):
+            return "excluded"
+        if self.skip_binary and file.is_binary_file:
+            return "binary"
+        if self.max_changed_lines is not None and file.added + file.removed > self.max_changed_lines:
+            return "too large"
+
+        added = (len(line.value) for hunk in file for line in hunk if line.is_added)
+        if is_minified(added, self.max_line_length):
+            return "minified"
+        if self.detect_generated and self.has_generated_header(file):
+            return "generated"
+        return None
+
+    def has_generated_header(self, file: "PatchedFile") -> bool:
+        # Only the new file's first lines count: a marker in a removed line,
+        # or further down, says nothing about what the file is now.
+        for hunk in file:
+            if hunk.target_start > GENERATED_MARKER_LINES:
+                break
+            for line in hunk:
+                if line.is_removed:
+                    continue
+                if line.target_line_no > GENERATED_MARKER_LINES:
+                    break
+                if GENERATED_MARKER.search(line.value):
+                    return True
+        return False
+
+    def filter(self, files: Iterable["PatchedFile"], stats: Optional[TriageStats] = None) -> Iterator["PatchedFile"]:
+        # Reviews sharing this triage pass their own stats, so each one
+        # reports only the files it skipped.
+        stats = stats if stats is not None else self.stats
+        for file in files:
+            reason = self.reason(file)
+            if reason is None:
+                stats.record_kept()
+                yield file
+                continue
+            logger.info(f"Skipping {file.path}: {reason}")
+            stats.record_dropped(file.path, reason, file.added + file.removed, estimate_tokens(str(file)))
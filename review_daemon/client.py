@@ -0,0 +1,219 @@
+import argparse
+import http.client
+import json
+import os
+import socket
+import sys
+import time
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+from review_common.rendering import OUTPUT_FORMATS
+
+# Kept in step with review_daemon.daemon, which is not imported here so the
+# client starts without loading any reviewer.
+DEFAULT_URL = "http://127.0.0.1:8765"
+DEFAULT_TOKEN_FILE = os.path.join(os.path.expanduser("~"), ".cache", "gpt-code-analyzer", "daemon.token")
+DEFAULT_PRIORITY = 10
+MAX_WAIT = 60.0
+FINISHED_STATES = ("done", "failed", "cancelled")
+
+
+class DaemonError(Exception):
+    pass
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: Optional[float] = None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class DaemonClient:
+    def __init__(
+        self,
+        url: str = DEFAULT_URL,
+        socket_path: Optional[str] = None,
+        timeout: float = MAX_WAIT + 10,
+        token: Optional[str] = None,
+    ):
+        self.url = urlsplit(url)
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.token = token
+
+    def connection(self) -> http.client.HTTPConnection:
+        if self.socket_path:
+            return UnixHTTPConnection(self.socket_path, timeout=self.timeout)
+        return http.client.HTTPConnection(self.url.hostname, self.url.port or 80, timeout=self.timeout)
+
+    def request(self, method: str, path: str, payload: Optional[Dict] = None) -> Dict:
+        if payload is None and method == "POST":
+            payload = {}
+        body = json.dumps(payload).encode() if payload is not None else None
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        connection = self.connection()
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            data = response.read()
+        except OSError as e:
+            where = self.socket_path or self.url.geturl()
+            raise DaemonError(f"cannot reach the review daemon at {where}: {e}") from e
+        finally:
+            connection.close()
+        try:
+            reply = json.loads(data)
+        except ValueError as e:
+            raise DaemonError(f"unexpected reply from the review daemon: {data[:200]!r}") from e
+        if response.status >= 400:
+            raise DaemonError(reply.get("error", f"HTTP {response.status}"))
+        return reply
+
+    def submit(self, kind: str, params: Dict, priority: int = DEFAULT_PRIORITY) -> Dict:
+        return self.request("POST", "/jobs", {"kind": kind, "params": params, "priority": priority})
+
+    def status(self, job_id: str, wait: float = 0) -> Dict:
+        return self.request("GET", f"/jobs/{job_id}?wait={wait:g}" if wait else f"/jobs/{job_id}")
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Dict:
+        # Long-polls in steps of at most MAX_WAIT, which the daemon caps anyway.
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = MAX_WAIT if deadline is None else min(MAX_WAIT, deadline - time.monotonic())
+            job = self.status(job_id, wait=max(remaining, 0.001))
+            if job["status"] in FINISHED_STATES or (deadline is not None and time.monotonic() >= deadline):
+                return job
+
+    def cancel(self, job_id: str) -> Dict:
+        return self.request("DELETE", f"/jobs/{job_id}")
+
+    def list_jobs(self) -> List[Dict]:
+        return self.request("GET", "/jobs")["jobs"]
+
+    def health(self) -> Dict:
+        return self.request("GET", "/health")
+
+    def shutdown(self) -> Dict:
+        return self.request("POST", "/shutdown")
+
+
+def read_token(path: str) -> Optional[str]:
+    try:
+        with open(path) as token_file:
+            return token_file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def job_source(job: Dict) -> str:
+    params = job["params"]
+    return params.get("url") or params.get("path") or job["id"]
+
+
+def print_result(job: Dict, output_format: str) -> int:
+    if job["status"] != "done":
+        print(f"Job {job['id']} {job['status']}" + (f": {job['error']}" if job.get("error") else ""), file=sys.stderr)
+        return 1
+    if output_format == "text":
+        from review_common.rendering import markdown_to_text
+
+        print("\nCode Review Results:\n", markdown_to_text(job["result"]))
+    else:
+        from review_common.rendering import render_review
+
+        render_review(output_format, sys.stdout, job_source(job), job["result"])
+    return 0
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Submit review jobs to a running review daemon.")
+    parser.add_argument("--url", default=os.getenv("REVIEW_DAEMON_URL", DEFAULT_URL), help="daemon URL")
+    parser.add_argument("--socket", default=os.getenv("REVIEW_DAEMON_SOCKET") or None, help="daemon Unix socket")
+    parser.add_argument(
+        "--token-file",
+        default=os.getenv("REVIEW_DAEMON_TOKEN_FILE") or DEFAULT_TOKEN_FILE,
+        help="file holding the daemon's bearer token",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_submit_options(subparser):
+        subparser.add_argument("--priority", type=int, default=DEFAULT_PRIORITY, help="lower runs first (default: 10)")
+        subparser.add_argument("--no-wait", action="store_true", help="print the job id instead of waiting")
+        subparser.add_argument("--chunk-tokens", type=int, help="override the daemon's chunk budget")
+        subparser.add_argument(
+            "--format",
+            choices=OUTPUT_FORMATS,
+            default=os.getenv("REVIEW_OUTPUT_FORMAT", "text"),
+            help="output format (default: text)",
+        )
+
+    code = subparsers.add_parser("code", help="review a source file")
+    code.add_argument("path")
+    code.add_argument("message")
+    add_submit_options(code)
+    diff = subparsers.add_parser("diff", help="review a unified diff file")
+    diff.add_argument("path")
+    diff.add_argument("message")
+    add_submit_options(diff)
+    pr = subparsers.add_parser("pr", help="review a GitHub pull request")
+    pr.add_argument("pr_url", metavar="url")
+    add_submit_options(pr)
+
+    status = subparsers.add_parser("status", help="show a job's status")
+    status.add_argument("job_id")
+    wait = subparsers.add_parser("wait", help="wait for a job and print its review")
+    wait.add_argument("job_id")
+    wait.add_argument("--format", choices=OUTPUT_FORMATS, default=os.getenv("REVIEW_OUTPUT_FORMAT", "text"))
+    cancel = subparsers.add_parser("cancel", help="cancel a queued job")
+    cancel.add_argument("job_id")
+    subparsers.add_parser("list", help="list known jobs")
+    subparsers.add_parser("health", help="show daemon statistics")
+    subparsers.add_parser("stop", help="stop the daemon")
+    args = parser.parse_args(argv)
+
+    token = None if args.socket else read_token(args.token_file)
+    client = DaemonClient(url=args.url, socket_path=args.socket, token=token)
+    exit_code = 0
+    try:
+        if args.command in ("code", "diff", "pr"):
+            if args.command == "pr":
+                params = {"url": args.pr_url}
+            else:
+                params = {"path": os.path.abspath(args.path), "message": args.message}
+            if args.chunk_tokens is not None:
+                params["chunk_tokens"] = args.chunk_tokens
+            job = client.submit(args.command, params, priority=args.priority)
+            if args.no_wait:
+                print(job["id"])
+            else:
+                exit_code = print_result(client.wait(job["id"]), args.format)
+        elif args.command == "wait":
+            exit_code = print_result(client.wait(args.job_id), args.format)
+        elif args.command == "status":
+            print(json.dumps(client.status(args.job_id), indent=2))
+        elif args.command == "cancel":
+            print(json.dumps(client.cancel(args.job_id), indent=2))
+        elif args.command == "list":
+            for job in client.list_jobs():
+                print(f"{job['id']}  {job['status']:<9}  {job['priority']:>3}  {job['kind']:<4}  {job_source(job)}")
+        elif args.command == "health":
+            print(json.dumps(client.health(), indent=2))
+        else:
+            client.shutdown()
+    except DaemonError as e:
+        print(e, file=sys.stderr)
+        exit_code = 1
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
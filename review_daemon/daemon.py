@@ -0,0 +1,554 @@
+import argparse
+import heapq
+import hmac
+import itertools
+import json
+import logging
+import os
+import re
+import secrets
+import signal
+import socketserver
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from code_reviewer.code_reviewer import CodeReviewer
+from local_diff_reviewer.local_diff_reviewer import LocalCodeReviewer
+from pull_request_reviewer.pull_request_reviewer import PRReviewer
+from review_common.ast_chunking import AstChunker
+from review_common.cascade import ModelCascade
+from review_common.compaction import DiffCompactor
+from review_common.diff_stream import iter_file_lines
+from review_common.github_client import GitHubClient
+from review_common.openai_client import OpenAIClient
+from review_common.response_cache import DEFAULT_CACHE_DIR, ResponseCache
+from review_common.symbol_index import SymbolIndex
+from review_common.triage import DiffTriage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+JOB_KINDS = ("code", "diff", "pr")
+JOB_STATES = ("queued", "running", "done", "failed", "cancelled")
+# Jobs with a lower priority number run first.
+DEFAULT_PRIORITY = 10
+# Longest a status request may block waiting for a job to finish, in seconds.
+MAX_WAIT = 60.0
+MAX_BODY_BYTES = 1 << 20
+# Clients on the TCP port present this token, which only the daemon's user
+# can read.
+DEFAULT_TOKEN_FILE = os.path.join(DEFAULT_CACHE_DIR, "daemon.token")
+
+RE_JOB_PATH = re.compile(r"^/jobs/([0-9a-f]+)$")
+
+
+class JobError(ValueError):
+    pass
+
+
+class Job:
+    def __init__(self, kind: str, params: Dict, priority: int = DEFAULT_PRIORITY):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.params = params
+        self.priority = priority
+        self.status = "queued"
+        self.result: Optional[str] = None
+        self.error: Optional[str] = None
+        self.submitted = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.done = threading.Event()
+
+    def to_dict(self, include_result: bool = True) -> Dict:
+        record = {
+            "id": self.id,
+            "kind": self.kind,
+            "params": self.params,
+            "priority": self.priority,
+            "status": self.status,
+            "submitted": round(self.submitted, 3),
+            "started": round(self.started, 3) if self.started else None,
+            "finished": round(self.finished, 3) if self.finished else None,
+        }
+        if self.error is not None:
+            record["error"] = self.error
+        if include_result and self.result is not None:
+            record["result"] = self.result
+        return record
+
+
+class JobQueue:
+    def __init__(self):
+        # The sequence number keeps jobs of equal priority first in, first out.
+        self._heap: List = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self.closed = False
+
+    def __len__(self) -> int:
+        with self._condition:
+            return len(self._heap)
+
+    def put(self, job: Job):
+        with self._condition:
+            heapq.heappush(self._heap, (job.priority, next(self._sequence), job))
+            self._condition.notify()
+
+    def get(self) -> Optional[Job]:
+        with self._condition:
+            while not self._heap and not self.closed:
+                self._condition.wait()
+            if self.closed:
+                return None
+            return heapq.heappop(self._heap)[2]
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+
+def share_model_connections(pool_size: int):
+    # openai keeps one requests session per thread, so chunk reviews that fan
+    # out on short-lived threads would each open new connections. One pooled
+    # session shared by every thread keeps connections to the API warm.
+    import openai
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    class SharedSession(requests.Session):
+        def close(self):
+            # openai closes each thread's session every few minutes; the shared
+            # one stays open for the lifetime of the daemon.
+            pass
+
+    session = SharedSession()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    openai.requestssession = session
+
+
+class ReviewService:
+    def __init__(
+        self,
+        code_reviewer: CodeReviewer,
+        diff_reviewer: LocalCodeReviewer,
+        pr_reviewer: PRReviewer,
+        workers: int = 4,
+        chunk_tokens: Optional[int] = None,
+        max_workers: int = 4,
+        max_finished_jobs: int = 1000,
+    ):
+        self.code_reviewer = code_reviewer
+        self.diff_reviewer = diff_reviewer
+        self.pr_reviewer = pr_reviewer
+        self.workers = max(1, workers)
+        self.chunk_tokens = chunk_tokens
+        self.max_workers = max_workers
+        self.max_finished_jobs = max_finished_jobs
+        self.queue = JobQueue()
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self.started = time.time()
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, workers: int = 4) -> "ReviewService":
+        # One set of clients is shared by every job, so rate limits, the
+        # response cache and pooled connections carry over between reviews.
+        client = OpenAIClient.from_env(cache=ResponseCache.from_env())
+        triage = DiffTriage.from_env()
+        compactor = DiffCompactor.from_env()
+        cascade = ModelCascade.from_env(client)
+        # Diff and pull request jobs come without a checkout, so both use
+        # REVIEW_SYMBOL_ROOT; pull request jobs only while it is at their head.
+        symbols = SymbolIndex.from_env()
+        max_workers = int(os.getenv("REVIEW_MAX_WORKERS", "4"))
+        return cls(
+            CodeReviewer(client=client, chunker=AstChunker.from_env()),
+            LocalCodeReviewer(triage=triage, client=client, compactor=compactor, cascade=cascade, symbols=symbols),
+            PRReviewer(
+                github=GitHubClient.from_env(pool_size=workers),
+                triage=triage,
+                client=client,
+                compactor=compactor,
+                cascade=cascade,
+                symbols=symbols,
+            ),
+            workers=workers,
+            chunk_tokens=int(os.getenv("REVIEW_CHUNK_TOKENS", "0")) or None,
+            max_workers=max_workers,
+        )
+
+    @property
+    def client(self) -> OpenAIClient:
+        return self.code_reviewer.client
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"review-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def shutdown(self, timeout: Optional[float] = None):
+        # Queued jobs are dropped; running ones are given until the timeout.
+        self.queue.close()
+        for thread in self._threads:
+            thread.join(timeout)
+        with self._lock:
+            for job in list(self.jobs.values()):
+                if job.status == "queued":
+                    self._finish(job, "cancelled", error="daemon shut down")
+
+    def validate(self, kind: str, params: Dict):
+        if kind not in JOB_KINDS:
+            raise JobError(f"unknown job kind {kind!r}, expected one of {', '.join(JOB_KINDS)}")
+        required = ("url",) if kind == "pr" else ("path", "message")
+        missing = [name for name in required if not isinstance(params.get(name), str) or not params[name]]
+        if missing:
+            raise JobError(f"{kind} jobs need {', '.join(missing)}")
+        # The daemon's working directory is not the client's.
+        if kind != "pr" and not os.path.isabs(params["path"]):
+            raise JobError("path must be absolute")
+        chunk_tokens = params.get("chunk_tokens")
+        if chunk_tokens is not None and (not isinstance(chunk_tokens, int) or chunk_tokens < 0):
+            raise JobError("chunk_tokens must be a non-negative integer")
+
+    def submit(self, kind: str, params: Dict, priority: int = DEFAULT_PRIORITY) -> Job:
+        self.validate(kind, params)
+        if self.queue.closed:
+            raise JobError("daemon is shutting down")
+        job = Job(kind, params, priority)
+        with self._lock:
+            self.jobs[job.id] = job
+        self.queue.put(job)
+        logger.info(f"Queued {kind} job {job.id} (priority {priority})")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        # Only queued jobs can be cancelled; workers skip them when popped.
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is not None and job.status == "queued":
+                self._finish(job, "cancelled")
+            return job
+
+    def list_jobs(self) -> List[Job]:
+        with self._lock:
+            return list(self.jobs.values())
+
+    def stats(self) -> Dict:
+        counts = dict.fromkeys(JOB_STATES, 0)
+        for job in self.list_jobs():
+            counts[job.status] += 1
+        return {
+            "workers": self.workers,
+            "uptime": round(time.time() - self.started, 1),
+            "jobs": counts,
+            "model": self.client.stats(),
+            "usage": self.client.usage_summary(),
+        }
+
+    def run_job(self, job: Job) -> str:
+        params = job.params
+        chunk_tokens = params.get("chunk_tokens", self.chunk_tokens) or None
+        if job.kind == "code":
+            return self.code_reviewer.review_code_changes(
+                params["path"],
+                params["message"],
+                progress_callback=ignore,
+                raw=True,
+                chunk_tokens=chunk_tokens,
+                max_workers=self.max_workers,
+            )
+        if job.kind == "diff":
+            files = self.diff_reviewer.parse_diff_lines(iter_file_lines(params["path"]))
+            return self.diff_reviewer.review_files(
+                files,
+                params["message"],
+                progress_callback=ignore,
+                chunk_tokens=chunk_tokens,
+                max_workers=self.max_workers,
+                raw=True,
+            )
+        return self.pr_reviewer.review_pull_request(
+            params["url"],
+            progress_callback=ignore,
+            chunk_tokens=chunk_tokens,
+            max_workers=self.max_workers,
+            raw=True,
+        )
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            with self._lock:
+                if job.status != "queued":
+                    continue
+                job.status = "running"
+                job.started = time.time()
+            try:
+                result = self.run_job(job)
+            except Exception as e:
+                logger.error(f"Job {job.id} failed: {e}")
+                with self._lock:
+                    self._finish(job, "failed", error=str(e) or type(e).__name__)
+            else:
+                with self._lock:
+                    self._finish(job, "done", result=result)
+                logger.info(f"Job {job.id} done in {job.finished - job.started:.2f}s")
+
+    def _finish(self, job: Job, status: str, result: Optional[str] = None, error: Optional[str] = None):
+        job.status = status
+        job.result = result
+        job.error = error
+        job.finished = time.time()
+        job.done.set()
+        # Finished jobs are kept for polling, oldest evicted first.
+        finished = [key for key, value in self.jobs.items() if value.done.is_set()]
+        for key in finished[: max(0, len(finished) - self.max_finished_jobs)]:
+            del self.jobs[key]
+
+
+def ignore(text: str):
+    pass
+
+
+def write_token(path: str) -> str:
+    token = secrets.token_urlsafe(32)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if os.path.exists(path):
+        os.unlink(path)
+    descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(descriptor, "w") as token_file:
+        token_file.write(token)
+    return token
+
+
+def make_handler(service: ReviewService, stop=None, token: Optional[str] = None):
+    class Handler(BaseHTTPRequestHandler):
+        # Keep-alive lets a client poll over one connection.
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+        def send_json(self, status: int, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_error_json(self, status: int, message: str):
+            self.send_json(status, {"error": message})
+
+        def authorized(self) -> bool:
+            # Without the token, a web page open in the user's browser could
+            # reach the port and have the daemon read and send local files.
+            if token is None:
+                return True
+            scheme, _, presented = (self.headers.get("Authorization") or "").partition(" ")
+            if scheme.lower() == "bearer" and hmac.compare_digest(presented.strip().encode(), token.encode()):
+                return True
+            self.send_error_json(401, "missing or invalid bearer token")
+            return False
+
+        def is_json(self) -> bool:
+            # Browsers send text/plain and form bodies cross-origin without a
+            # preflight; application/json always needs one.
+            content_type = (self.headers.get("Content-Type") or "").split(";", 1)[0].strip().lower()
+            return content_type == "application/json"
+
+        def read_json(self) -> Dict:
+            length = int(self.headers.get("Content-Length") or 0)
+            if length > MAX_BODY_BYTES:
+                raise JobError("request body too large")
+            try:
+                payload = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError as e:
+                raise JobError(f"invalid JSON: {e}") from e
+            if not isinstance(payload, dict):
+                raise JobError("request body must be a JSON object")
+            return payload
+
+        def do_GET(self):
+            if not self.authorized():
+                return
+            url = urlsplit(self.path)
+            if url.path == "/health":
+                self.send_json(200, service.stats())
+                return
+            if url.path == "/jobs":
+                self.send_json(200, {"jobs": [job.to_dict(include_result=False) for job in service.list_jobs()]})
+                return
+            match = RE_JOB_PATH.match(url.path)
+            job = service.get(match.group(1)) if match else None
+            if job is None:
+                self.send_error_json(404, "no such job")
+                return
+            # ?wait=N long-polls, so clients learn about completion without
+            # hammering the daemon.
+            try:
+                wait = float(parse_qs(url.query).get("wait", ["0"])[0])
+            except ValueError:
+                self.send_error_json(400, "wait must be a number")
+                return
+            if wait > 0:
+                job.done.wait(min(wait, MAX_WAIT))
+            self.send_json(200, job.to_dict())
+
+        def do_POST(self):
+            if not self.authorized():
+                return
+            if self.path not in ("/jobs", "/shutdown") or (self.path == "/shutdown" and stop is None):
+                self.send_error_json(404, "not found")
+                return
+            if not self.is_json():
+                self.send_error_json(415, "request body must be sent as application/json")
+                return
+            if self.path == "/shutdown":
+                self.send_json(202, {"status": "stopping"})
+                threading.Thread(target=stop, daemon=True).start()
+                return
+            try:
+                payload = self.read_json()
+                priority = payload.get("priority", DEFAULT_PRIORITY)
+                if not isinstance(priority, int):
+                    raise JobError("priority must be an integer")
+                job = service.submit(payload.get("kind"), payload.get("params") or {}, priority)
+            except JobError as e:
+                self.send_error_json(400, str(e))
+                return
+            self.send_json(202, job.to_dict())
+
+        def do_DELETE(self):
+            if not self.authorized():
+                return
+            match = RE_JOB_PATH.match(self.path)
+            job = service.cancel(match.group(1)) if match else None
+            if job is None:
+                self.send_error_json(404, "no such job")
+                return
+            if job.status != "cancelled":
+                self.send_error_json(409, f"job is {job.status}")
+                return
+            self.send_json(200, job.to_dict())
+
+    return Handler
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        # BaseHTTPRequestHandler expects a (host, port) client address.
+        request, _ = super().get_request()
+        return request, ("local", 0)
+
+
+def make_server(
+    service: ReviewService,
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    socket_path: Optional[str] = None,
+    token: Optional[str] = None,
+):
+    def stop():
+        server.shutdown()
+
+    handler = make_handler(service, stop, token)
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = UnixHTTPServer(socket_path, handler)
+        os.chmod(socket_path, 0o600)
+    else:
+        server = ThreadingHTTPServer((host, port), handler)
+        server.daemon_threads = True
+    return server
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Run the reviewers as a long-lived daemon that takes jobs over a local HTTP API."
+    )
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"address to listen on (default: {DEFAULT_HOST})")
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=int(os.getenv("REVIEW_DAEMON_PORT", str(DEFAULT_PORT))),
+        help=f"port to listen on (default: {DEFAULT_PORT})",
+    )
+    parser.add_argument(
+        "--socket",
+        default=os.getenv("REVIEW_DAEMON_SOCKET") or None,
+        help="listen on this Unix socket instead of a TCP port",
+    )
+    parser.add_argument(
+        "--token-file",
+        default=os.getenv("REVIEW_DAEMON_TOKEN_FILE") or DEFAULT_TOKEN_FILE,
+        help=f"where the TCP API's bearer token is written (default: {DEFAULT_TOKEN_FILE})",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("REVIEW_DAEMON_WORKERS", "4")),
+        help="jobs reviewed concurrently (default: 4)",
+    )
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    if not os.getenv("OPENAI_API_KEY"):
+        print("Please set the OPENAI_API_KEY environment variable.")
+        sys.exit(1)
+
+    service = ReviewService.from_env(workers=args.workers)
+    # Paid once at startup instead of by the first job.
+    share_model_connections(pool_size=service.workers * service.max_workers)
+    import unidiff  # noqa: F401
+
+    # The Unix socket is already private to its owner; the TCP port needs a
+    # token, new for every run.
+    token = None if args.socket else write_token(args.token_file)
+    server = make_server(service, args.host, args.port, args.socket, token)
+    service.start()
+    # SIGTERM stops the daemon as cleanly as Ctrl-C does.
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    where = args.socket or f"http://{args.host}:{server.server_address[1]}"
+    logger.info(f"Review daemon listening on {where} with {service.workers} worker(s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        for path in (args.socket, None if args.socket else args.token_file):
+            if path and os.path.exists(path):
+                os.unlink(path)
+        service.shutdown(timeout=30)
+        logger.info(service.client.usage_summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+import threading
+import time
+
+import pytest
+
+from review_common.openai_client import OpenAIClient, RequestCancelled
+
+
+class FakeClient(OpenAIClient):
+    # Records every call as (model, prompt) and answers with reply: a string,
+    # or a function of the prompt and model. Clearing release holds calls
+    # until it is set again; started is set as soon as a call arrives. A held
+    # call whose cancelled event is set stops at once and sets aborted.
+    def __init__(self, reply="- Looks fine."):
+        super().__init__(api_key="test")
+        self.reply = reply
+        self.calls = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+        self.aborted = threading.Event()
+        self._calls_lock = threading.Lock()
+
+    @property
+    def prompts(self):
+        return [prompt for _, prompt in self.calls]
+
+    def chat(self, system_prompt, prompt, model="gpt-4", cancelled=None, **kwargs):
+        with self._calls_lock:
+            self.calls.append((model, prompt))
+        self.started.set()
+        deadline = time.monotonic() + 5
+        while not self.release.wait(0.01) and time.monotonic() < deadline:
+            if cancelled is not None and cancelled.is_set():
+                self.aborted.set()
+                raise RequestCancelled("The request was cancelled")
+        return self.reply(prompt, model) if callable(self.reply) else self.reply
+
+
+@pytest.fixture
+# Returns a model client that answers locally; set its reply per test.
+def fake_client():
+    return FakeClient()
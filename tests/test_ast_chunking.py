@@ -0,0 +1,105 @@
+import os
+
+from code_reviewer.code_reviewer import CodeReviewer
+from review_common.ast_chunking import AstChunker, anchor_findings, plan_chunks, render_chunk
+from review_common.rendering import extract_findings
+from review_common.response_cache import ResponseCache
+
+SOURCE = '''"""Sample module."""
+import os
+import sys
+from typing import List
+
+LIMIT = 10
+
+
+def helper(path):
+    return os.path.join(path, "a")
+
+
+class Big:
+    """A class too large for one chunk."""
+
+    size = LIMIT
+
+    def one(self):
+        return sys.argv
+
+    @property
+    def two(self) -> List[int]:
+        return [1, 2, 3]
+
+
+if __name__ == "__main__":
+    helper("x")
+'''
+
+
+def reply(prompt, model):
+    if "def one" in prompt.split("```python")[1]:
+        return "- `sample.py:19` exposes argv\n- Consider a docstring"
+    return "- Looks fine"
+
+
+class TestAstChunking:
+
+    # Tests that large classes are split into methods that carry the imports they use.
+    def test_plan(self):
+        chunks = plan_chunks(SOURCE, max_tokens=40)
+        assert [chunk.names for chunk in chunks] == [
+            ["<module>"], ["helper"], ["Big"], ["Big.one"], ["Big.two"], ["<module>"]
+        ]
+        one = chunks[3]
+        assert (one.start, one.end) == (18, 19)
+        rendered = render_chunk(SOURCE.splitlines(), one)
+        assert " 3 | import sys" in rendered
+        assert "import os" not in rendered
+        assert "13 | class Big:" in rendered
+        assert "19 |         return sys.argv" in rendered
+
+    # Tests that small units are packed together and unparsable code is not chunked.
+    def test_packing_and_syntax_errors(self):
+        assert [chunk.names for chunk in plan_chunks(SOURCE, max_tokens=10_000)] == [["<module>", "helper", "Big"]]
+        assert plan_chunks("def broken(:\n", max_tokens=10) is None
+
+    # Tests that findings without a line number are pinned to their chunk.
+    def test_anchor_findings(self):
+        review = "- `a.py:3` bad\n- missing check\n  - nested detail\n- see line 7"
+        assert anchor_findings(review, "a.py", 40) == (
+            "- `a.py:3` bad\n- missing check (line 40)\n  - nested detail\n- see line 7"
+        )
+
+    # Tests that the parse cache skips re-parsing until the file changes.
+    def test_parse_cache(self, tmp_path):
+        path = tmp_path / "sample.py"
+        path.write_text(SOURCE)
+        chunker = AstChunker(cache=ResponseCache(cache_dir=str(tmp_path / "cache")))
+        first = chunker.plan(str(path), SOURCE, 40)
+        assert chunker.plan(str(path), SOURCE, 40) == first
+        assert chunker.parses == 1
+        os.utime(path, ns=(1, 1))
+        chunker.plan(str(path), SOURCE, 40)
+        assert chunker.parses == 2
+
+    # Tests that chunks are reviewed separately and findings keep file line numbers.
+    def test_chunked_review(self, tmp_path, fake_client):
+        path = tmp_path / "sample.py"
+        path.write_text(SOURCE)
+        client = fake_client
+        client.reply = reply
+        reviewer = CodeReviewer(client=client)
+        result = reviewer.review_code_changes(str(path), "Add Big", raw=True, chunk_tokens=40)
+        assert len(client.prompts) == 6
+        assert "### Part 4/6: lines 18-19 (Big.one)" in result
+        findings = [finding for finding in extract_findings(result, "sample.py") if "argv" in finding.message]
+        assert [(finding.path, finding.line) for finding in findings] == [("sample.py", 19)]
+        docstring = [finding for finding in extract_findings(result, "sample.py") if "docstring" in finding.message]
+        assert docstring[0].line == 18
+
+    # Tests that files within the budget are reviewed in one prompt as before.
+    def test_small_file_unchanged(self, tmp_path, fake_client):
+        path = tmp_path / "sample.py"
+        path.write_text(SOURCE)
+        client = fake_client
+        CodeReviewer(client=client).review_code_changes(str(path), "Add Big", raw=True, chunk_tokens=10_000)
+        assert client.prompts == [CodeReviewer().build_context_message("Add Big", SOURCE)]
@@ -0,0 +1,113 @@
+import asyncio
+import io
+import json
+import threading
+import time
+
+from unidiff import PatchSet
+from pull_request_reviewer.batch_reviewer import RateLimitedPRReviewer, read_pr_urls, review_pull_requests
+from review_common.rate_limit import RateLimiter
+
+import pytest
+
+
+class FakePRReviewer(RateLimitedPRReviewer):
+    def __init__(self, delay=0.1, **kwargs):
+        super().__init__(**kwargs)
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def extract_pr_info(self, pr_url):
+        if pr_url.endswith("/404"):
+            raise ValueError("Not Found")
+        return super().extract_pr_info(pr_url)
+
+    def review_patch(self, patch, title, description, chunk_tokens=None, max_workers=4, raw=False):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+        return f"Review of {title}"
+
+
+class TestBatchReviewer:
+    @pytest.fixture(autouse=True)
+    # Replaces the GitHub calls with local stand-ins.
+    def fake_github(self, monkeypatch):
+        monkeypatch.setattr(
+            "pull_request_reviewer.pull_request_reviewer.PRReviewer.extract_pr_info",
+            lambda self, pr_url: (pr_url + ".diff", "description", pr_url.split("/")[-1]),
+        )
+        monkeypatch.setattr(
+            "pull_request_reviewer.pull_request_reviewer.PRReviewer.fetch_and_parse_diff",
+            lambda self, diff_url: PatchSet(""),
+        )
+
+    # Tests that blank lines and comments are ignored when reading PR URLs.
+    def test_read_pr_urls(self):
+        source = io.StringIO("https://github.com/o/r/pull/1\n\n# skip\nhttps://github.com/o/r/pull/2\n")
+        assert read_pr_urls(source) == ["https://github.com/o/r/pull/1", "https://github.com/o/r/pull/2"]
+
+    # Tests that reviews overlap up to the concurrency limit and every result is written.
+    def test_reviews_run_concurrently(self):
+        reviewer = FakePRReviewer()
+        output = io.StringIO()
+        pr_urls = [f"https://github.com/o/r/pull/{i}" for i in range(6)]
+        start = time.perf_counter()
+        counts = asyncio.run(review_pull_requests(pr_urls, output, reviewer, concurrency=3))
+        assert time.perf_counter() - start < 0.1 * len(pr_urls)
+        assert reviewer.max_active == 3
+        assert counts == {"reviewed": 6, "failed": 0}
+        records = [json.loads(line) for line in output.getvalue().splitlines()]
+        assert sorted(record["url"] for record in records) == sorted(pr_urls)
+
+    # Tests that a failing pull request is recorded without stopping the batch.
+    def test_failed_review_is_recorded(self):
+        output = io.StringIO()
+        pr_urls = ["https://github.com/o/r/pull/1", "https://github.com/o/r/pull/404"]
+        counts = asyncio.run(review_pull_requests(pr_urls, output, FakePRReviewer(delay=0)))
+        assert counts == {"reviewed": 1, "failed": 1}
+        records = {record["url"]: record for record in map(json.loads, output.getvalue().splitlines())}
+        assert records["https://github.com/o/r/pull/404"]["error"] == "Not Found"
+        assert records["https://github.com/o/r/pull/1"]["review"] == "Review of 1"
+
+    # Tests that results are written as each review finishes rather than at the end.
+    def test_results_written_incrementally(self):
+        class SlowFirstReviewer(FakePRReviewer):
+            def review_patch(self, patch, title, description, chunk_tokens=None, max_workers=4, raw=False):
+                time.sleep(0.3 if title == "1" else 0)
+                return f"Review of {title}"
+
+        output = io.StringIO()
+        pr_urls = ["https://github.com/o/r/pull/1", "https://github.com/o/r/pull/2"]
+        asyncio.run(review_pull_requests(pr_urls, output, SlowFirstReviewer()))
+        assert json.loads(output.getvalue().splitlines()[0])["url"] == pr_urls[1]
+
+    # Tests that rendered output formats get the raw review and record failures.
+    def test_output_format(self):
+        class MarkdownReviewer(FakePRReviewer):
+            def review_patch(self, patch, title, description, chunk_tokens=None, max_workers=4, raw=False):
+                assert raw
+                return f"- Review of `{title}.py`"
+
+        output = io.StringIO()
+        pr_urls = ["https://github.com/o/r/pull/1", "https://github.com/o/r/pull/404"]
+        counts = asyncio.run(review_pull_requests(pr_urls, output, MarkdownReviewer(delay=0), output_format="sarif"))
+        assert counts == {"reviewed": 1, "failed": 1}
+        run = json.loads(output.getvalue())["runs"][0]
+        assert [result["properties"]["source"] for result in run["results"]] == [pr_urls[0]]
+        assert run["results"][0]["locations"][0]["physicalLocation"]["artifactLocation"]["uri"] == "1.py"
+        assert "Not Found" in run["invocations"][0]["toolExecutionNotifications"][0]["message"]["text"]
+
+    # Tests that the GitHub rate limiter spaces out metadata and diff requests.
+    def test_github_rate_limit(self):
+        reviewer = FakePRReviewer(delay=0, github_limiter=RateLimiter(60 / 0.05))
+        start = time.perf_counter()
+        pr_urls = ["https://github.com/o/r/pull/1", "https://github.com/o/r/pull/2"]
+        asyncio.run(review_pull_requests(pr_urls, io.StringIO(), reviewer))
+        # Four GitHub requests at one per 50ms.
+        assert time.perf_counter() - start >= 0.15
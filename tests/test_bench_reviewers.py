@@ -0,0 +1,48 @@
+import json
+
+from benchmarks.bench_reviewers import compare, main
+from benchmarks.fake_servers import FakeServer
+
+import pytest
+
+
+class TestBenchReviewers:
+
+    # Tests that every scenario runs end to end against the local stand-ins, including injected 429s.
+    def test_benchmark_runs_offline(self, tmp_path, capsys):
+        results_path = tmp_path / "results.json"
+        main([
+            "--sizes", "1", "8",
+            "--repeat", "2",
+            "--chunk-tokens", "1000",
+            "--latency", "0",
+            "--github-latency", "0",
+            "--tokens-per-second", "100000",
+            "--rate-limit-every", "4",
+            "--json", str(results_path),
+        ])
+        results = json.loads(results_path.read_text())
+        assert set(results) == {f"{name}/{size}" for name in ("code", "local", "pr") for size in (1, 8)}
+        assert results["local/8"]["requests"] > 1
+        assert results["code/8"]["requests"] > results["code/1"]["requests"]
+        assert results["pr/8"]["prompt_tokens"] > results["pr/1"]["prompt_tokens"]
+        assert all(metrics["peak_kb"] > 0 for metrics in results.values())
+        assert "pr" in capsys.readouterr().out
+
+    # Tests that slower or costlier results than the baseline are reported as regressions.
+    def test_compare(self):
+        baseline = {"local/1": {"p50_ms": 100, "p90_ms": 120, "prompt_tokens": 500, "peak_kb": 64}}
+        results = {"local/1": {"p50_ms": 110, "p90_ms": 200, "prompt_tokens": 500, "peak_kb": 32}}
+        assert compare(results, baseline, 0.25) == ["local/1 p90_ms: 120 -> 200 (+67%)"]
+
+    # Tests that a regression against the baseline fails the run.
+    def test_baseline_regression_exits(self, tmp_path):
+        baseline = tmp_path / "baseline.json"
+        baseline.write_text(json.dumps({"code/1": {"prompt_tokens": 1}}))
+        with pytest.raises(SystemExit):
+            main(["--scenarios", "code", "--sizes", "1", "--repeat", "1", "--latency", "0", "--baseline", str(baseline)])
+
+    # Tests that a fake server without a request handler cannot be created.
+    def test_incomplete_server(self):
+        with pytest.raises(TypeError):
+            FakeServer()
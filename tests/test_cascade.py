@@ -0,0 +1,111 @@
+from unidiff import PatchSet
+
+from local_diff_reviewer.local_diff_reviewer import LocalCodeReviewer
+from review_common.cascade import ModelCascade, parse_risk
+from review_common.rendering import extract_findings
+
+
+def file_diff(path, old, new):
+    return f"""diff --git a/{path} b/{path}
+index 1234567..abcdefg 100644
+--- a/{path}
++++ b/{path}
+@@ -1,1 +1,1 @@
+-{old}
++{new}
+"""
+
+
+DIFF = (
+    file_diff("auth.py", "check(token)", "pass")
+    + file_diff("README.md", "Hello", "Hello, world")
+    + file_diff("flaky.py", "x = 1", "x = 2")
+)
+
+RISK = {"auth.py": '{"risk": 9, "verdict": "Removes the token check."}', "README.md": '{"risk": 1, "verdict": "Docs only."}'}
+
+
+def reply(prompt, model):
+    if model == "gpt-4":
+        return "- `auth.py:1` the token is no longer checked"
+    for path, risk in RISK.items():
+        if f"change to {path}" in prompt:
+            return risk
+    return "I cannot rate this."
+
+
+class TestCascade:
+
+    # Tests that risk scores are read from JSON and from loosely formatted replies.
+    def test_parse_risk(self):
+        assert parse_risk('Sure: {"risk": 3, "verdict": "Small rename."}') == (3, "Small rename.")
+        assert parse_risk('{"risk": 42}') == (10, "")
+        assert parse_risk('risk: 7, "verdict": "Touches auth"') == (7, "Touches auth")
+        assert parse_risk("no idea") is None
+
+    # Tests that only risky or unscored files reach the review model.
+    def test_escalation(self, fake_client):
+        client = fake_client
+        client.reply = reply
+        cascade = ModelCascade(client, threshold=4)
+        reviewer = LocalCodeReviewer(client=client, cascade=cascade)
+        result = reviewer.review_files(PatchSet(DIFF), "Simplify auth", raw=True)
+
+        (review_prompt,) = [prompt for model, prompt in client.calls if model == "gpt-4"]
+        assert "auth.py" in review_prompt and "flaky.py" in review_prompt
+        assert "README.md" not in review_prompt
+        assert "- `README.md`: Docs only. (risk 1/10)" in result
+        findings = extract_findings(result, None)
+        assert [finding.path for finding in findings] == ["auth.py", "README.md"]
+
+        stats = cascade.stats
+        assert (stats.files, stats.escalated) == (3, 2)
+        assert "escalated 2 of 3 file(s) (67%)" in stats.summary()
+        assert "saved against an all-large-model run" in stats.summary()
+
+    # Tests that files over the triage budget skip the triage model.
+    def test_large_files_escalate(self, fake_client):
+        client = fake_client
+        client.reply = reply
+        cascade = ModelCascade(client, max_triage_tokens=1)
+        reviewer = LocalCodeReviewer(client=client, cascade=cascade)
+        reviewer.review_files(PatchSet(DIFF), "Simplify auth", raw=True)
+        assert [model for model, _ in client.calls] == ["gpt-4"]
+        assert cascade.stats.escalated == 3
+
+    # Tests that escalated files are reviewed by the configured review model.
+    def test_review_model(self, fake_client, monkeypatch):
+        monkeypatch.setenv("REVIEW_CASCADE", "1")
+        monkeypatch.setenv("REVIEW_CASCADE_REVIEW_MODEL", "gpt-4-32k")
+        fake_client.reply = lambda prompt, model: reply(prompt, "gpt-4" if model == "gpt-4-32k" else model)
+        cascade = ModelCascade.from_env(fake_client)
+        reviewer = LocalCodeReviewer(client=fake_client, cascade=cascade)
+        for chunk_tokens in (None, 40):
+            fake_client.calls.clear()
+            result = reviewer.review_files(PatchSet(DIFF), "Simplify auth", chunk_tokens=chunk_tokens, raw=True)
+            models = [model for model, _ in fake_client.calls]
+            assert models[:3] == ["gpt-3.5-turbo"] * 3
+            assert models[3:] and set(models[3:]) == {"gpt-4-32k"}
+            assert "token is no longer checked" in result
+
+    # Tests that a streamed diff is scored a few files ahead of the review instead of being read in full.
+    def test_streams_files(self, fake_client):
+        pulled, reviewed, ahead = [], [], []
+
+        def source():
+            for index in range(40):
+                pulled.append(index)
+                yield PatchSet(file_diff(f"file_{index}.py", "x = 1", "x = 2"))[0]
+
+        def review_files(files):
+            for file in files:
+                reviewed.append(file.path)
+                ahead.append(len(pulled) - len(reviewed))
+            return "- reviewed"
+
+        fake_client.reply = reply
+        cascade = ModelCascade(fake_client, max_workers=2)
+        result = cascade.review(source(), "Bump", review_files)
+        assert len(reviewed) == 40 and result == "- reviewed"
+        assert max(ahead) <= 2 * 2 + 1
+        assert cascade.stats.files == cascade.stats.escalated == 40
@@ -0,0 +1,80 @@
+import time
+
+from unidiff import PatchSet
+from review_common.chunking import chunk_patched_files, estimate_tokens, map_reduce_review
+
+import pytest
+
+
+DIFF = """diff --git a/file1.py b/file1.py
+index 1234567..abcdefg 100644
+--- a/file1.py
++++ b/file1.py
+@@ -1,2 +1,2 @@
+-x = 1
++x = 2
+ y = 3
+@@ -20,2 +20,2 @@
+-z = 1
++z = 2
+ w = 3
+diff --git a/file2.py b/file2.py
+index 1234567..abcdefg 100644
+--- a/file2.py
++++ b/file2.py
+@@ -1,2 +1,2 @@
+-a = 1
++a = 2
+ b = 3
+"""
+
+
+class TestChunking:
+
+    # Tests that a budget large enough for the whole diff produces a single chunk.
+    def test_single_chunk_when_within_budget(self):
+        chunks = chunk_patched_files(PatchSet(DIFF), 10000)
+        assert len(chunks) == 1
+        assert chunks[0].paths == ["file1.py", "file2.py"]
+
+    # Tests that every chunk stays within the budget and files are split along hunk boundaries.
+    def test_chunks_respect_budget(self):
+        budget = 40
+        chunks = chunk_patched_files(PatchSet(DIFF), budget)
+        assert len(chunks) > 1
+        assert all(estimate_tokens(chunk.text) <= budget for chunk in chunks)
+        file1_chunks = [chunk for chunk in chunks if "file1.py" in chunk.paths]
+        assert len(file1_chunks) == 2
+        assert all("--- a/file1.py\n+++ b/file1.py" in chunk.text for chunk in file1_chunks)
+
+    # Tests that a non-positive budget is rejected.
+    def test_invalid_budget(self):
+        with pytest.raises(ValueError):
+            chunk_patched_files(PatchSet(DIFF), 0)
+
+    # Tests that chunks are reviewed concurrently and merged in order.
+    def test_map_reduce_review_runs_concurrently(self):
+        chunks = chunk_patched_files(PatchSet(DIFF), 40)
+
+        def review_chunk(text):
+            time.sleep(0.2)
+            return f"reviewed {len(text)}"
+
+        result, stats = map_reduce_review(chunks, review_chunk, max_workers=len(chunks))
+        assert stats.wall_clock < 0.2 * len(chunks)
+        assert [timing.index for timing in stats.chunks] == list(range(len(chunks)))
+        assert result.index("Part 1/") < result.index("Part 2/")
+
+    # Tests that a failing chunk is reported without losing the other reviews.
+    def test_map_reduce_review_failed_chunk(self):
+        chunks = chunk_patched_files(PatchSet(DIFF), 40)
+
+        def review_chunk(text):
+            if "file2.py" in text:
+                raise RuntimeError("boom")
+            return "Looks good."
+
+        result, stats = map_reduce_review(chunks, review_chunk)
+        assert "Looks good." in result
+        assert [timing.error for timing in stats.chunks if timing.error] == ["boom"]
+        assert "failed: boom" in stats.summary()
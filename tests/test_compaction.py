@@ -0,0 +1,126 @@
+from unidiff import PatchSet
+from local_diff_reviewer.local_diff_reviewer import LocalCodeReviewer
+from review_common.chunking import iter_chunks
+from review_common.compaction import DiffCompactor
+
+CONTEXT = "".join(f" line{i}\n" for i in range(1, 21))
+
+WIDE_CONTEXT_DIFF = f"""diff --git a/app.py b/app.py
+index 1234567..abcdefg 100644
+--- a/app.py
++++ b/app.py
+@@ -1,22 +1,23 @@ class App:
+-import os
++import sys
+{CONTEXT}-end = 1
++end = 2
++done = True
+"""
+
+
+def import_change(path):
+    return f"""diff --git a/{path} b/{path}
+index 1234567..abcdefg 100644
+--- a/{path}
++++ b/{path}
+@@ -1,2 +1,2 @@
+-from legacy import retry
++from common import retry
+ import os
+@@ -10,2 +10,2 @@
+-if  ready :
++if ready:
+     start()
+"""
+
+
+DEDENT_DIFF = """diff --git a/totals.py b/totals.py
+--- a/totals.py
++++ b/totals.py
+@@ -1,4 +1,4 @@
+ def total(items):
+     for item in items:
+-        return item.price
++    return item.price
+ 
+"""
+
+METADATA_ONLY_DIFF = """diff --git a/old.py b/new.py
+similarity index 100%
+rename from old.py
+rename to new.py
+diff --git a/run.sh b/run.sh
+old mode 100644
+new mode 100755
+"""
+
+
+class TestCompaction:
+
+    # Tests that context is trimmed into separate hunks with valid line numbers.
+    def test_trim_context(self):
+        compactor = DiffCompactor(context_lines=2)
+        (file,) = compactor.compact(PatchSet(WIDE_CONTEXT_DIFF))
+        (reparsed,) = PatchSet(str(file))
+        assert [(h.source_start, h.source_length, h.target_start, h.target_length) for h in reparsed] == [
+            (1, 3, 1, 3), (20, 3, 20, 4),
+        ]
+        assert [h.section_header for h in reparsed] == ["class App:", "class App:"]
+        assert [line.value for line in reparsed[1]] == ["line19\n", "line20\n", "end = 1\n", "end = 2\n", "done = True\n"]
+        assert compactor.stats.context_lines_trimmed == 16
+
+    # Tests that whitespace-only hunks collapse and repeated hunks point at their first occurrence.
+    def test_whitespace_and_repeats(self):
+        compactor = DiffCompactor()
+        files = list(compactor.compact(PatchSet(import_change("a.py") + import_change("b.py") + import_change("c.py"))))
+        assert "whitespace-only change (2 lines)" in str(files[0])
+        assert "+from common import retry" in str(files[0])
+        assert str(files[1]).endswith("@@ -1,2 +1,2 @@ same change as in a.py (repeat #1)\n@@ -10,2 +10,2 @@ whitespace-only change (2 lines)\n")
+        assert "same change as in a.py (repeat #2)" in str(files[2])
+        assert (compactor.stats.whitespace_hunks, compactor.stats.duplicate_hunks) == (3, 2)
+
+    # Tests that a change to leading indentation is sent in full, since it can change what the code does.
+    def test_dedent_is_not_whitespace_only(self):
+        compactor = DiffCompactor()
+        (file,) = compactor.compact(PatchSet(DEDENT_DIFF))
+        assert "whitespace-only" not in str(file)
+        assert "+    return item.price" in str(file)
+        assert compactor.stats.whitespace_hunks == 0
+
+    # Tests that compaction is only switched on by REVIEW_COMPACT=1.
+    def test_opt_in(self, monkeypatch):
+        monkeypatch.delenv("REVIEW_COMPACT", raising=False)
+        assert DiffCompactor.from_env() is None
+        monkeypatch.setenv("REVIEW_COMPACT", "1")
+        assert isinstance(DiffCompactor.from_env(), DiffCompactor)
+
+    # Tests that rename-only and mode-only files become one-line summaries.
+    def test_metadata_only_files(self):
+        compactor = DiffCompactor()
+        files = [str(file) for file in compactor.compact(PatchSet(METADATA_ONLY_DIFF))]
+        assert files == [
+            "renamed old.py -> new.py (no content changes)\n",
+            "run.sh: mode changed 100644 -> 100755 (no content changes)\n",
+        ]
+        assert compactor.stats.files_summarized == 2
+
+    # Tests that token counts before and after compaction are reported.
+    def test_stats(self):
+        compactor = DiffCompactor()
+        list(compactor.compact(PatchSet(import_change("a.py") + import_change("b.py") + METADATA_ONLY_DIFF)))
+        assert compactor.stats.tokens_after < compactor.stats.tokens_before
+        assert "% saved" in compactor.stats.summary()
+
+    # Tests that compacted files can still be split into chunks along hunk boundaries.
+    def test_chunking_compacted_files(self):
+        compactor = DiffCompactor(context_lines=1)
+        chunks = list(iter_chunks(compactor.compact(PatchSet(WIDE_CONTEXT_DIFF)), max_tokens=40))
+        assert len(chunks) == 2
+        assert all("diff --git a/app.py b/app.py" in chunk.text for chunk in chunks)
+
+    # Tests that the diff reviewer only compacts when a compactor is configured.
+    def test_reviewer_prompt(self):
+        patch = PatchSet(import_change("a.py") + import_change("b.py"))
+        assert "repeat #1" not in "".join(LocalCodeReviewer().prepare_code_changes_messages(patch))
+        messages = LocalCodeReviewer(compactor=DiffCompactor()).prepare_code_changes_messages(patch)
+        assert "repeat #1" in messages[1]
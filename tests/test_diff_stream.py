@@ -0,0 +1,80 @@
+from unidiff import PatchSet
+from review_common.diff_stream import iter_chunked_lines, iter_file_lines, iter_patched_files
+
+import pytest
+
+
+GIT_DIFF = """diff --git a/file1.txt b/file1.txt
+index 1234567..abcdefg 100644
+--- a/file1.txt
++++ b/file1.txt
+@@ -1,2 +1,2 @@
+--- not a file header
++++ not a file header either
+ How are you?
+diff --git a/logo.png b/logo.png
+index 1234567..abcdefg 100644
+Binary files a/logo.png and b/logo.png differ
+diff --git a/file2.txt b/file2.txt
+index 1234567..abcdefg 100644
+--- a/file2.txt
++++ b/file2.txt
+@@ -1 +1 @@
+-I am fine, thank you.
++I am doing well, thanks for asking.
+"""
+
+PLAIN_DIFF = """--- a/file1.txt
++++ b/file1.txt
+@@ -1,2 +1,2 @@
+-Hello, world!
++Hello, GitHub!
+ How are you?
+--- a/file2.txt
++++ b/file2.txt
+@@ -1,2 +1,2 @@
+-I am fine, thank you.
++I am doing well, thanks for asking.
+ How about you?
+"""
+
+
+class TestDiffStream:
+
+    # Tests that streaming a git diff yields the same files as parsing it in one go.
+    def test_matches_patchset(self):
+        streamed = [str(file) for file in iter_patched_files(GIT_DIFF.splitlines(True))]
+        assert streamed == [str(file) for file in PatchSet(GIT_DIFF)]
+        assert len(streamed) == 3
+
+    # Tests that unified diffs without "diff" lines are split on their file headers.
+    def test_plain_unified_diff(self):
+        paths = [file.path for file in iter_patched_files(PLAIN_DIFF.splitlines(True))]
+        assert paths == ["file1.txt", "file2.txt"]
+
+    # Tests that a diff file is read through a memory map.
+    def test_iter_file_lines(self, tmp_path):
+        diff_path = tmp_path / "test.diff"
+        diff_path.write_text(GIT_DIFF)
+        assert "".join(iter_file_lines(str(diff_path))) == GIT_DIFF
+
+    # Tests that an empty diff file yields nothing and a missing one fails immediately.
+    def test_iter_file_lines_empty_and_missing(self, tmp_path):
+        diff_path = tmp_path / "empty.diff"
+        diff_path.write_text("")
+        assert list(iter_patched_files(iter_file_lines(str(diff_path)))) == []
+        with pytest.raises(IOError):
+            iter_file_lines(str(tmp_path / "missing.diff"))
+
+    # Tests that lines split across HTTP body chunks are reassembled.
+    def test_iter_chunked_lines(self):
+        data = GIT_DIFF.encode()
+        chunks = (data[i:i + 7] for i in range(0, len(data), 7))
+        assert list(iter_chunked_lines(chunks)) == GIT_DIFF.splitlines(True)
+
+    # Tests that LocalCodeReviewer exits when the diff file cannot be read.
+    def test_local_reviewer_invalid_path(self):
+        from local_diff_reviewer.local_diff_reviewer import LocalCodeReviewer
+
+        with pytest.raises(SystemExit):
+            LocalCodeReviewer().iter_diff_files("invalid_path")
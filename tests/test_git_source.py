@@ -0,0 +1,109 @@
+import subprocess
+import threading
+import time
+
+import pytest
+
+from local_diff_reviewer.local_diff_reviewer import LocalCodeReviewer
+from review_common.git_source import GitError, commit_diff_lines, iter_git_lines, list_commits, staged_diff_lines
+from review_common.openai_client import OpenAIClient
+
+
+def git(repo, *args):
+    return subprocess.run(["git", *args], cwd=repo, check=True, capture_output=True, text=True).stdout
+
+
+@pytest.fixture
+def repo(tmp_path):
+    git(tmp_path, "init", "-q", "-b", "main")
+    git(tmp_path, "config", "user.email", "dev@example.com")
+    git(tmp_path, "config", "user.name", "Dev")
+    for index in range(4):
+        (tmp_path / f"module_{index}.py").write_text(f"value = {index}\n")
+        git(tmp_path, "add", ".")
+        git(tmp_path, "commit", "-q", "-m", f"Add module {index}\n\nDetails {index}.")
+    return str(tmp_path)
+
+
+class FakeReviewer(LocalCodeReviewer):
+    def __init__(self, delay=0.0):
+        super().__init__(client=OpenAIClient(api_key="test"))
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def message_reviewer(self, system_prompt, prompt, progress_callback=None, **kwargs):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+        files = [line[6:] for line in prompt.splitlines() if line.startswith("+++ b/")]
+        return f"- reviewed {', '.join(files)}\n"
+
+
+class TestGitSource:
+
+    # Tests that a range lists its commits oldest first, with their messages.
+    def test_list_range(self, repo):
+        commits = list_commits("HEAD~3..HEAD", repo)
+        assert [commit.subject for commit in commits] == ["Add module 1", "Add module 2", "Add module 3"]
+        assert commits[0].message == "Add module 1\n\nDetails 1."
+
+    # Tests that a single revision resolves to one commit and that the root commit has a diff.
+    def test_single_commit(self, repo):
+        (commit,) = list_commits("HEAD~3", repo)
+        assert commit.subject == "Add module 0"
+        assert "+++ b/module_0.py\n" in "".join(commit_diff_lines(commit.sha, repo))
+
+    # Tests that unknown revisions raise GitError.
+    def test_unknown_revision(self, repo):
+        with pytest.raises(GitError):
+            list_commits("no-such-branch", repo)
+        with pytest.raises(GitError):
+            list(commit_diff_lines("0" * 40, repo))
+
+    # Tests that git writing more than a pipe buffer to stderr neither stalls the reader nor loses the error.
+    def test_noisy_stderr(self, repo):
+        noisy = "alias.noisy=!yes warning | head -c 500000 >&2; echo done; exit {}"
+        result = []
+        thread = threading.Thread(
+            target=lambda: result.extend(iter_git_lines(["-c", noisy.format(0), "noisy"], repo)), daemon=True
+        )
+        thread.start()
+        thread.join(10)
+        assert not thread.is_alive() and result == ["done\n"]
+        with pytest.raises(GitError, match="warning"):
+            list(iter_git_lines(["-c", noisy.format(1), "noisy"], repo))
+
+    # Tests that only staged changes are part of the staged diff.
+    def test_staged_diff(self, repo, tmp_path):
+        (tmp_path / "staged.py").write_text("staged = True\n")
+        (tmp_path / "module_0.py").write_text("value = 'unstaged'\n")
+        git(repo, "add", "staged.py")
+        diff = "".join(staged_diff_lines(repo))
+        assert "+++ b/staged.py" in diff
+        assert "module_0.py" not in diff
+
+
+class TestReviewCommits:
+
+    # Tests that commit reviews overlap but are yielded in commit order.
+    def test_pipelined_in_order(self, repo):
+        reviewer = FakeReviewer(delay=0.1)
+        results = list(reviewer.review_commits(list_commits("HEAD~3..HEAD", repo), repo=repo, commit_workers=3))
+        assert [commit.subject for commit, _, _ in results] == ["Add module 1", "Add module 2", "Add module 3"]
+        assert [review for _, review, _ in results] == [f"- reviewed module_{i}.py\n" for i in (1, 2, 3)]
+        assert all(error is None for _, _, error in results)
+        assert reviewer.max_active > 1
+
+    # Tests that a failing commit is reported without stopping the range.
+    def test_failure_is_reported(self, repo):
+        reviewer = FakeReviewer()
+        commits = list_commits("HEAD~2..HEAD", repo)
+        broken = commits[0]._replace(sha="0" * 40)
+        results = list(reviewer.review_commits([broken, commits[1]], repo=repo))
+        assert results[0][1] is None and "diff-tree" in results[0][2]
+        assert results[1][1] == "- reviewed module_3.py\n"
@@ -0,0 +1,121 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from review_common.github_client import DIFF_MEDIA_TYPE, GitHubClient
+from review_common.response_cache import ResponseCache
+
+import pytest
+import requests
+
+
+class FakeGitHubHandler(BaseHTTPRequestHandler):
+    etag = '"v1"'
+    failures = 0
+    requests = []
+
+    def do_GET(self):
+        FakeGitHubHandler.requests.append((self.path, dict(self.headers)))
+        if FakeGitHubHandler.failures:
+            FakeGitHubHandler.failures -= 1
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.headers.get("If-None-Match") == FakeGitHubHandler.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        if self.path == "/repos/test/repo/pulls/1":
+            body = json.dumps({"title": "Test PR Title", "diff_url": "/test/repo/pull/1.diff"}).encode()
+        elif self.path == "/missing":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        else:
+            body = b"diff --git a/file1.txt b/file1.txt\n"
+        self.send_response(200)
+        self.send_header("ETag", FakeGitHubHandler.etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestGitHubClient:
+    @pytest.fixture(scope="function")
+    # Starts a local stand-in for the GitHub API and returns its base URL.
+    def server_url(self):
+        FakeGitHubHandler.etag = '"v1"'
+        FakeGitHubHandler.failures = 0
+        FakeGitHubHandler.requests = []
+        server = ThreadingHTTPServer(("127.0.0.1", 0), FakeGitHubHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield f"http://127.0.0.1:{server.server_port}"
+        server.shutdown()
+        server.server_close()
+
+    @pytest.fixture(scope="function")
+    # Returns a client pointed at the local server with an ETag store in a temporary directory.
+    def client(self, server_url, tmp_path):
+        return GitHubClient(
+            token="test_token",
+            api_url=server_url,
+            etag_cache=ResponseCache(cache_dir=str(tmp_path)),
+            backoff_factor=0,
+        )
+
+    # Tests that pull request metadata is fetched from the API with the token attached.
+    def test_get_pull(self, client):
+        assert client.get_pull("test/repo", 1)["title"] == "Test PR Title"
+        path, headers = FakeGitHubHandler.requests[0]
+        assert path == "/repos/test/repo/pulls/1"
+        assert headers["Authorization"] == "token test_token"
+
+    # Tests that a repeated fetch revalidates with If-None-Match and is served from the ETag store.
+    def test_conditional_request(self, client, server_url):
+        first = client.get(f"{server_url}/test/repo/pull/1.diff", accept=DIFF_MEDIA_TYPE)
+        second = client.get(f"{server_url}/test/repo/pull/1.diff", accept=DIFF_MEDIA_TYPE)
+        assert first == second
+        assert FakeGitHubHandler.requests[1][1]["If-None-Match"] == '"v1"'
+        assert client.stats() == {"requests_made": 2, "requests_saved": 1}
+
+    # Tests that a streamed fetch revalidates with If-None-Match and shares the ETag store with fetch.
+    def test_conditional_stream(self, client, server_url):
+        url = f"{server_url}/test/repo/pull/1.diff"
+        first = list(client.iter_lines(url, accept=DIFF_MEDIA_TYPE))
+        second = list(client.iter_lines(url, accept=DIFF_MEDIA_TYPE))
+        assert first == second == ["diff --git a/file1.txt b/file1.txt\n"]
+        assert FakeGitHubHandler.requests[1][1]["If-None-Match"] == '"v1"'
+        assert client.fetch(url, accept=DIFF_MEDIA_TYPE).not_modified
+        assert client.stats() == {"requests_made": 3, "requests_saved": 2}
+
+    # Tests that a streamed body read only in part is not stored.
+    def test_partial_stream_not_stored(self, client, server_url):
+        url = f"{server_url}/test/repo/pull/1.diff"
+        next(client.iter_lines(url, accept=DIFF_MEDIA_TYPE), None)
+        list(client.iter_lines(url, accept=DIFF_MEDIA_TYPE))
+        assert "If-None-Match" not in FakeGitHubHandler.requests[1][1]
+
+    # Tests that a changed ETag returns the new body.
+    def test_changed_etag(self, client):
+        client.get_pull("test/repo", 1)
+        FakeGitHubHandler.etag = '"v2"'
+        client.get_pull("test/repo", 1)
+        assert client.stats() == {"requests_made": 2, "requests_saved": 0}
+
+    # Tests that transient server errors are retried.
+    def test_retry_on_server_error(self, client):
+        FakeGitHubHandler.failures = 2
+        assert client.get_pull("test/repo", 1)["title"] == "Test PR Title"
+        assert len(FakeGitHubHandler.requests) == 3
+
+    # Tests that client errors are raised rather than retried.
+    def test_client_error(self, client, server_url):
+        with pytest.raises(requests.HTTPError):
+            client.get(f"{server_url}/missing")
+        assert len(FakeGitHubHandler.requests) == 1
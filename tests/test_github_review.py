@@ -0,0 +1,121 @@
+from unidiff import PatchSet
+
+from benchmarks.fake_servers import FakeGitHubServer
+from pull_request_reviewer.pull_request_reviewer import PRReviewer
+from review_common.github_client import GitHubClient
+from review_common.incremental import ReviewStateStore
+from review_common.github_review import DiffLineIndex, format_review_body, split_findings
+from review_common.rendering import Finding
+
+DIFF = """diff --git a/src/app/auth.py b/src/app/auth.py
+index 1234567..abcdefg 100644
+--- a/src/app/auth.py
++++ b/src/app/auth.py
+@@ -1,3 +1,3 @@
+ import hmac
+-check(token)
++pass
+ done()
+"""
+
+REVIEW = """- `auth.py:2` the token is no longer checked
+- `src/app/auth.py` line 40 is outside the diff
+- Consider adding a test for the login flow
+"""
+
+TOKEN_HUNK = """ import hmac
+-check(token)
++pass
+ done()
+"""
+
+FIRST_HEAD = f"""diff --git a/src/app/auth.py b/src/app/auth.py
+--- a/src/app/auth.py
++++ b/src/app/auth.py
+@@ -5,3 +5,3 @@
+{TOKEN_HUNK}"""
+
+# The base moved down ten lines and a new hunk now covers line 6.
+SECOND_HEAD = f"""diff --git a/src/app/auth.py b/src/app/auth.py
+--- a/src/app/auth.py
++++ b/src/app/auth.py
+@@ -5,2 +5,2 @@
+-retries = 1
++retries = 3
+ timeout = 5
+@@ -15,3 +15,3 @@
+{TOKEN_HUNK}"""
+
+
+def incremental_reply(prompt, model):
+    if "+pass" in prompt:
+        return "- Line 6: the token is no longer checked"
+    return "- Line 5: retries changed without a test"
+
+
+class TestGitHubReview:
+
+    # Tests that findings on diff lines become inline comments and the rest go to the review body.
+    def test_split_findings(self):
+        index = DiffLineIndex(PatchSet(DIFF))
+        comments, general = split_findings(REVIEW, index)
+        assert [(c.path, c.line, c.side) for c in comments] == [("src/app/auth.py", 2, "RIGHT")]
+        assert [finding.line for finding in general] == [40, None]
+        assert index.locate(Finding("src/app/auth.py", 2, "")) == ("src/app/auth.py", 2, "RIGHT")
+        body = format_review_body(general, len(comments))
+        assert body.startswith("### Automated code review")
+        assert "1 comment(s) were left inline." in body
+
+    # Tests that ambiguous path suffixes are not resolved.
+    def test_ambiguous_suffix(self):
+        index = DiffLineIndex(PatchSet(DIFF + DIFF.replace("src/app/", "lib/")))
+        assert index.resolve_path("auth.py") is None
+        assert index.resolve_path("app/auth.py") == "src/app/auth.py"
+
+    # Tests that a review is posted in one call and not posted again on a second run.
+    def test_post_once(self, fake_client):
+        fake_client.reply = REVIEW
+        with FakeGitHubServer() as server:
+            pr_url = server.add_pull("o/r", 1, DIFF)
+            reviewer = PRReviewer(client=fake_client, github=GitHubClient(token="test", api_url=server.url))
+            result = reviewer.review_pull_request(pr_url, raw=True, post=True)
+            assert "token is no longer checked" in result
+            assert server.stats["reviews_posted"] == 1
+            (comment,) = server.comments["o/r/1"]
+            assert (comment["path"], comment["line"], comment["side"]) == ("src/app/auth.py", 2, "RIGHT")
+            (review,) = server.reviews["o/r/1"]
+            assert "Consider adding a test" in review["body"]
+
+            reviewer.review_pull_request(pr_url, raw=True, post=True)
+            assert server.stats["reviews_posted"] == 1
+
+    # Tests that new findings are posted without repeating comments already on the pull request.
+    def test_post_only_new_comments(self, fake_client):
+        fake_client.reply = REVIEW
+        with FakeGitHubServer() as server:
+            pr_url = server.add_pull("o/r", 1, DIFF)
+            reviewer = PRReviewer(client=fake_client, github=GitHubClient(token="test", api_url=server.url))
+            reviewer.review_pull_request(pr_url, raw=True, post=True)
+            fake_client.reply = REVIEW + "- `auth.py` line 1: `hmac` is unused\n"
+            reviewer.review_pull_request(pr_url, raw=True, post=True)
+            assert server.stats["reviews_posted"] == 2
+            assert [comment["line"] for comment in server.comments["o/r/1"]] == [2, 1]
+
+    # Tests that an incremental review is posted from one fetch of the diff, with earlier heads' findings kept out of the inline comments.
+    def test_post_incremental_review(self, fake_client, tmp_path):
+        fake_client.reply = incremental_reply
+        store = ReviewStateStore(str(tmp_path))
+        with FakeGitHubServer() as server:
+            pr_url = server.add_pull("o/r", 1, FIRST_HEAD)
+            reviewer = PRReviewer(client=fake_client, github=GitHubClient(token="test", api_url=server.url))
+            reviewer.review_pull_request(pr_url, raw=True, state_store=store)
+            server.add_pull("o/r", 1, SECOND_HEAD)
+            server.reset()
+            result = reviewer.review_pull_request(pr_url, raw=True, state_store=store, post=True)
+            assert "token is no longer checked" in result and "retries changed" in result
+            assert server.stats["diff_bytes"] == len(SECOND_HEAD.encode())
+            (comment,) = server.comments["o/r/1"]
+            assert (comment["line"], comment["body"]) == (5, "Line 5: retries changed without a test")
+            (review,) = server.reviews["o/r/1"]
+            assert "token is no longer checked" in review["body"]
+            assert review["commit_id"] == server.pull_json("o", "r", "1")["head"]["sha"]
@@ -0,0 +1,113 @@
+import threading
+import time
+
+from benchmarks.fake_servers import FakeOpenAIServer
+from review_common.hedging import BACKUP, PRIMARY, AttemptPool, HedgedClient
+from review_common.openai_client import OpenAIClient
+
+
+def fast_server(**kwargs):
+    return FakeOpenAIServer(latency=0, tokens_per_second=1e6, **kwargs)
+
+
+def hedged_client(primary, backup, **kwargs):
+    return HedgedClient(
+        OpenAIClient(api_key="test", api_base=backup.api_base, max_retries=0),
+        api_key="test",
+        api_base=primary.api_base,
+        max_retries=0,
+        **kwargs,
+    )
+
+
+class TestHedging:
+
+    # Tests that a fast primary answers alone.
+    def test_no_hedge_when_fast(self):
+        with fast_server() as primary, fast_server() as backup:
+            client = hedged_client(primary, backup, hedge_delay=1.0)
+            assert "Consider handling" in client.chat("system", "prompt")
+            assert (primary.stats["requests"], backup.stats.get("requests", 0)) == (1, 0)
+            assert client.stats()["hedged"] == 0
+
+    # Tests that a slow primary is hedged, the backup's reply wins and the loser is cancelled.
+    def test_hedge_slow_primary(self):
+        with fast_server(slow_every=1, slow_latency=1.0) as primary, fast_server() as backup:
+            client = hedged_client(primary, backup, hedge_delay=0.05, backup_model="gpt-3.5-turbo")
+            start = time.perf_counter()
+            client.chat("system", "prompt")
+            assert time.perf_counter() - start < 0.8
+            stats = client.hedge_stats
+            assert (stats.calls, stats.hedged, stats.backup_wins, stats.cancelled) == (1, 1, 1, 1)
+            assert client.backup.requests == 1
+            assert "1 of 1 call(s) hedged" in client.usage_summary()
+
+    # Tests that the losing stream is closed before its reply is done and the tokens it was billed count as wasted.
+    def test_loser_closed(self):
+        slow = FakeOpenAIServer(latency=0, tokens_per_second=200, completion_tokens=2000, slow_every=1, slow_latency=0.2)
+        with slow as primary, fast_server() as backup:
+            client = hedged_client(primary, backup, hedge_delay=0.05)
+            client.chat("system", "prompt")
+            deadline = time.monotonic() + 5
+            while not (client.hedge_stats.wasted_tokens and primary.stats.get("aborted")) and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert primary.stats["aborted"] == 1
+            assert 0 < client.hedge_stats.wasted_tokens < 100
+            assert client.stats()["wasted_tokens"] == client.hedge_stats.wasted_tokens
+            assert "token(s) wasted" in client.usage_summary()
+
+    # Tests that a failing primary fails over at once and is raced once it is unhealthy.
+    def test_failover(self):
+        with fast_server(rate_limit_every=1) as primary, fast_server() as backup:
+            client = hedged_client(primary, backup, hedge_delay=10.0)
+            for _ in range(3):
+                assert "Consider handling" in client.chat("system", "prompt")
+            assert client.hedge_stats.failovers == 3
+            assert not client.health[PRIMARY].healthy
+            assert client.delay_for("gpt-4") == 0.0
+            assert client.health[BACKUP].successes == 3
+
+    # Tests that the hedge delay follows the primary's latency percentile once enough samples exist.
+    def test_adaptive_delay(self):
+        client = HedgedClient(OpenAIClient(api_key="test"), api_key="test", hedge_delay=5.0, min_samples=10)
+        assert client.delay_for("gpt-4") == 5.0
+        for index in range(1, 21):
+            client.health[PRIMARY].record_success("gpt-4", index / 10)
+        assert client.delay_for("gpt-4") == 1.9
+        assert client.delay_for("gpt-3.5-turbo") == 5.0
+        for _ in range(3):
+            client.health[BACKUP].record_failure()
+        assert client.delay_for("gpt-4") is None
+
+    # Tests that a failing backup is probed again after the cooldown and recovers on success.
+    def test_backup_recovers(self):
+        now = [0.0]
+        client = HedgedClient(
+            OpenAIClient(api_key="test"), api_key="test", hedge_delay=5.0, cooldown=30.0, clock=lambda: now[0]
+        )
+        for _ in range(3):
+            client.health[BACKUP].record_failure()
+        assert client.delay_for("gpt-4") is None
+        now[0] = 29.0
+        assert client.delay_for("gpt-4") is None
+        now[0] = 30.0
+        assert client.delay_for("gpt-4") == 5.0
+        client.health[BACKUP].record_failure()
+        assert client.delay_for("gpt-4") is None
+        now[0] = 60.0
+        client.health[BACKUP].record_success("gpt-4", 0.1)
+        assert client.health[BACKUP].healthy and client.delay_for("gpt-4") == 5.0
+
+    # Tests that attempts reuse a bounded set of long-lived threads.
+    def test_attempt_threads_reused(self):
+        with fast_server() as primary, fast_server() as backup:
+            client = hedged_client(primary, backup, hedge_delay=1.0, max_threads=2)
+            for _ in range(5):
+                client.chat("system", "prompt")
+            assert len(client.pool.threads) == 1
+        pool = AttemptPool(max_threads=2)
+        release = threading.Event()
+        futures = [pool.submit(release.wait, 5) for _ in range(4)]
+        assert len(pool.threads) == 2
+        release.set()
+        assert [future.result(5) for future in futures] == [True] * 4
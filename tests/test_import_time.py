@@ -0,0 +1,30 @@
+import subprocess
+import sys
+
+from benchmarks.bench_import_time import ENTRY_POINTS, HEAVY_MODULES, heavy_modules_loaded
+
+import pytest
+
+
+class TestImportTime:
+
+    # Tests that importing a reviewer module does not pull in heavy dependencies.
+    @pytest.mark.parametrize("module", ENTRY_POINTS)
+    def test_import_is_lazy(self, module):
+        assert heavy_modules_loaded(module) == []
+
+    # Tests that --help prints usage without importing heavy dependencies.
+    @pytest.mark.parametrize("module", ENTRY_POINTS)
+    def test_help_is_lazy(self, module):
+        code = (
+            "import runpy, sys\n"
+            f"sys.argv = [{module!r}, '--help']\n"
+            "try:\n"
+            f"    runpy.run_module({module!r}, run_name='__main__')\n"
+            "except SystemExit:\n"
+            "    pass\n"
+            f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules), file=sys.stderr)\n"
+        )
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+        assert "usage:" in result.stdout
+        assert result.stderr.strip() == ""
@@ -0,0 +1,170 @@
+from unidiff import PatchSet
+from pull_request_reviewer.pull_request_reviewer import PRReviewer
+from review_common.cascade import ModelCascade
+from review_common.compaction import DiffCompactor
+from review_common.incremental import ReviewStateStore, fingerprint_hunk, plan_file_review
+
+import pytest
+
+
+def make_diff(offset, second_change):
+    return f"""diff --git a/app.py b/app.py
+index 1234567..abcdefg 100644
+--- a/app.py
++++ b/app.py
+@@ -{offset},2 +{offset},2 @@
+-x = 1
++x = 2
+ y = 3
+@@ -{offset + 20},2 +{offset + 20},2 @@
+-z = 1
++{second_change}
+ w = 3
+diff --git a/util.py b/util.py
+index 1234567..abcdefg 100644
+--- a/util.py
++++ b/util.py
+@@ -1,2 +1,2 @@
+-a = 1
++a = 2
+ b = 3
+"""
+
+
+DUPLICATE_HUNKS = """diff --git a/guard.py b/guard.py
+index 1234567..abcdefg 100644
+--- a/guard.py
++++ b/guard.py
+@@ -3,2 +3,2 @@
+-    if not user:
++    if user is None:
+         return
+@@ -30,2 +30,2 @@
+-    if not user:
++    if user is None:
+         return
+"""
+
+
+def triage_reply(prompt, model):
+    if "change to util.py" in prompt:
+        return '{"risk": 1, "verdict": "Renames a constant."}'
+    return '{"risk": 8, "verdict": "Touches state."}'
+
+
+def fake_pull_request(sha):
+    return {
+        "head": {"sha": sha},
+        "diff_url": "https://github.com/test/repo/pull/1.diff",
+        "title": "Test PR Title",
+        "body": "This is a test PR description.",
+    }
+
+
+class TestIncrementalReview:
+    @pytest.fixture(scope="function")
+    # Returns a PRReviewer whose GitHub and OpenAI calls are served locally.
+    def reviewer(self, monkeypatch):
+        reviewer = PRReviewer()
+        reviewer.prompts = []
+        reviewer.head = fake_pull_request("a" * 40)
+        reviewer.diff = make_diff(1, "z = 2")
+        monkeypatch.setattr(reviewer, "fetch_pull_request", lambda pr_url: reviewer.head)
+        monkeypatch.setattr(reviewer, "iter_diff_files", lambda diff_url: iter(PatchSet(reviewer.diff)))
+
+        def message_prreviewer(system_prompt, prompt, **kwargs):
+            reviewer.prompts.append(prompt)
+            return f"- Review {len(reviewer.prompts)}"
+
+        monkeypatch.setattr(reviewer, "message_prreviewer", message_prreviewer)
+        return reviewer
+
+    # Tests that hunk fingerprints ignore line numbers but not content.
+    def test_fingerprint_ignores_line_numbers(self):
+        original = PatchSet(make_diff(1, "z = 2"))[0]
+        shifted = PatchSet(make_diff(40, "z = 2"))[0]
+        changed = PatchSet(make_diff(1, "z = 3"))[0]
+        assert fingerprint_hunk(original[0]) == fingerprint_hunk(shifted[0])
+        assert fingerprint_hunk(original[1]) != fingerprint_hunk(changed[1])
+
+    # Tests that only hunks not covered by an earlier review are planned for review.
+    def test_plan_file_review(self):
+        file = PatchSet(make_diff(1, "z = 3"))[0]
+        previous = {"reviews": [{"hunks": [fingerprint_hunk(file[0]), "gone"], "review": "ok", "head_sha": "a"}]}
+        plan = plan_file_review(file, previous)
+        assert plan.carried_over == previous["reviews"]
+        assert [fingerprint_hunk(hunk) for hunk in plan.new_hunks] == [fingerprint_hunk(file[1])]
+
+    # Tests that a change repeated in one file is planned once per copy.
+    def test_plan_duplicate_hunks(self):
+        file = PatchSet(DUPLICATE_HUNKS)[0]
+        fingerprint = fingerprint_hunk(file[0])
+        assert fingerprint == fingerprint_hunk(file[1])
+        assert plan_file_review(file, None).new_hunks == [file[0], file[1]]
+        one = {"reviews": [{"hunks": [fingerprint], "review": "ok", "head_sha": "a"}]}
+        assert plan_file_review(file, one).new_hunks == [file[1]]
+        both = {"reviews": [{"hunks": [fingerprint, fingerprint], "review": "ok", "head_sha": "a"}]}
+        assert plan_file_review(file, both).new_hunks == []
+
+    # Tests that both copies of a repeated change are reviewed and recorded.
+    def test_duplicate_hunks_are_reviewed(self, reviewer, tmp_path):
+        store = ReviewStateStore(str(tmp_path))
+        reviewer.diff = DUPLICATE_HUNKS
+        reviewer.review_pull_request_incrementally("https://github.com/test/repo/pull/1", store)
+        assert reviewer.prompts[0].count("+    if user is None:") == 2
+        (entry,) = store.load("test/repo/pull/1")["files"]["guard.py"]["reviews"]
+        assert len(entry["hunks"]) == 2
+
+        reviewer.head = fake_pull_request("b" * 40)
+        reviewer.review_pull_request_incrementally("https://github.com/test/repo/pull/1", store)
+        assert len(reviewer.prompts) == 1
+
+    # Tests that an unchanged head SHA reuses the stored review without fetching the diff.
+    def test_same_head_is_not_reviewed_again(self, reviewer, tmp_path):
+        store = ReviewStateStore(str(tmp_path))
+        first = reviewer.review_pull_request_incrementally("https://github.com/test/repo/pull/1", store)
+        reviewer.diff = "not a diff"
+        second = reviewer.review_pull_request_incrementally("https://github.com/test/repo/pull/1", store)
+        assert first == second
+        assert len(reviewer.prompts) == 2
+
+    # Tests that a rebased push only sends the changed hunk and carries over untouched findings.
+    def test_only_changed_hunks_are_reviewed(self, reviewer, tmp_path):
+        store = ReviewStateStore(str(tmp_path))
+        reviewer.review_pull_request_incrementally("https://github.com/test/repo/pull/1", store)
+
+        reviewer.head = fake_pull_request("b" * 40)
+        reviewer.diff = make_diff(30, "z = 3")
+        result = reviewer.review_pull_request_incrementally("https://github.com/test/repo/pull/1", store)
+
+        assert len(reviewer.prompts) == 3
+        assert "+z = 3" in reviewer.prompts[-1]
+        assert "+x = 2" not in reviewer.prompts[-1]
+        assert "Review 1" in result and "Review 2" in result and "Review 3" in result
+        assert "From the review of aaaaaaa" in result
+
+    # Tests that files whose review failed are retried on the next run of the same head.
+    def test_failed_files_are_retried(self, reviewer, tmp_path, monkeypatch):
+        store = ReviewStateStore(str(tmp_path))
+        monkeypatch.setattr(reviewer, "message_prreviewer", lambda system_prompt, prompt, **kwargs: "")
+        reviewer.review_pull_request_incrementally("https://github.com/test/repo/pull/1", store)
+        assert store.load("test/repo/pull/1")["head_sha"] is None
+
+    # Tests that new hunks go through compaction, the cascade and chunking, as in a full review.
+    def test_review_pipeline(self, reviewer, tmp_path, fake_client):
+        fake_client.reply = triage_reply
+        reviewer.cascade = ModelCascade(fake_client)
+        reviewer.compactor = DiffCompactor(context_lines=0)
+        store = ReviewStateStore(str(tmp_path))
+        result = reviewer.review_pull_request_incrementally(
+            "https://github.com/test/repo/pull/1", store, raw=True, chunk_tokens=35
+        )
+        assert len(reviewer.prompts) == 2
+        assert all("app.py" in prompt and " y = 3" not in prompt for prompt in reviewer.prompts)
+        assert "Low risk (triage only): Renames a constant. (risk 1/10)" in result
+        state = store.load("test/repo/pull/1")
+        assert state["head_sha"] == "a" * 40
+        (entry,) = state["files"]["app.py"]["reviews"]
+        assert len(entry["hunks"]) == 2
+        assert "Review 1" in entry["review"] and "Review 2" in entry["review"]
+        assert reviewer.cascade.stats.escalated == 1
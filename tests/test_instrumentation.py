@@ -0,0 +1,88 @@
+import io
+import json
+import time
+
+from openai.openai_object import OpenAIObject
+from benchmarks.bench_reviewers import synthetic_diff
+from benchmarks.fake_servers import FakeGitHubServer, FakeOpenAIServer
+from pull_request_reviewer.pull_request_reviewer import PRReviewer
+from review_common.github_client import GitHubClient
+from review_common.instrumentation import NULL_SPAN, Instrumentation, JsonLinesExporter, PrometheusExporter
+from review_common.openai_client import OpenAIClient
+
+import openai
+
+
+class TestInstrumentation:
+
+    # Tests that disabled instrumentation hands out the shared no-op span and the original iterator.
+    def test_disabled_is_free(self):
+        instrumentation = Instrumentation()
+        assert instrumentation.span("stage") is NULL_SPAN
+        items = iter([1, 2])
+        assert instrumentation.timed_iter("stage", items) is items
+
+    # Tests that nested spans are charged to the innermost stage.
+    def test_nested_self_time(self):
+        spans = []
+        instrumentation = Instrumentation([spans.append])
+        with instrumentation.span("outer"):
+            time.sleep(0.02)
+            with instrumentation.span("inner", size=3):
+                time.sleep(0.05)
+        inner, outer = spans
+        assert (inner.name, inner.attributes) == ("inner", {"size": 3})
+        assert outer.duration >= inner.duration + 0.02
+        assert abs(outer.self_time - (outer.duration - inner.duration)) < 1e-6
+
+    # Tests that a timed iterator emits one span with the time spent producing items.
+    def test_timed_iter(self):
+        spans = []
+        instrumentation = Instrumentation([spans.append])
+
+        def produce():
+            for i in range(3):
+                time.sleep(0.01)
+                yield i
+
+        for _ in instrumentation.timed_iter("parse", produce()):
+            time.sleep(0.02)
+        (span,) = spans
+        assert span.attributes == {"items": 3}
+        assert 0.03 <= span.duration < 0.06
+
+    # Tests that model calls record token usage and estimated cost.
+    def test_model_call_usage(self, mocker):
+        spans = []
+        response = OpenAIObject.construct_from({
+            "choices": [{"message": {"content": "ok"}}],
+            "usage": {"prompt_tokens": 1000, "completion_tokens": 500, "total_tokens": 1500},
+        })
+        mocker.patch.object(openai.ChatCompletion, "create", return_value=response)
+        client = OpenAIClient(instrumentation=Instrumentation([spans.append]))
+        client.chat("system", "prompt", model="gpt-4-0613")
+        model_call = spans[-1]
+        assert model_call.name == "model_call"
+        assert model_call.attributes["total_tokens"] == 1500
+        assert abs(model_call.attributes["cost_usd"] - 0.06) < 1e-9
+        assert client.stats()["prompt_tokens"] == 1000
+
+    # Tests that a pull request review reports every stage through both exporters.
+    def test_pull_request_stages(self, tmp_path):
+        jsonl = io.StringIO()
+        prometheus = PrometheusExporter(str(tmp_path / "metrics.prom"))
+        instrumentation = Instrumentation([JsonLinesExporter(jsonl), prometheus])
+        with FakeOpenAIServer(latency=0, tokens_per_second=1e6) as openai_server, FakeGitHubServer() as github_server:
+            pr_url = github_server.add_pull("o/r", 1, synthetic_diff(3))
+            reviewer = PRReviewer(
+                client=OpenAIClient(api_key="test", api_base=openai_server.api_base, instrumentation=instrumentation),
+                github=GitHubClient(token="test", api_url=github_server.url),
+            )
+            reviewer.review_pull_request(pr_url, progress_callback=None)
+
+        stages = [json.loads(line)["span"] for line in jsonl.getvalue().splitlines()]
+        assert set(stages) == {"fetch_metadata", "fetch_diff", "parse_diff", "build_prompt", "rate_limit_wait", "model_call", "render"}
+        instrumentation.close()
+        metrics = (tmp_path / "metrics.prom").read_text()
+        assert 'review_stage_calls_total{stage="model_call"} 1' in metrics
+        assert 'review_model_tokens_total{model="gpt-4",kind="prompt"}' in metrics
@@ -0,0 +1,150 @@
+import threading
+import time
+
+from openai.openai_object import OpenAIObject
+from benchmarks.fake_servers import FakeOpenAIServer
+from review_common.openai_client import ModelRequestError, OpenAIClient, RequestCancelled
+from review_common.rate_limit import TokenBucket
+
+import openai
+import pytest
+
+
+def make_response(content, total_tokens=10):
+    return OpenAIObject.construct_from(
+        {"choices": [{"message": {"content": content}}], "usage": {"total_tokens": total_tokens}}
+    )
+
+
+class TestOpenAIClient:
+    @pytest.fixture(autouse=True)
+    # Makes backoff sleeps instant and records their durations.
+    def sleeps(self, monkeypatch):
+        sleeps = []
+        monkeypatch.setattr("review_common.openai_client.time.sleep", sleeps.append)
+        return sleeps
+
+    # Tests that chat returns the stripped completion text.
+    def test_chat(self, mocker):
+        mocker.patch.object(openai.ChatCompletion, "create", return_value=make_response(" Great job! "))
+        assert OpenAIClient().chat("test system prompt", "test prompt") == "Great job!"
+
+    # Tests that rate-limit errors are retried, honouring Retry-After when present.
+    def test_retry_after(self, mocker, sleeps):
+        error = openai.error.RateLimitError("slow down", headers={"retry-after": "7"})
+        mocker.patch.object(openai.ChatCompletion, "create", side_effect=[error, make_response("ok")])
+        client = OpenAIClient()
+        assert client.chat("test system prompt", "test prompt") == "ok"
+        assert sleeps == [7.0]
+        assert client.stats()["retries"] == 1
+
+    # Tests that backoff without Retry-After is jittered and grows exponentially up to the cap.
+    def test_exponential_backoff(self, mocker, sleeps):
+        errors = [openai.error.ServiceUnavailableError("busy") for _ in range(4)]
+        mocker.patch.object(openai.ChatCompletion, "create", side_effect=errors + [make_response("ok")])
+        client = OpenAIClient(base_delay=1, max_delay=4)
+        client.chat("test system prompt", "test prompt")
+        assert [delay <= cap for delay, cap in zip(sleeps, [1, 2, 4, 4])] == [True] * 4
+
+    # Tests that every failure surfaces as ModelRequestError once retries are exhausted.
+    def test_retries_exhausted(self, mocker):
+        create = mocker.patch.object(openai.ChatCompletion, "create", side_effect=openai.error.APIConnectionError("down"))
+        with pytest.raises(ModelRequestError, match="Error calling OpenAI API"):
+            OpenAIClient(max_retries=2).chat("test system prompt", "test prompt")
+        assert create.call_count == 3
+
+    # Tests that a stream failing after output was shown is not retried, while one failing before any output is.
+    def test_stream_fails_midway(self, mocker):
+        def stream(*deltas, error=None):
+            for delta in deltas:
+                yield OpenAIObject.construct_from({"choices": [{"delta": {"content": delta}}]})
+            if error is not None:
+                raise error
+
+        create = mocker.patch.object(
+            openai.ChatCompletion,
+            "create",
+            side_effect=[stream("first line\nsec", error=openai.error.APIError("reset")), stream("retried\n")],
+        )
+        lines = []
+        with pytest.raises(ModelRequestError, match="while streaming"):
+            OpenAIClient().chat("test system prompt", "test prompt", progress_callback=lines.append)
+        assert lines == ["first line"] and create.call_count == 1
+
+        create = mocker.patch.object(
+            openai.ChatCompletion,
+            "create",
+            side_effect=[stream(error=openai.error.APIError("reset")), stream("retried\n")],
+        )
+        lines = []
+        assert OpenAIClient().chat("test system prompt", "test prompt", progress_callback=lines.append) == "retried"
+        assert lines == ["retried"] and create.call_count == 2
+
+    # Tests that errors which cannot succeed on retry are raised immediately.
+    def test_non_retryable_error(self, mocker):
+        create = mocker.patch.object(openai.ChatCompletion, "create", side_effect=openai.error.InvalidRequestError("too long", None))
+        with pytest.raises(ModelRequestError):
+            OpenAIClient().chat("test system prompt", "test prompt")
+        assert create.call_count == 1
+
+    # Tests that every reviewer uses the same error model.
+    def test_reviewers_share_error_model(self, mocker):
+        from code_reviewer.code_reviewer import CodeReviewer
+        from local_diff_reviewer.local_diff_reviewer import LocalCodeReviewer
+        from pull_request_reviewer.pull_request_reviewer import PRReviewer
+
+        mocker.patch.object(openai.ChatCompletion, "create", side_effect=openai.error.AuthenticationError("bad key"))
+        for reviewer, method in [(CodeReviewer(), "message_reviewer"), (LocalCodeReviewer(), "message_reviewer"), (PRReviewer(), "message_prreviewer")]:
+            with pytest.raises(ModelRequestError):
+                getattr(reviewer, method)("test system prompt", "test prompt")
+
+
+class TestTokenBucket:
+
+    # Tests that a full bucket serves a burst immediately and then paces callers at the refill rate.
+    def test_acquire(self):
+        bucket = TokenBucket(120)
+        assert bucket.acquire(120) == 0
+        assert bucket.acquire(1) == pytest.approx(0.5, abs=0.05)
+
+    # Tests that concurrent callers share the bucket without exceeding its rate.
+    def test_concurrent_acquire(self):
+        bucket = TokenBucket(6000)
+        bucket.acquire(6000)
+        start = time.perf_counter()
+        threads = [threading.Thread(target=bucket.acquire, args=(10,)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # 40 tokens at 100 tokens per second.
+        assert time.perf_counter() - start >= 0.38
+
+    # Tests that unused tokens can be returned to the bucket.
+    def test_release(self):
+        bucket = TokenBucket(100)
+        bucket.acquire(80)
+        bucket.release(50)
+        assert bucket._tokens == pytest.approx(70, abs=1)
+
+
+class TestCancel:
+
+    # Tests that cancelling a call mid-reply closes its stream and bills only what was received.
+    def test_cancel_mid_reply(self):
+        cancelled = threading.Event()
+        with FakeOpenAIServer(latency=0, tokens_per_second=200, completion_tokens=2000) as server:
+            client = OpenAIClient(api_key="test", api_base=server.api_base)
+
+            def cancel_after_first_line(line):
+                cancelled.set()
+
+            with pytest.raises(RequestCancelled):
+                client.chat(
+                    "test system prompt", "test prompt", progress_callback=cancel_after_first_line, cancelled=cancelled
+                )
+            deadline = time.monotonic() + 5
+            while not server.stats.get("aborted") and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert server.stats["aborted"] == 1
+        assert 0 < client.stats()["completion_tokens"] < 100
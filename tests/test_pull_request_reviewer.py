@@ -16,24 +16,14 @@ class TestPRReviewer:
 
     # Tests that extract_pr_info returns the correct diff_url, description, and title.
     def test_extract_pr_info(self, monkeypatch):
-        def mock_get_repo(repo_name):
-            class MockPR:
-                def __init__(self, diff_url, body, title):
-                    self.diff_url = diff_url
-                    self.body = body
-                    self.title = title
-
-            class MockRepo:
-                def get_pull(self, pr_id):
-                    return MockPR(
-                        "https://github.com/test/repo/pull/1.diff",
-                        "This is a test PR description.",
-                        "Test PR Title",
-                    )
-
-            return MockRepo()
-
-        monkeypatch.setattr("github.Github.get_repo", mock_get_repo)
+        def mock_get_pull(self, repo_name, pr_id):
+            return {
+                "diff_url": "https://github.com/test/repo/pull/1.diff",
+                "body": "This is a test PR description.",
+                "title": "Test PR Title",
+            }
+
+        monkeypatch.setattr("review_common.github_client.GitHubClient.get_pull", mock_get_pull)
 
         code_review_assistant = PRReviewer()
         diff_url, description, title = code_review_assistant.extract_pr_info(
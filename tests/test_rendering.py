@@ -0,0 +1,89 @@
+import io
+import json
+
+from review_common.rendering import ReviewRenderer, extract_findings, make_renderer, render_review
+
+import pytest
+
+REVIEW = """Here is my review.
+
+### Part 1/2: src/app.py, src/db.py
+
+- In `src/db.py:42` the query is built with string formatting.
+  This allows SQL injection.
+  - Use query parameters instead.
+- `src/app.py` ignores errors on line 10.
+
+Overall the change looks reasonable.
+
+### Part 2/2: README.md
+
+1. The install section is out of date.
+"""
+
+
+class TestRendering:
+
+    # Tests that bullets become findings attributed to the files named in part headings.
+    def test_extract_findings(self):
+        findings = list(extract_findings(REVIEW))
+        assert [(f.path, f.line) for f in findings] == [("src/db.py", 42), ("src/app.py", 10), ("README.md", None)]
+        assert "Use query parameters instead." in findings[0].message
+        assert "Overall" not in findings[1].message
+
+    # Tests that a review without bullets is kept whole and attributed to the default path.
+    def test_extract_findings_without_bullets(self):
+        findings = list(extract_findings("Looks good to me.", default_path="app.py"))
+        assert [(f.path, f.message) for f in findings] == [("app.py", "Looks good to me.")]
+
+    # Tests that the JSON lines renderer writes one record per finding.
+    def test_jsonl(self):
+        output = io.StringIO()
+        render_review("jsonl", output, "pr/1", REVIEW)
+        records = [json.loads(line) for line in output.getvalue().splitlines()]
+        assert len(records) == 3
+        assert records[0]["source"] == "pr/1" and records[0]["path"] == "src/db.py"
+
+    # Tests that a streamed SARIF log is valid JSON with locations and failure notifications.
+    def test_sarif(self):
+        output = io.StringIO()
+        renderer = make_renderer("sarif", output)
+        renderer.begin()
+        renderer.write("pr/1", REVIEW)
+        renderer.error("pr/2", "Not Found")
+        renderer.write("pr/3", "- Looks fine.")
+        renderer.end()
+        run = json.loads(output.getvalue())["runs"][0]
+        assert len(run["results"]) == 4
+        location = run["results"][0]["locations"][0]["physicalLocation"]
+        assert location == {"artifactLocation": {"uri": "src/db.py"}, "region": {"startLine": 42}}
+        assert "locations" not in run["results"][3]
+        assert run["invocations"][0]["executionSuccessful"] is False
+
+    # Tests that an empty SARIF log is still valid.
+    def test_sarif_without_results(self):
+        output = io.StringIO()
+        renderer = make_renderer("sarif", output)
+        renderer.begin()
+        renderer.end()
+        assert json.loads(output.getvalue())["runs"][0]["results"] == []
+
+    # Tests that the markdown renderer passes the review through untouched.
+    def test_markdown(self):
+        output = io.StringIO()
+        render_review("markdown", output, "pr/1", REVIEW)
+        assert output.getvalue() == f"## pr/1\n\n{REVIEW.strip()}\n\n"
+
+    # Tests that unknown formats are rejected.
+    def test_unknown_format(self):
+        with pytest.raises(ValueError):
+            make_renderer("html", io.StringIO())
+
+    # Tests that a renderer missing write or error cannot be created.
+    def test_incomplete_renderer(self):
+        class HalfRenderer(ReviewRenderer):
+            def write(self, source, review, default_path=None):
+                pass
+
+        with pytest.raises(TypeError):
+            HalfRenderer(io.StringIO())
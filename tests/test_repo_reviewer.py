@@ -0,0 +1,94 @@
+import io
+import json
+import threading
+import time
+
+from code_reviewer.code_reviewer import CodeReviewer
+from code_reviewer.repo_reviewer import review_repository
+from review_common.rendering import make_renderer
+
+
+class FakeCodeReviewer(CodeReviewer):
+    def __init__(self, delay=0.0):
+        super().__init__()
+        self.delay = delay
+        self.prompts = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def message_reviewer(self, system_prompt, prompt, **kwargs):
+        with self.lock:
+            self.prompts.append(prompt)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+        if "raise" in prompt:
+            raise ValueError("model error")
+        return "- Looks fine."
+
+
+def make_tree(root):
+    files = {
+        "src/app.py": "print('app')\n",
+        "src/copy_of_app.py": "print('app')\n",
+        "src/util.go": "package util\n",
+        "src/broken.py": "raise SystemExit\n",
+        "src/empty.py": "",
+        "src/big.py": "x = 1\n" * 100,
+        "src/gen_pb2.py": "# generated\n",
+        "src/models.py": "# Code generated by sqlc. DO NOT EDIT.\nx = 1\n",
+        "src/logo.png": "png",
+        "src/blob.py": "x = '\0'\n",
+        "node_modules/lib/index.js": "module.exports = 1\n",
+        ".git/config.py": "x = 1\n",
+    }
+    for path, content in files.items():
+        target = root / path
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_text(content)
+
+
+class TestRepoReviewer:
+
+    # Tests that a tree is filtered, deduplicated and reported file by file.
+    def test_review_repository(self, tmp_path):
+        make_tree(tmp_path)
+        reviewer = FakeCodeReviewer()
+        output = io.StringIO()
+        progress = []
+        stats = review_repository(
+            [str(tmp_path)], reviewer, make_renderer("jsonl", output), max_bytes=300, progress_callback=progress.append
+        )
+
+        assert stats.files_found == 10
+        assert stats.duplicates == 1
+        assert (stats.reviewed, stats.failed) == (2, 1)
+        assert dict(stats.skipped) == {
+            "empty": 1, "too large": 1, "excluded": 1, "generated": 1, "type": 1, "binary": 1
+        }
+        assert len(reviewer.prompts) == 3
+        assert any("```go\npackage util" in prompt for prompt in reviewer.prompts)
+
+        records = [json.loads(line) for line in output.getvalue().splitlines()]
+        paths = {record["path"] for record in records if "message" in record}
+        assert paths == {str(tmp_path / "src/app.py"), str(tmp_path / "src/copy_of_app.py"), str(tmp_path / "src/util.go")}
+        assert [record["error"] for record in records if "error" in record] == ["model error"]
+        assert progress[0].startswith("Reviewing 3 unique file(s) of 10 found")
+        assert len(progress) == 4 and "files/s" in progress[-1]
+
+    # Tests that glob targets are expanded and files are reviewed concurrently.
+    def test_glob_targets_run_concurrently(self, tmp_path):
+        for i in range(6):
+            (tmp_path / f"module_{i}.py").write_text(f"x = {i}\n")
+        reviewer = FakeCodeReviewer(delay=0.1)
+        start = time.perf_counter()
+        stats = review_repository(
+            [str(tmp_path / "*.py")], reviewer, make_renderer("markdown", io.StringIO()), max_workers=3,
+            progress_callback=lambda message: None,
+        )
+        assert stats.reviewed == 6
+        assert reviewer.max_active == 3
+        assert time.perf_counter() - start < 0.1 * 6
@@ -0,0 +1,74 @@
+import time
+
+from review_common.response_cache import ResponseCache
+
+import pytest
+
+
+class TestResponseCache:
+    @pytest.fixture(scope="function")
+    # Returns a ResponseCache stored in a temporary directory.
+    def cache(self, tmp_path):
+        return ResponseCache(cache_dir=str(tmp_path))
+
+    # Tests that identical inputs map to the same key and any change produces a new one.
+    def test_make_key(self):
+        key = ResponseCache.make_key("system", "prompt", "gpt-4", 0.7, 3000)
+        assert key == ResponseCache.make_key("system", "prompt", "gpt-4", 0.7, 3000)
+        assert key != ResponseCache.make_key("system", "prompt", "gpt-4", 0.2, 3000)
+        assert key != ResponseCache.make_key("system", "prompt!", "gpt-4", 0.7, 3000)
+
+    # Tests that a stored response is returned and hits and misses are counted.
+    def test_get_and_put(self, cache):
+        assert cache.get("key") is None
+        cache.put("key", "Great job!")
+        assert cache.get("key") == "Great job!"
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    # Tests that the cache persists across instances sharing a directory.
+    def test_persistence(self, tmp_path):
+        ResponseCache(cache_dir=str(tmp_path)).put("key", "Great job!")
+        assert ResponseCache(cache_dir=str(tmp_path)).get("key") == "Great job!"
+
+    # Tests that the least recently used entries are evicted once the size limit is exceeded.
+    def test_lru_size_eviction(self, tmp_path):
+        cache = ResponseCache(cache_dir=str(tmp_path), max_bytes=20)
+        cache.put("a", "x" * 10)
+        time.sleep(0.01)
+        cache.put("b", "x" * 10)
+        time.sleep(0.01)
+        cache.get("a")
+        cache.put("c", "x" * 10)
+        assert cache.get("a") is not None
+        assert cache.get("b") is None
+        assert cache.get("c") is not None
+
+    # Tests that entries older than max_age are treated as misses and evicted.
+    def test_age_eviction(self, tmp_path):
+        cache = ResponseCache(cache_dir=str(tmp_path), max_age=0.05)
+        cache.put("key", "Great job!")
+        time.sleep(0.1)
+        assert cache.get("key") is None
+        cache.evict()
+        assert cache.stats()["entries"] == 0
+
+    # Tests that the bypass flag skips lookups but still refreshes stored responses.
+    def test_bypass(self, tmp_path):
+        ResponseCache(cache_dir=str(tmp_path)).put("key", "old")
+        cache = ResponseCache(cache_dir=str(tmp_path), bypass=True)
+        assert cache.get("key") is None
+        cache.put("key", "new")
+        assert ResponseCache(cache_dir=str(tmp_path)).get("key") == "new"
+
+    # Tests that a reviewer returns the cached response without calling the OpenAI API.
+    def test_reviewer_uses_cache(self, cache, mocker):
+        import openai
+        from openai.openai_object import OpenAIObject
+        from local_diff_reviewer.local_diff_reviewer import LocalCodeReviewer
+
+        response = OpenAIObject.construct_from({"choices": [{"message": {"content": "Great job!"}}]})
+        create = mocker.patch.object(openai.ChatCompletion, "create", return_value=response)
+        reviewer = LocalCodeReviewer(cache=cache)
+        assert reviewer.message_reviewer("test system prompt", "test prompt") == "Great job!"
+        assert reviewer.message_reviewer("test system prompt", "test prompt") == "Great job!"
+        assert create.call_count == 1
@@ -0,0 +1,144 @@
+import http.client
+import json
+import os
+import threading
+
+import pytest
+
+from code_reviewer.code_reviewer import CodeReviewer
+from local_diff_reviewer.local_diff_reviewer import LocalCodeReviewer
+from pull_request_reviewer.pull_request_reviewer import PRReviewer
+from review_daemon.client import DaemonClient, DaemonError, read_token
+from review_daemon.daemon import ReviewService, make_server, write_token
+
+DIFF = """diff --git a/app.py b/app.py
+index 1234567..abcdefg 100644
+--- a/app.py
++++ b/app.py
+@@ -1,1 +1,1 @@
+-value = 1
++value = 2
+"""
+
+
+def make_service(client, workers=2):
+    client.reply = "- reviewed prompt\n"
+    return ReviewService(
+        CodeReviewer(client=client),
+        LocalCodeReviewer(client=client),
+        PRReviewer(client=client),
+        workers=workers,
+    )
+
+
+@pytest.fixture
+def daemon(request, fake_client):
+    service = make_service(fake_client, **getattr(request, "param", {}))
+    server = make_server(service, port=0, token="secret")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    service.start()
+    yield service, DaemonClient(url=f"http://127.0.0.1:{server.server_address[1]}", token="secret")
+    server.shutdown()
+    server.server_close()
+    service.shutdown(timeout=5)
+
+
+class TestReviewDaemon:
+
+    # Tests that code and diff jobs are reviewed and their results polled.
+    def test_submit_and_wait(self, daemon, tmp_path):
+        service, client = daemon
+        source = tmp_path / "app.py"
+        source.write_text("value = 2\n")
+        diff = tmp_path / "change.diff"
+        diff.write_text(DIFF)
+        code_job = client.submit("code", {"path": str(source), "message": "Bump value"})
+        diff_job = client.submit("diff", {"path": str(diff), "message": "Bump value"})
+        assert code_job["status"] in ("queued", "running", "done")
+        for job_id in (code_job["id"], diff_job["id"]):
+            job = client.wait(job_id, timeout=5)
+            assert job["status"] == "done"
+            assert job["result"].startswith("- reviewed prompt")
+        assert any("+value = 2" in prompt for prompt in service.client.prompts)
+        assert client.health()["jobs"]["done"] == 2
+
+    # Tests that queued jobs run in priority order and can be cancelled.
+    @pytest.mark.parametrize("daemon", [{"workers": 1}], indirect=True)
+    def test_priority_and_cancel(self, daemon, tmp_path):
+        service, client = daemon
+        source = tmp_path / "app.py"
+        source.write_text("value = 2\n")
+        service.client.release.clear()
+        blocker = client.submit("code", {"path": str(source), "message": "blocker"})
+        low = client.submit("code", {"path": str(source), "message": "low"}, priority=20)
+        high = client.submit("code", {"path": str(source), "message": "high"}, priority=1)
+        dropped = client.submit("code", {"path": str(source), "message": "dropped"}, priority=5)
+        assert client.cancel(dropped["id"])["status"] == "cancelled"
+        service.client.release.set()
+        jobs = [client.wait(job["id"], timeout=5) for job in (blocker, high, low)]
+        assert [job["status"] for job in jobs] == ["done"] * 3
+        assert jobs[1]["started"] <= jobs[2]["started"]
+        assert [p for p in service.client.prompts if "dropped" in p] == []
+        with pytest.raises(DaemonError, match="job is done"):
+            client.cancel(low["id"])
+
+    # Tests that invalid jobs and failures are reported to the client.
+    def test_errors(self, daemon, tmp_path):
+        _, client = daemon
+        with pytest.raises(DaemonError, match="unknown job kind"):
+            client.submit("lint", {})
+        with pytest.raises(DaemonError, match="absolute"):
+            client.submit("code", {"path": "app.py", "message": "m"})
+        with pytest.raises(DaemonError, match="no such job"):
+            client.status("abc123")
+        job = client.wait(client.submit("diff", {"path": str(tmp_path / "missing.diff"), "message": "m"})["id"])
+        assert job["status"] == "failed" and "missing.diff" in job["error"]
+
+    # Tests that requests without the token, or with a body a browser could send cross-origin, are rejected.
+    def test_rejects_unauthenticated_requests(self, daemon, tmp_path):
+        service, client = daemon
+        source = tmp_path / "app.py"
+        source.write_text("value = 2\n")
+        body = json.dumps({"kind": "code", "params": {"path": str(source), "message": "m"}})
+
+        def post(path, headers):
+            connection = http.client.HTTPConnection(client.url.hostname, client.url.port, timeout=5)
+            connection.request("POST", path, body=body, headers=headers)
+            response = connection.getresponse()
+            reply = json.loads(response.read())
+            connection.close()
+            return response.status, reply
+
+        assert post("/jobs", {"Content-Type": "text/plain", "Authorization": "Bearer secret"})[0] == 415
+        assert post("/shutdown", {"Content-Type": "text/plain", "Authorization": "Bearer secret"})[0] == 415
+        assert post("/jobs", {"Content-Type": "application/json"})[0] == 401
+        assert post("/jobs", {"Content-Type": "application/json", "Authorization": "Bearer wrong"})[0] == 401
+        with pytest.raises(DaemonError, match="bearer token"):
+            DaemonClient(url=client.url.geturl()).list_jobs()
+        assert service.list_jobs() == []
+        assert client.health()["workers"] == 2
+
+    # Tests that the token file is private to its owner and replaced on every run.
+    def test_write_token(self, tmp_path):
+        path = str(tmp_path / "daemon.token")
+        first = write_token(path)
+        assert os.stat(path).st_mode & 0o777 == 0o600
+        assert read_token(path) == first
+        assert write_token(path) != first
+        assert read_token(str(tmp_path / "missing")) is None
+
+    # Tests that the daemon can listen on a Unix socket.
+    def test_unix_socket(self, tmp_path, fake_client):
+        service = make_service(fake_client)
+        socket_path = str(tmp_path / "daemon.sock")
+        server = make_server(service, socket_path=socket_path)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        service.start()
+        try:
+            client = DaemonClient(socket_path=socket_path)
+            assert client.health()["workers"] == 2
+            assert client.list_jobs() == []
+        finally:
+            server.shutdown()
+            server.server_close()
+            service.shutdown(timeout=5)
@@ -0,0 +1,48 @@
+import time
+
+from openai.openai_object import OpenAIObject
+from review_common.streaming import collect_stream
+
+import openai
+
+
+def make_chunks(*deltas):
+    for delta in deltas:
+        yield OpenAIObject.construct_from({"choices": [{"delta": {"content": delta} if delta else {}}]})
+
+
+class TestStreaming:
+
+    # Tests that streamed tokens are reassembled and handed to the callback one line at a time.
+    def test_collect_stream_lines(self):
+        lines = []
+        completion = collect_stream(make_chunks(None, "- Great", " job!\n- Add", " tests", "\n", "Done"), lines.append)
+        assert completion.text == "- Great job!\n- Add tests\nDone"
+        assert lines == ["- Great job!", "- Add tests", "Done"]
+
+    # Tests that time to first token is measured from the start of the request.
+    def test_time_to_first_token(self):
+        def slow_chunks():
+            time.sleep(0.05)
+            yield from make_chunks("Great job!")
+
+        completion = collect_stream(slow_chunks(), lambda line: None, started=time.perf_counter())
+        assert completion.time_to_first_token >= 0.05
+        assert completion.total_time >= completion.time_to_first_token
+
+    # Tests that an empty stream reports no first token.
+    def test_empty_stream(self):
+        completion = collect_stream(make_chunks(), lambda line: None)
+        assert completion.text == ""
+        assert completion.time_to_first_token is None
+
+    # Tests that a reviewer requests a streamed completion and still returns the full text.
+    def test_reviewer_streams_to_callback(self, mocker):
+        from local_diff_reviewer.local_diff_reviewer import LocalCodeReviewer
+
+        create = mocker.patch.object(openai.ChatCompletion, "create", return_value=make_chunks("Great ", "job!\n"))
+        lines = []
+        result = LocalCodeReviewer().message_reviewer("test system prompt", "test prompt", progress_callback=lines.append)
+        assert result == "Great job!"
+        assert lines == ["Great job!"]
+        assert create.call_args.kwargs["stream"] is True
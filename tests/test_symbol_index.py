@@ -0,0 +1,199 @@
+import os
+
+from unidiff import PatchSet
+
+from local_diff_reviewer.local_diff_reviewer import LocalCodeReviewer
+from pull_request_reviewer.pull_request_reviewer import PRReviewer
+from review_common.git_source import run_git
+from review_common.symbol_index import CONTEXT_HEADING, SymbolIndex, extract_symbols, parse_diff_refs
+
+MODELS = '''\
+class Account:
+    """A customer account."""
+
+    def __init__(self, owner: str, balance: int = 0):
+        self.owner = owner
+        self.balance = balance
+
+    def withdraw(self, amount: int) -> int:
+        if amount > self.balance:
+            raise ValueError("insufficient funds")
+        self.balance -= amount
+        return self.balance
+
+
+def transfer(source: Account, target: Account, amount: int) -> None:
+    """Moves money between accounts.
+
+    Raises ValueError when the source cannot cover the amount.
+    """
+    source.withdraw(amount)
+    target.balance += amount
+'''
+
+SERVICE = '''\
+from bank.models import Account, transfer
+
+
+def pay(owner: str, amount: int) -> Account:
+    account = Account(owner, 100)
+    transfer(account, Account("shop"), amount)
+    return account
+
+
+def refund(account: Account, amount: int):
+    account.balance += amount
+'''
+
+DIFF = """diff --git a/bank/service.py b/bank/service.py
+--- a/bank/service.py
++++ b/bank/service.py
+@@ -4,4 +4,4 @@
+ def pay(owner: str, amount: int) -> Account:
+     account = Account(owner, 100)
+-    transfer(account, Account("shop"), amount)
++    transfer(Account("shop"), account, amount)
+     return account
+"""
+
+DEFINITION_DIFF = """diff --git a/bank/models.py b/bank/models.py
+--- a/bank/models.py
++++ b/bank/models.py
+@@ -15,2 +15,2 @@
+-def transfer(source: Account, target: Account, amount: int) -> None:
++def transfer(source: Account, target: Account, amount: int, fee: int) -> None:
+     \"\"\"Moves money between accounts.
+"""
+
+
+def write(root, path, source):
+    full_path = os.path.join(root, path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with open(full_path, "w") as source_file:
+        source_file.write(source)
+
+
+def make_index(tmp_path, **kwargs):
+    root = tmp_path / "repo"
+    write(root, "bank/__init__.py", "")
+    write(root, "bank/models.py", MODELS)
+    write(root, "bank/service.py", SERVICE)
+    index = SymbolIndex(str(root), str(tmp_path / "index"), **kwargs)
+    index.update()
+    return root, index
+
+
+class TestSymbolIndex:
+
+    # Tests that classes, methods and functions are extracted with compact summaries and call references.
+    def test_extract_symbols(self):
+        symbols, references = extract_symbols("bank/models.py", MODELS)
+        assert [(symbol.qualname, symbol.kind, symbol.start, symbol.end) for symbol in symbols] == [
+            ("Account", "class", 1, 12),
+            ("Account.__init__", "method", 4, 6),
+            ("Account.withdraw", "method", 8, 12),
+            ("transfer", "function", 15, 21),
+        ]
+        account = symbols[0].summary
+        assert '"""A customer account."""' in account
+        assert "    def withdraw(self, amount: int) -> int:" in account
+        assert "insufficient funds" not in account
+        assert symbols[3].summary.endswith('    """\n    ...')
+        assert ("withdraw", 20) in references and ("ValueError", 10) in references
+        assert extract_symbols("broken.py", "def broken(:\n") == ([], [])
+
+    # Tests that only changed lines count as references, and definitions a hunk makes are recorded.
+    def test_parse_diff_refs(self):
+        (hunk,) = parse_diff_refs(DIFF)
+        assert (hunk.path, hunk.start, hunk.end) == ("bank/service.py", 4, 7)
+        assert hunk.names == {"transfer", "Account"}
+        (hunk,) = parse_diff_refs(DEFINITION_DIFF)
+        assert hunk.defined == {"transfer"}
+
+    # Tests that updates only parse new or edited files and drop deleted ones.
+    def test_incremental_update(self, tmp_path):
+        root, index = make_index(tmp_path)
+        assert index.update().parsed == 0
+        os.utime(root / "bank/models.py", ns=(1, 1))
+        assert index.update().parsed == 0
+        write(root, "bank/service.py", SERVICE + "\n\ndef audit():\n    pass\n")
+        update = index.update()
+        assert (update.parsed, update.removed, update.symbols) == (1, 0, 7)
+        os.remove(root / "bank/service.py")
+        update = index.update()
+        assert (update.files, update.removed, update.symbols) == (2, 1, 4)
+        # A second index over the same checkout reuses what is on disk.
+        reopened = SymbolIndex(str(root), str(tmp_path / "index"))
+        assert reopened.path == index.path
+        assert reopened.update().parsed == 0
+
+    # Tests that a hunk pulls in the definitions it refers to, not the code it shows or its own file's noise.
+    def test_context_for_diff(self, tmp_path):
+        _, index = make_index(tmp_path)
+        context = index.context_for_diff(DIFF)
+        assert context.startswith(CONTEXT_HEADING)
+        assert "# bank/models.py:1 (class Account)" in context
+        assert "# bank/models.py:15 (function transfer)" in context
+        assert "Raises ValueError" in context
+        assert "refund" not in context and "def pay" not in context
+        assert "(method Account.withdraw)" not in context
+        assert index.stats.lookups == 1 and index.stats.definitions == 2
+
+    # Tests that changing a definition lists its callers elsewhere.
+    def test_callers(self, tmp_path):
+        _, index = make_index(tmp_path)
+        assert index.callers("transfer") == ([("bank/service.py", 6)], 1)
+        context = index.context_for_diff(DEFINITION_DIFF)
+        assert "- `transfer` is called from `bank/service.py:6`" in context
+        assert "(function transfer)" not in context
+
+    # Tests that context stays within the token budget.
+    def test_budget(self, tmp_path):
+        _, index = make_index(tmp_path)
+        assert index.context_for_diff(DIFF, max_tokens=0) == ""
+        context = index.context_for_diff(DIFF, max_tokens=60)
+        assert context.count("# bank/models.py") == 1
+
+    # Tests that the reviewer sends the referenced definitions along with the diff.
+    def test_reviewer_prompt(self, tmp_path, fake_client):
+        _, index = make_index(tmp_path)
+        client = fake_client
+        reviewer = LocalCodeReviewer(client=client, symbols=index)
+        reviewer.review_files(PatchSet(DIFF), "Swap the transfer arguments", raw=True)
+        (prompt,) = client.prompts
+        assert prompt.index("+    transfer(") < prompt.index(CONTEXT_HEADING)
+        assert "def transfer(source: Account, target: Account, amount: int) -> None:" in prompt
+
+    # Tests that reviews refresh the index at most once per interval, or sooner when git changes the checkout.
+    def test_refresh_interval(self, tmp_path, fake_client):
+        root = tmp_path / "repo"
+        write(root, "bank/service.py", SERVICE)
+        write(root, ".git/index", "one")
+        now = [0.0]
+        index = SymbolIndex(str(root), str(tmp_path / "index"), refresh_interval=60, clock=lambda: now[0])
+        client = fake_client
+        reviewer = LocalCodeReviewer(client=client, symbols=index)
+        reviewer.review_files(PatchSet(DIFF), "Swap the transfer arguments", raw=True)
+        assert CONTEXT_HEADING not in client.prompts[-1]
+        write(root, "bank/models.py", MODELS)
+        assert index.refresh() is None
+        now[0] = 61
+        reviewer.review_files(PatchSet(DIFF), "Swap the transfer arguments", raw=True)
+        assert "(function transfer)" in client.prompts[-1]
+        os.remove(root / "bank/models.py")
+        assert index.refresh() is None
+        write(root, ".git/index", "two")
+        assert index.refresh().removed == 1
+
+    # Tests that pull request reviews only add symbol context when the checkout is at the head under review.
+    def test_pull_request_head(self, tmp_path, fake_client):
+        root, index = make_index(tmp_path)
+        run_git(["init", "-q"], repo=str(root))
+        run_git(["add", "."], repo=str(root))
+        run_git(["-c", "user.name=t", "-c", "user.email=t@t", "commit", "-q", "-m", "Add bank"], repo=str(root))
+        head = index.revision()
+        reviewer = PRReviewer(client=fake_client, symbols=index)
+        reviewer.review_patch(PatchSet(DIFF), "Swap the transfer arguments", "", raw=True, head_sha="0" * 40)
+        assert CONTEXT_HEADING not in fake_client.prompts[-1]
+        reviewer.review_patch(PatchSet(DIFF), "Swap the transfer arguments", "", raw=True, head_sha=head)
+        assert "(function transfer)" in fake_client.prompts[-1]
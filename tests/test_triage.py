@@ -0,0 +1,115 @@
+from unidiff import PatchSet
+from local_diff_reviewer.local_diff_reviewer import LocalCodeReviewer
+from review_common.triage import DiffTriage, TriageStats
+
+
+def make_file_diff(path, added_lines):
+    body = "".join(f"+{line}\n" for line in added_lines)
+    return f"""diff --git a/{path} b/{path}
+new file mode 100644
+index 0000000..abcdefg
+--- /dev/null
++++ b/{path}
+@@ -0,0 +1,{len(added_lines)} @@
+{body}"""
+
+
+DIFF = (
+    make_file_diff("src/app.py", ["x = 1", "y = 2"])
+    + make_file_diff("frontend/package-lock.json", ["{}"])
+    + make_file_diff("vendor/lib/util.go", ["package lib"])
+    + make_file_diff("static/app.min.js", ["var a=1"])
+    + make_file_diff("api/service_pb2.py", ["# proto"])
+    + make_file_diff("src/models.py", ["# Code generated by sqlc. DO NOT EDIT.", "x = 1"])
+    + make_file_diff("src/bundle.js", ["x" * 2000])
+    + make_file_diff("src/big.py", [f"x{i} = {i}" for i in range(30)])
+    + """diff --git a/logo.png b/logo.png
+index 1234567..abcdefg 100644
+Binary files a/logo.png and b/logo.png differ
+"""
+)
+
+HAND_WRITTEN = """diff --git a/src/config.py b/src/config.py
+index 1234567..abcdefg 100644
+--- a/src/config.py
++++ b/src/config.py
+@@ -1,3 +1,3 @@
+-# Code generated by an old script. DO NOT EDIT.
++# Settings; do not edit without telling ops.
+ TIMEOUT = 30
+ RETRIES = 3
+@@ -40,2 +40,2 @@
+-KEY = ""
++KEY = "generated by the protocol buffer compiler"
+ DEBUG = False
+"""
+
+
+class TestDiffTriage:
+
+    # Tests that lockfiles, vendored trees, minified, generated, binary and oversized files are dropped.
+    def test_default_rules(self):
+        triage = DiffTriage(max_changed_lines=20)
+        kept = [file.path for file in triage.filter(PatchSet(DIFF))]
+        assert kept == ["src/app.py"]
+        assert triage.stats.files_dropped == 8
+        assert triage.stats.reasons == {
+            "excluded": 4,
+            "generated": 1,
+            "minified": 1,
+            "too large": 1,
+            "binary": 1,
+        }
+
+    # Tests that dropped lines and estimated tokens are reported.
+    def test_stats_summary(self):
+        triage = DiffTriage(max_changed_lines=20)
+        list(triage.filter(PatchSet(DIFF)))
+        assert triage.stats.lines_dropped == 1 + 1 + 1 + 1 + 2 + 1 + 30
+        assert triage.stats.tokens_dropped > 0
+        assert "kept 1 file(s) and dropped 8" in triage.stats.summary()
+
+    # Tests that custom glob and regex rules are applied on top of the defaults.
+    def test_custom_rules(self):
+        triage = DiffTriage(exclude_globs=["src/*"], exclude_patterns=[r"\.png$"], max_changed_lines=None)
+        kept = [file.path for file in triage.filter(PatchSet(DIFF))]
+        assert "src/app.py" not in kept
+        assert "logo.png" not in kept
+        assert "frontend/package-lock.json" in kept
+
+    # Tests that the triage rules can be configured through the environment.
+    def test_from_env(self, monkeypatch):
+        monkeypatch.setenv("REVIEW_EXCLUDE", "src/app.py, docs/*")
+        monkeypatch.setenv("REVIEW_MAX_FILE_LINES", "0")
+        triage = DiffTriage.from_env()
+        kept = [file.path for file in triage.filter(PatchSet(DIFF))]
+        assert "src/app.py" not in kept
+        assert "src/big.py" in kept
+
+    # Tests that one long line in an otherwise ordinary file does not mark it as minified.
+    def test_long_line_is_not_minified(self):
+        lines = [f"x{i} = {i}" for i in range(200)] + ["BLOB = '" + "a" * 1500 + "'"]
+        (file,) = PatchSet(make_file_diff("src/data.py", lines))
+        assert DiffTriage().reason(file) is None
+
+    # Tests that only markers in the new file's first lines mark it as generated.
+    def test_generated_header_only(self):
+        (file,) = PatchSet(HAND_WRITTEN)
+        assert DiffTriage().reason(file) is None
+
+    # Tests that stats passed to filter hold only that call's files, including the skipped ones.
+    def test_stats_per_call(self):
+        triage = DiffTriage(max_changed_lines=20)
+        stats = TriageStats()
+        list(triage.filter(PatchSet(DIFF), stats))
+        assert stats.files_dropped == 8 and triage.stats.files_dropped == 0
+        assert ("src/big.py", "too large") in stats.skipped
+
+    # Tests that skipped files are listed in the review output.
+    def test_skipped_files_reported(self, fake_client):
+        reviewer = LocalCodeReviewer(client=fake_client, triage=DiffTriage(max_changed_lines=20))
+        result = reviewer.review_files(PatchSet(DIFF), "Add the app", raw=True)
+        assert result.startswith(fake_client.reply)
+        assert "### Skipped files (not reviewed)" in result
+        assert "- `src/big.py` (too large)" in result and "- `logo.png` (binary)" in result
+        assert "src/app.py" not in result.split("###")[1]
@@ -0,0 +1,147 @@
+from benchmarks.fake_servers import FakeGitHubServer
+from pull_request_reviewer.pull_request_reviewer import PRReviewer
+from pull_request_reviewer.watcher import PullRequestWatcher
+from review_common.github_client import GitHubClient
+from review_common.incremental import ReviewStateStore
+from review_common.response_cache import ResponseCache
+
+
+def diff(value):
+    return f"""diff --git a/app.py b/app.py
+index 1234567..abcdefg 100644
+--- a/app.py
++++ b/app.py
+@@ -1,1 +1,1 @@
+-value = 0
++value = {value}
+"""
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_watcher(server, client, tmp_path, **kwargs):
+    client.reply = "- `app.py:1` looks fine"
+    github = GitHubClient(token="test", api_url=server.url, etag_cache=ResponseCache(cache_dir=str(tmp_path)))
+    results = []
+    watcher = PullRequestWatcher(
+        PRReviewer(client=client, github=github),
+        "o/r",
+        on_result=lambda job, review, error: results.append((job.number, job.head_sha, review, error)),
+        **kwargs,
+    )
+    return watcher, results
+
+
+class TestWatcher:
+
+    # Tests that unchanged polls are conditional requests that queue nothing.
+    def test_conditional_polls(self, tmp_path, fake_client):
+        with FakeGitHubServer() as server:
+            server.add_pull("o/r", 1, diff(1))
+            watcher, _ = make_watcher(server, fake_client, tmp_path, clock=Clock())
+            assert watcher.poll() == 1
+            assert watcher.poll() == 0
+            assert server.stats["not_modified"] == 1
+            stats = watcher.stats()
+            assert (stats["polls"], stats["not_modified"], stats["queue_depth"]) == (2, 1, 1)
+            # A 304 served to a review on the same client while a poll is in
+            # flight is not counted as an unchanged poll.
+            github = watcher.reviewer.github
+            server.add_pull("o/r", 2, diff(2))
+            other = f"{server.url}/repos/o/r/pulls?state=all"
+            github.get(other)
+            fetch = github.fetch
+
+            def fetch_during_review(url, *args):
+                fetch(other)
+                return fetch(url, *args)
+
+            github.fetch = fetch_during_review
+            assert watcher.poll() == 1
+            assert github.requests_saved == 2 and watcher.stats()["not_modified"] == 1
+            watcher.shutdown()
+
+    # Tests that a burst of pushes inside the settle window becomes one review of the last head.
+    def test_coalesce_pushes(self, tmp_path, fake_client):
+        clock = Clock()
+        client = fake_client
+        with FakeGitHubServer() as server:
+            watcher, results = make_watcher(server, client, tmp_path, settle=30, clock=clock)
+            for value in range(1, 4):
+                server.add_pull("o/r", 1, diff(value))
+                watcher.poll()
+                clock.now += 10
+                assert watcher.dispatch() == 0
+            clock.now += 30
+            assert watcher.dispatch() == 1
+            watcher.shutdown(cancel=False)
+        (prompt,) = client.prompts
+        assert "+value = 3" in prompt
+        assert results[0][2] == "- `app.py:1` looks fine"
+        stats = watcher.stats()
+        assert (stats["queued"], stats["coalesced"], stats["reviewed"], stats["cancelled"]) == (1, 2, 1, 0)
+
+    # Tests that a push during a review cancels it and only the new head's review is reported.
+    def test_cancel_stale_review(self, tmp_path, fake_client):
+        client = fake_client
+        client.release.clear()
+        with FakeGitHubServer() as server:
+            server.add_pull("o/r", 1, diff(1))
+            watcher, results = make_watcher(server, client, tmp_path, settle=0, clock=Clock())
+            watcher.poll()
+            watcher.dispatch()
+            assert client.started.wait(5)
+            server.add_pull("o/r", 1, diff(2))
+            assert watcher.poll() == 1
+            assert watcher.stats()["cancelled"] == 1
+            assert watcher.dispatch() == 1
+            # The superseded model call stops without waiting for its reply.
+            assert client.aborted.wait(5)
+            client.release.set()
+            watcher.shutdown(cancel=False)
+        (result,) = results
+        assert result[1] == watcher.heads[1]
+        stats = watcher.stats()
+        assert (stats["reviewed"], stats["cancelled"], stats["running"]) == (1, 1, 0)
+        assert stats["cancelled_seconds"] > 0
+
+    # Tests that closing a pull request drops its queued review.
+    def test_closed_pull(self, tmp_path, fake_client):
+        with FakeGitHubServer() as server:
+            server.add_pull("o/r", 1, diff(1))
+            watcher, _ = make_watcher(server, fake_client, tmp_path, clock=Clock())
+            watcher.poll()
+            server.close_pull("o/r", 1)
+            watcher.poll()
+            watcher.shutdown()
+        stats = watcher.stats()
+        assert (stats["queue_depth"], stats["cancelled"]) == (0, 1)
+        assert watcher.heads == {}
+
+    # Tests that a restarted watcher only reviews heads it has not reviewed before.
+    def test_resume_from_state(self, tmp_path, fake_client):
+        store = ReviewStateStore(str(tmp_path / "state"))
+        with FakeGitHubServer() as server:
+            server.add_pull("o/r", 1, diff(1))
+            server.add_pull("o/r", 2, diff(2))
+            watcher, _ = make_watcher(server, fake_client, tmp_path, settle=0, clock=Clock(), state_store=store)
+            watcher.poll()
+            watcher.dispatch()
+            watcher.shutdown(cancel=False)
+            assert len(fake_client.prompts) == 2
+
+            server.add_pull("o/r", 2, diff(3))
+            server.close_pull("o/r", 1)
+            restarted, results = make_watcher(server, fake_client, tmp_path, settle=0, clock=Clock(), state_store=store)
+            assert restarted.poll() == 1
+            restarted.dispatch()
+            restarted.shutdown(cancel=False)
+        assert [(number, review) for number, _, review, _ in results] == [(2, "- `app.py:1` looks fine")]
+        assert "+value = 3" in fake_client.prompts[-1]
+        assert list(store.load("watch/o/r")["reviewed"]) == ["2"]